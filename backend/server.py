@@ -1,15 +1,19 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Body, status, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta, timezone
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+import abc
 import os
 import logging
 import random
@@ -17,10 +21,26 @@ import string
 import io
 import base64
 import uuid
+import hashlib
+import hmac
+import secrets
+import socket
+import tempfile
+import fcntl
+import time
+import sys
 import pydicom
 from pydicom.dataset import Dataset
-from pydicom.uid import generate_uid
+from pydicom.multival import MultiValue
+from pydicom.uid import generate_uid, RLELossless, DeflatedExplicitVRLittleEndian, ExplicitVRLittleEndian
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+from contextlib import contextmanager
+from PIL import Image
+from cachetools import LRUCache, TTLCache
+import numpy as np
+import asyncio
 import zipfile
 import json
 
@@ -39,9 +59,146 @@ SECRET_KEY = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production'
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
+# Signed, study-scoped download URLs handed out with study manifests
+SIGNED_URL_TTL_SECONDS = int(os.environ.get('SIGNED_URL_TTL_SECONDS', 600))
+SIGNED_URL_KEY = hmac.new(SECRET_KEY.encode(), b"signed-file-url", hashlib.sha256).digest()
+
+# Authenticated principals cached per worker. A user's token_version is bumped when they are
+# deactivated or their role changes; tokens carrying an older version are rejected.
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.environ.get('PRINCIPAL_CACHE_TTL_SECONDS', 30))
+principal_cache = TTLCache(maxsize=10000, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+
+# Machine API keys ("pacs_<id>_<secret>"), stored as SHA-256 hashes. Each scope allows requests
+# whose method and matched route template (not merely the URL prefix) are listed under it.
+API_KEY_PREFIX = "pacs_"
+API_KEY_SCOPES = {
+    "studies:upload": [("POST", "/api/studies/upload")],
+    "studies:read": [
+        ("GET", "/api/studies"),
+        ("GET", "/api/studies/{study_id}")
+    ],
+    "files:read": [
+        ("GET", "/api/files/{file_id}"),
+        ("GET", "/api/files/{file_id}/metadata"),
+        ("GET", "/api/files/{file_id}/frames/{frame_number}"),
+        ("GET", "/api/files/{file_id}/pyramid"),
+        ("GET", "/api/files/{file_id}/pyramid/{scale}"),
+        ("GET", "/api/files/{file_id}/pyramid/{scale}/tiles/{column}/{row}"),
+        ("GET", "/api/studies/{study_id}/manifest"),
+        ("GET", "/api/studies/{study_id}/series"),
+        ("GET", "/api/studies/{study_id}/series/{series_uid}/volume"),
+        ("GET", "/api/studies/{study_id}/series/{series_uid}/mpr")
+    ]
+}
+api_key_cache = TTLCache(maxsize=10000, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+# Unknown keys are remembered separately, so random keys cannot evict the valid ones above
+api_key_miss_cache = TTLCache(maxsize=1000, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+
 # Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt releases the GIL, so hashing runs on a bounded thread pool off the event loop. Hashes
+# below the configured cost are upgraded on the next successful login.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', PASSWORD_HASH_WORKERS * 16))
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS
+)
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+pending_password_jobs = 0
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# CPU-bound pixel work (decoding, resampling) runs in a process pool, off the event loop
+CPU_WORKERS = int(os.environ.get('CPU_WORKERS', os.cpu_count() or 2))
+cpu_executor = ProcessPoolExecutor(max_workers=CPU_WORKERS)
+
+# Image pyramid settings (progressive loading of large single-frame images)
+PYRAMID_MODALITIES = {"MG", "CR", "DX"}
+PYRAMID_MIN_DIMENSION = int(os.environ.get('PYRAMID_MIN_DIMENSION', 2048))
+PYRAMID_SCALES = [1, 2, 4, 8]  # full, 1/2, 1/4, 1/8
+PYRAMID_TILE_SIZE = 512
+
+# Lossless transcoding at ingest, per modality, e.g. INGEST_COMPRESSION="CT=rle,MR=rle,SR=deflate,*=none"
+INGEST_COMPRESSION = {
+    modality.strip().upper(): method.strip().lower()
+    for modality, method in (
+        entry.split("=", 1) for entry in os.environ.get('INGEST_COMPRESSION', '').split(",") if "=" in entry
+    )
+}
+INGEST_COMPRESSION_SYNTAXES = {"rle": RLELossless, "deflate": DeflatedExplicitVRLittleEndian}
+
+# Study-wide metadata corrections
+METADATA_CORRECTION_FIELDS = {
+    "patient_name", "patient_id", "patient_birth_date", "patient_gender", "patient_age",
+    "study_description", "accession_number"
+}
+METADATA_CORRECTION_CONCURRENCY = CPU_WORKERS * 2
+METADATA_CORRECTION_ATTEMPTS = 3
+
+# Optional storage layout that keeps the DICOM header and the Pixel Data element in separate blobs
+SPLIT_PIXEL_STORAGE = os.environ.get('SPLIT_PIXEL_STORAGE', 'false').lower() == 'true'
+
+# Series volumes kept in memory for MPR/MIP reformatting
+VOLUME_CACHE_BYTES = int(os.environ.get('VOLUME_CACHE_MB', 1024)) * 1024 * 1024
+volume_cache = LRUCache(maxsize=VOLUME_CACHE_BYTES, getsizeof=lambda volume: volume["voxels"].nbytes)
+
+# Decoded series volumes are also written to local disk as .npy files that every worker can memory-map
+VOLUME_DISK_CACHE_DIR = Path(os.environ.get('VOLUME_DISK_CACHE_DIR', Path(tempfile.gettempdir()) / 'pacs-volume-cache'))
+VOLUME_DISK_CACHE_BYTES = int(os.environ.get('VOLUME_DISK_CACHE_MB', 10240)) * 1024 * 1024
+
+# Decoded slices shared between uvicorn workers through POSIX shared memory (0 disables)
+SHARED_PIXEL_CACHE_BYTES = int(os.environ.get('SHARED_PIXEL_CACHE_MB', 2048)) * 1024 * 1024
+SHARED_PIXEL_CACHE_INDEX = Path(os.environ.get('SHARED_PIXEL_CACHE_INDEX', Path(tempfile.gettempdir()) / 'pacs-pixel-cache.json'))
+
+# Blob storage backend for new data ("gridfs" or "local"); the local backend shards files under LOCAL_BLOB_ROOT
+BLOB_STORAGE_BACKEND = os.environ.get('BLOB_STORAGE_BACKEND', 'gridfs').lower()
+LOCAL_BLOB_ROOT = Path(os.environ.get('LOCAL_BLOB_ROOT', ROOT_DIR / 'blob_store'))
+# Orphaned blob reclamation; blobs younger than the grace period may belong to an upload in flight (0 interval disables)
+BLOB_RECONCILE_INTERVAL_HOURS = float(os.environ.get('BLOB_RECONCILE_INTERVAL_HOURS', 24))
+BLOB_ORPHAN_GRACE_HOURS = float(os.environ.get('BLOB_ORPHAN_GRACE_HOURS', 6))
+# Upper bound on the throwaway data one storage benchmark writes to each backend
+STORAGE_BENCHMARK_MAX_BYTES = int(os.environ.get('STORAGE_BENCHMARK_MAX_MB', 1024)) * 1024 * 1024
+
+# Instances as served to clients, cached on local disk in front of the blob store (0 disables)
+FILE_DISK_CACHE_DIR = Path(os.environ.get('FILE_DISK_CACHE_DIR', Path(tempfile.gettempdir()) / 'pacs-file-cache'))
+FILE_DISK_CACHE_BYTES = int(os.environ.get('FILE_DISK_CACHE_MB', 10240)) * 1024 * 1024
+
+# Background job queue
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 60))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_BASE_SECONDS = int(os.environ.get('JOB_RETRY_BASE_SECONDS', 5))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 1.0))
+# Job consumers inside each API process; set to 0 when dedicated `python -m worker` processes run
+EMBEDDED_JOB_WORKERS = int(os.environ.get('EMBEDDED_JOB_WORKERS', 1))
+# Completed jobs are kept this long for inspection; dead-lettered jobs stay until retried or removed
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+# Worklist claims. With a lease set (minutes, off by default), an assigned study without a report
+# returns to the worklist once its claim lapses; opening it in the viewer or claiming it again renews it.
+STUDY_CLAIM_LEASE_MINUTES = int(os.environ.get('STUDY_CLAIM_LEASE_MINUTES', 0))
+STUDY_CLAIM_SWEEP_SECONDS = int(os.environ.get('STUDY_CLAIM_SWEEP_SECONDS', 60))
+STUDY_CLAIM_BATCH_LIMIT = int(os.environ.get('STUDY_CLAIM_BATCH_LIMIT', 50))
+
+# Server-sent live updates from Mongo change streams (needs a replica set; clients fall back to fetching)
+LIVE_UPDATES_ENABLED = os.environ.get('LIVE_UPDATES_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LIVE_UPDATE_QUEUE_SIZE = int(os.environ.get('LIVE_UPDATE_QUEUE_SIZE', 256))
+LIVE_UPDATE_HEARTBEAT_SECONDS = int(os.environ.get('LIVE_UPDATE_HEARTBEAT_SECONDS', 15))
+
+# Reporting turnaround per study priority. The worklist is read in deadline order, so a routine
+# study climbs past newer urgent ones as its deadline approaches.
+STUDY_SLA_MINUTES = {
+    "stat": int(os.environ.get('STAT_SLA_MINUTES', 60)),
+    "urgent": int(os.environ.get('URGENT_SLA_MINUTES', 240)),
+    "routine": int(os.environ.get('ROUTINE_SLA_MINUTES', 1440))
+}
+
+# Automatic distribution of pending studies to radiologists (off: radiologists self-assign)
+AUTO_ASSIGN_ENABLED = os.environ.get('AUTO_ASSIGN_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+AUTO_ASSIGN_MAX_OPEN = int(os.environ.get('AUTO_ASSIGN_MAX_OPEN', 10))
+AUTO_ASSIGN_THROUGHPUT_HOURS = int(os.environ.get('AUTO_ASSIGN_THROUGHPUT_HOURS', 24))
+AUTO_ASSIGN_REBALANCE_SECONDS = int(os.environ.get('AUTO_ASSIGN_REBALANCE_SECONDS', 300))
+AUTO_ASSIGN_MAX_MOVES = int(os.environ.get('AUTO_ASSIGN_MAX_MOVES', 20))
+radiologist_roster_cache = TTLCache(maxsize=1, ttl=30)
 
 # Create the main app
 app = FastAPI(title="PACS System")
@@ -57,6 +214,14 @@ class UserRole:
     RADIOLOGIST = "radiologist"
     PATIENT = "patient"
 
+class StudyPriority:
+    STAT = "stat"
+    URGENT = "urgent"
+    ROUTINE = "routine"
+
+def study_sla_deadline(priority: str, uploaded_at: datetime) -> datetime:
+    return uploaded_at + timedelta(minutes=STUDY_SLA_MINUTES[priority])
+
 class User(BaseModel):
     id: str
     email: EmailStr
@@ -66,6 +231,7 @@ class User(BaseModel):
     created_at: datetime
     is_active: bool = True
     phone: Optional[str] = None
+    modalities: List[str] = []  # Radiologist reading credentials; empty means every modality
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -74,6 +240,7 @@ class UserCreate(BaseModel):
     role: str
     centre_id: Optional[str] = None
     phone: Optional[str] = None
+    modalities: List[str] = []
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -99,6 +266,22 @@ class DiagnosticCentreCreate(BaseModel):
     phone: str
     email: EmailStr
 
+class ApiKey(BaseModel):
+    id: str
+    name: str
+    prefix: str  # First characters of the key, to recognise it in listings
+    centre_id: Optional[str] = None
+    scopes: List[str]
+    created_by: str
+    created_at: datetime
+    last_used_at: Optional[datetime] = None
+    revoked: bool = False
+
+class ApiKeyCreate(BaseModel):
+    name: str
+    scopes: List[str]
+    centre_id: Optional[str] = None
+
 class DicomStudy(BaseModel):
     id: str
     study_id: Optional[str] = None  # 8-digit alphanumeric
@@ -119,6 +302,12 @@ class DicomStudy(BaseModel):
     delete_requested: bool = False
     delete_requested_at: Optional[datetime] = None
     delete_requested_by: Optional[str] = None
+    duplicate_sop_instance_uids: List[str] = []  # SOP Instance UIDs that were already stored
+    assigned_at: Optional[datetime] = None
+    claim_expires_at: Optional[datetime] = None
+    opened_at: Optional[datetime] = None  # First opened by the assigned radiologist
+    priority: str = StudyPriority.ROUTINE  # stat, urgent, routine
+    sla_deadline: Optional[datetime] = None
 
 class DicomStudyCreate(BaseModel):
     patient_name: str
@@ -208,17 +397,81 @@ class CheckoutRequest(BaseModel):
     success_url: Optional[str] = None
     cancel_url: Optional[str] = None
 
+class MetadataCorrectionJob(BaseModel):
+    id: str
+    study_id: str
+    updates: Dict[str, Any]
+    status: str  # queued, running, completed, failed
+    total_files: int
+    completed_files: int = 0
+    failed_files: int = 0
+    file_states: Dict[str, str] = {}  # file_id: pending, done, failed
+    errors: Dict[str, str] = {}
+    attempts: int = 0
+    created_by: str
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+
+class Job(BaseModel):
+    id: str
+    type: str
+    payload: Dict[str, Any]
+    priority: int
+    status: str  # queued, running, completed, dead
+    attempts: int = 0
+    max_attempts: int
+    dedupe_key: Optional[str] = None
+    pending_dedupe_key: Optional[str] = None  # dedupe_key while queued or running, unset once finished
+    run_after: datetime
+    leased_by: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    result: Optional[Any] = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+
+class StorageMigration(BaseModel):
+    id: str
+    source: str
+    target: str
+    delete_source: bool = True
+    status: str  # running, completed, failed
+    migrated: int = 0
+    failed: int = 0
+    migrated_bytes: int = 0
+    error: Optional[str] = None
+    created_by: str
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+
 # ==================== UTILITIES ====================
 
 def generate_study_id() -> str:
     """Generate 8-digit alphanumeric study ID"""
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def run_password_job(func, *args):
+    """Run a bcrypt operation on the password pool, refusing work once the queue is full"""
+    global pending_password_jobs
+    if pending_password_jobs >= PASSWORD_HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=503, detail="Too many sign-in requests, please retry shortly", headers={"Retry-After": "1"}
+        )
+    pending_password_jobs += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        pending_password_jobs -= 1
+
+async def hash_password(password: str) -> str:
+    return await run_password_job(pwd_context.hash, password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple:
+    """Return (valid, new hash or None); a new hash is produced when the stored one is below the current cost"""
+    return await run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -227,7 +480,90 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+def sign_file_url(file_id: str, study_id: str, user_id: str, revision: int, expires: int) -> str:
+    message = f"{file_id}|{study_id}|{user_id}|{revision}|{expires}".encode()
+    return hmac.new(SIGNED_URL_KEY, message, hashlib.sha256).hexdigest()
+
+def signed_file_url(file_id: str, study_id: str, user_id: str, revision: int) -> tuple:
+    """Return (URL, expiry) of a signed download link for one instance of a study.
+    
+    Expiry is rounded up to the next TTL window, so a user gets the same URL for the whole
+    window and a reverse proxy can cache it.
+    """
+    now = int(time.time())
+    expires = (now // SIGNED_URL_TTL_SECONDS + 2) * SIGNED_URL_TTL_SECONDS
+    signature = sign_file_url(file_id, study_id, user_id, revision, expires)
+    return (
+        f"/api/signed/files/{file_id}?study={study_id}&user={user_id}&revision={revision}&expires={expires}&signature={signature}",
+        expires
+    )
+
+def verify_file_signature(file_id: str, study_id: str, user_id: str, revision: int, expires: int, signature: str) -> bool:
+    """Check a signed download link without touching the database"""
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(sign_file_url(file_id, study_id, user_id, revision, expires), signature)
+
+def create_user_token(user: Dict[str, Any]) -> str:
+    """Access token carrying the claims needed to authorize requests, plus the user's token version"""
+    return create_access_token(data={
+        "sub": user["email"],
+        "uid": user["id"],
+        "role": user["role"],
+        "centre_id": user.get("centre_id"),
+        "ver": user.get("token_version", 0)
+    })
+
+def invalidate_principal(email: str):
+    principal_cache.pop(email, None)
+    # Role and activity changes also change who may receive assignments
+    radiologist_roster_cache.clear()
+
+def hash_api_key(key: str) -> str:
+    # Keys are long random strings, so a fast hash is enough (unlike passwords)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+async def get_api_key_principal(key: str, request: Request) -> User:
+    """Authenticate a machine API key from the in-process cache and enforce its scopes"""
+    key_hash = hash_api_key(key)
+    if key_hash in api_key_cache:
+        api_key = api_key_cache[key_hash]
+    elif key_hash in api_key_miss_cache:
+        api_key = None
+    else:
+        api_key = await db.api_keys.find_one({"key_hash": key_hash, "revoked": False}, {"_id": 0})
+        if api_key:
+            api_key_cache[key_hash] = api_key
+            await db.api_keys.update_one({"id": api_key["id"]}, {"$set": {"last_used_at": datetime.now(timezone.utc)}})
+        else:
+            api_key_miss_cache[key_hash] = True
+    if not api_key:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    
+    route = request.scope.get("route")
+    template = getattr(route, "path", None)
+    allowed = any(
+        (request.method, template) == entry
+        for scope in api_key["scopes"] for entry in API_KEY_SCOPES.get(scope, [])
+    )
+    if not allowed:
+        raise HTTPException(status_code=403, detail="API key scope does not allow this request")
+    
+    # Machine clients act as technicians of the key's centre
+    return User.model_construct(
+        id=api_key["id"],
+        email=f"{api_key['id']}@api-key",
+        name=api_key["name"],
+        role=UserRole.TECHNICIAN,
+        centre_id=api_key.get("centre_id"),
+        created_at=api_key["created_at"],
+        is_active=True,
+        phone=None
+    )
+
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+    if credentials.credentials.startswith(API_KEY_PREFIX):
+        return await get_api_key_principal(credentials.credentials, request)
     try:
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -235,11 +571,24 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
         
-        user_data = await db.users.find_one({"email": email})
+        # Served from the principal cache while the token's version is current; tokens issued
+        # before versioning (no "ver" claim) are checked against the database as before
+        version = payload.get("ver")
+        cached = principal_cache.get(email)
+        if cached and version is not None and cached[0] == version:
+            return cached[1]
+        
+        user_data = await db.users.find_one({"email": email}, {"password": 0})
         if user_data is None:
             raise HTTPException(status_code=401, detail="User not found")
+        if version is not None and version != user_data.get("token_version", 0):
+            raise HTTPException(status_code=401, detail="Session is no longer valid, please sign in again")
+        if not user_data.get("is_active", True):
+            raise HTTPException(status_code=403, detail="Account is deactivated")
         
-        return User(**user_data)
+        user = User(**user_data)
+        principal_cache[email] = (user_data.get("token_version", 0), user)
+        return user
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
@@ -294,57 +643,2195 @@ def extract_dicom_metadata(file_data: bytes) -> Dict[str, Any]:
             "institution_address": str(getattr(ds, 'InstitutionAddress', ''))
         }
         
-        # Calculate patient age if birth date is available and age is not
-        if metadata["patient_birth_date"] and not metadata["patient_age"]:
+        # Calculate patient age if birth date is available and age is not
+        if metadata["patient_birth_date"] and not metadata["patient_age"]:
+            try:
+                from datetime import datetime
+                birth_date = datetime.strptime(metadata["patient_birth_date"], "%Y%m%d")
+                study_date = datetime.strptime(metadata["study_date"], "%Y%m%d") if metadata["study_date"] else datetime.now()
+                age = study_date.year - birth_date.year
+                if study_date.month < birth_date.month or (study_date.month == birth_date.month and study_date.day < birth_date.day):
+                    age -= 1
+                metadata["calculated_age"] = age
+            except Exception:
+                metadata["calculated_age"] = None
+        
+        return metadata
+        
+    except Exception as e:
+        logging.error(f"Failed to extract DICOM metadata: {str(e)}")
+        return {}
+
+def apply_metadata_updates(ds: Dataset, patient_updates: Dict[str, Any]):
+    """Apply patient/study field updates to a parsed dataset"""
+    # Update patient information if provided
+    if "patient_name" in patient_updates:
+        ds.PatientName = patient_updates["patient_name"]
+    if "patient_id" in patient_updates:
+        ds.PatientID = patient_updates["patient_id"]
+    if "patient_birth_date" in patient_updates:
+        ds.PatientBirthDate = patient_updates["patient_birth_date"]
+    if "patient_gender" in patient_updates:
+        ds.PatientSex = patient_updates["patient_gender"]
+    if "patient_age" in patient_updates:
+        ds.PatientAge = patient_updates["patient_age"]
+        
+    # Update study information if provided
+    if "study_description" in patient_updates:
+        ds.StudyDescription = patient_updates["study_description"]
+    if "accession_number" in patient_updates:
+        ds.AccessionNumber = patient_updates["accession_number"]
+
+def modify_dicom_metadata(file_data: bytes, patient_updates: Dict[str, Any]) -> bytes:
+    """Modify DICOM file metadata with updated patient information"""
+    try:
+        # Parse DICOM data with force=True to handle files without proper DICM header
+        ds = pydicom.dcmread(io.BytesIO(file_data), force=True)
+        apply_metadata_updates(ds, patient_updates)
+            
+        # Save modified DICOM to bytes
+        output = io.BytesIO()
+        ds.save_as(output)
+        return output.getvalue()
+        
+    except Exception as e:
+        logging.error(f"Failed to modify DICOM metadata: {str(e)}")
+        return file_data  # Return original if modification fails
+
+def rewrite_dicom_header(header_data: bytes, patient_updates: Dict[str, Any]) -> bytes:
+    """Re-encode a header (everything before Pixel Data) with updates; the pixel bytes are untouched"""
+    ds = pydicom.dcmread(io.BytesIO(header_data), force=True)
+    if 0x7FE00010 in ds:
+        raise ValueError("Header bytes must not include Pixel Data")
+    apply_metadata_updates(ds, patient_updates)
+    output = io.BytesIO()
+    ds.save_as(output)
+    return output.getvalue()
+
+def rewrite_dicom_object(file_data: bytes, patient_updates: Dict[str, Any]) -> bytes:
+    """Re-encode a complete object with updates, for objects whose header cannot be rewritten on its own"""
+    ds = pydicom.dcmread(io.BytesIO(file_data), force=True)
+    apply_metadata_updates(ds, patient_updates)
+    output = io.BytesIO()
+    ds.save_as(output)
+    return output.getvalue()
+
+async def run_cpu_bound(func, *args):
+    """Run a CPU-heavy function in the process pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, func, *args)
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one execution whose result every caller shares.
+    
+    The work runs as its own task, so a caller that disconnects does not cancel it for the
+    others. Only in-flight calls are shared; nothing is cached once the work has finished.
+    """
+    
+    def __init__(self):
+        self.in_flight: Dict[Any, asyncio.Task] = {}
+        self.stats = {"executions": 0, "coalesced": 0}
+    
+    async def do(self, key, func, *args):
+        task = self.in_flight.get(key)
+        if task:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["executions"] += 1
+            task = asyncio.ensure_future(func(*args))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+single_flight = SingleFlight()
+
+def _first_value(value, default=None):
+    """Return the first item of a multi-valued DICOM element"""
+    if value is None or value == '':
+        return default
+    if isinstance(value, (list, tuple, MultiValue)):
+        return value[0] if len(value) else default
+    return value
+
+def _optional_float(value) -> Optional[float]:
+    return float(value) if value not in (None, '') else None
+
+def render_display_pixels(ds: Dataset) -> np.ndarray:
+    """Convert the first frame of a DICOM image to 8-bit display pixels using its default window"""
+    pixels = ds.pixel_array
+    if int(getattr(ds, 'NumberOfFrames', 1) or 1) > 1:
+        pixels = pixels[0]
+    
+    # Colour images are only rescaled to 8 bits
+    if int(getattr(ds, 'SamplesPerPixel', 1) or 1) > 1:
+        if pixels.dtype != np.uint8:
+            pixels = (pixels.astype(np.float32) * 255.0 / max(float(pixels.max()), 1.0)).astype(np.uint8)
+        return pixels
+    
+    slope = float(_first_value(getattr(ds, 'RescaleSlope', None), 1) or 1)
+    intercept = float(_first_value(getattr(ds, 'RescaleIntercept', None), 0) or 0)
+    pixels = pixels.astype(np.float32) * slope + intercept
+    
+    center = _first_value(getattr(ds, 'WindowCenter', None))
+    width = _first_value(getattr(ds, 'WindowWidth', None))
+    invert = str(getattr(ds, 'PhotometricInterpretation', '')) == "MONOCHROME1"
+    return apply_window(pixels, center, width, invert)
+
+def apply_window(pixels: np.ndarray, center=None, width=None, invert: bool = False) -> np.ndarray:
+    """Map modality values to 8-bit display values; without a window the full range is used"""
+    if center is not None and width:
+        low = float(center) - float(width) / 2
+        high = float(center) + float(width) / 2
+    else:
+        low, high = float(pixels.min()), float(pixels.max())
+    
+    pixels = np.clip((pixels.astype(np.float32) - low) / max(high - low, 1e-6), 0.0, 1.0) * 255.0
+    if invert:
+        pixels = 255.0 - pixels
+    return pixels.astype(np.uint8)
+
+def needs_image_pyramid(file_data: bytes) -> bool:
+    """Check from the header whether an image is a large single-frame image worth a pyramid"""
+    try:
+        ds = pydicom.dcmread(io.BytesIO(file_data), force=True, stop_before_pixels=True)
+    except Exception:
+        return False
+    if str(getattr(ds, 'Modality', '')).upper() not in PYRAMID_MODALITIES:
+        return False
+    if int(getattr(ds, 'NumberOfFrames', 1) or 1) > 1:
+        return False
+    return max(int(getattr(ds, 'Rows', 0) or 0), int(getattr(ds, 'Columns', 0) or 0)) >= PYRAMID_MIN_DIMENSION
+
+def build_image_pyramid(file_data: bytes) -> List[Dict[str, Any]]:
+    """Render PNG levels (full, 1/2, 1/4, 1/8) of a single-frame DICOM image.
+    
+    Levels are 8-bit previews with the default window applied; diagnostic
+    reading still uses the original DICOM file.
+    """
+    ds = pydicom.dcmread(io.BytesIO(file_data), force=True)
+    image = Image.fromarray(render_display_pixels(ds))
+    
+    levels = []
+    for scale in PYRAMID_SCALES:
+        if scale > 1:
+            image = image.reduce(2)  # Each level halves the previous one
+        output = io.BytesIO()
+        image.save(output, format="PNG")
+        levels.append({
+            "scale": scale,
+            "width": image.width,
+            "height": image.height,
+            "data": output.getvalue()
+        })
+    return levels
+
+def crop_pyramid_tile(level_data: bytes, column: int, row: int, tile_size: int) -> bytes:
+    """Cut a single tile out of a PNG pyramid level"""
+    image = Image.open(io.BytesIO(level_data))
+    left, top = column * tile_size, row * tile_size
+    if left >= image.width or top >= image.height:
+        raise ValueError("Tile outside image bounds")
+    tile = image.crop((left, top, min(left + tile_size, image.width), min(top + tile_size, image.height)))
+    output = io.BytesIO()
+    tile.save(output, format="PNG")
+    return output.getvalue()
+
+async def generate_image_pyramid(file_id: str, study_id: str, file_data: bytes):
+    """Build and store the pyramid of a freshly ingested image (runs on the job queue)"""
+    if not needs_image_pyramid(file_data):
+        return
+    
+    try:
+        levels = await run_cpu_bound(build_image_pyramid, file_data)
+        
+        stored_levels = []
+        for level in levels:
+            level_file_id = await blob_storage.put(
+                f"{file_id}_pyramid_{level['scale']}.png",
+                level["data"],
+                metadata={"pyramid_of": file_id, "scale": level["scale"], "content_type": "image/png"}
+            )
+            stored_levels.append({
+                "scale": level["scale"],
+                "width": level["width"],
+                "height": level["height"],
+                "file_id": str(level_file_id),
+                "size": len(level["data"])
+            })
+        
+        await db.image_pyramids.update_one(
+            {"file_id": file_id},
+            {"$set": {
+                "file_id": file_id,
+                "study_id": study_id,
+                "tile_size": PYRAMID_TILE_SIZE,
+                "width": stored_levels[0]["width"],
+                "height": stored_levels[0]["height"],
+                "levels": stored_levels,
+                "created_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+    except Exception as e:
+        logging.error(f"Failed to build image pyramid for {file_id}: {str(e)}")
+
+def extract_instance_geometry(file_data: bytes) -> Dict[str, Any]:
+    """Read the identifiers and geometry needed to place an instance within its series"""
+    ds = pydicom.dcmread(io.BytesIO(file_data), force=True, stop_before_pixels=True)
+    
+    def floats(name, count):
+        value = getattr(ds, name, None)
+        if value is None or len(value) != count:
+            return None
+        return [float(v) for v in value]
+    
+    instance_number = getattr(ds, 'InstanceNumber', None)
+    slice_thickness = getattr(ds, 'SliceThickness', None)
+    return {
+        "sop_instance_uid": str(getattr(ds, 'SOPInstanceUID', '')),
+        "series_instance_uid": str(getattr(ds, 'SeriesInstanceUID', '')),
+        "modality": str(getattr(ds, 'Modality', '')),
+        "instance_number": int(instance_number) if instance_number not in (None, '') else None,
+        "image_position": floats('ImagePositionPatient', 3),
+        "image_orientation": floats('ImageOrientationPatient', 6),
+        "pixel_spacing": floats('PixelSpacing', 2),
+        "slice_thickness": float(slice_thickness) if slice_thickness not in (None, '') else None,
+        "rows": int(getattr(ds, 'Rows', 0) or 0),
+        "columns": int(getattr(ds, 'Columns', 0) or 0),
+        "number_of_frames": int(getattr(ds, 'NumberOfFrames', 1) or 1)
+    }
+
+# Media types for single frames of common encapsulated transfer syntaxes
+FRAME_MEDIA_TYPES = {
+    "1.2.840.10008.1.2.4.50": "image/jpeg",
+    "1.2.840.10008.1.2.4.51": "image/jpeg",
+    "1.2.840.10008.1.2.4.57": "image/jpeg",
+    "1.2.840.10008.1.2.4.70": "image/jpeg",
+    "1.2.840.10008.1.2.4.80": "image/jls",
+    "1.2.840.10008.1.2.4.81": "image/jls",
+    "1.2.840.10008.1.2.4.90": "image/jp2",
+    "1.2.840.10008.1.2.4.91": "image/jp2",
+}
+
+def _parse_fragment_items(file_data: bytes, value_offset: int) -> tuple:
+    """Walk the items of encapsulated Pixel Data. Returns (Basic Offset Table, [(item offset, data offset, length)])"""
+    position = value_offset
+    items = []
+    while position + 8 <= len(file_data):
+        group, element, length = np.frombuffer(file_data, dtype="<u2", count=2, offset=position).tolist() + \
+            np.frombuffer(file_data, dtype="<u4", count=1, offset=position + 4).tolist()
+        if (group, element) == (0xFFFE, 0xE0DD):  # Sequence delimiter
+            break
+        if (group, element) != (0xFFFE, 0xE000):
+            raise ValueError(f"Unexpected tag ({group:04X},{element:04X}) in encapsulated pixel data")
+        items.append((position, position + 8, length))
+        position += 8 + length
+    
+    if not items:
+        raise ValueError("Encapsulated pixel data has no Basic Offset Table item")
+    _, bot_offset, bot_length = items[0]
+    offsets = np.frombuffer(file_data, dtype="<u4", count=bot_length // 4, offset=bot_offset).tolist() if bot_length else []
+    return offsets, items[1:]
+
+def _is_deflated(ds: Dataset) -> bool:
+    file_meta = getattr(ds, 'file_meta', None)
+    return bool(file_meta) and file_meta.get('TransferSyntaxUID') == DeflatedExplicitVRLittleEndian
+
+def compress_for_storage(file_data: bytes, policy: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Losslessly transcode an uncompressed instance according to the per-modality policy.
+    
+    Returns the stored bytes and the measured sizes, or None when the policy says no, the
+    object is already compressed, encoding is not supported or the result is not smaller.
+    """
+    ds = pydicom.dcmread(io.BytesIO(file_data), force=True)
+    modality = str(getattr(ds, 'Modality', '')).upper()
+    method = policy.get(modality, policy.get("*", "none"))
+    target = INGEST_COMPRESSION_SYNTAXES.get(method)
+    file_meta = getattr(ds, 'file_meta', None)
+    if not target or not file_meta or 'TransferSyntaxUID' not in file_meta:
+        return None
+    
+    original_syntax = file_meta.TransferSyntaxUID
+    if original_syntax.is_compressed or original_syntax == target:
+        return None
+    
+    try:
+        if target == RLELossless:
+            if 0x7FE00010 not in ds:
+                return None
+            ds.compress(RLELossless)
+        else:
+            ds.file_meta.TransferSyntaxUID = DeflatedExplicitVRLittleEndian
+        stored = _dataset_bytes(ds)
+    except Exception as e:
+        logging.warning(f"Lossless {method} transcoding skipped: {str(e)}")
+        return None
+    
+    if len(stored) >= len(file_data):
+        return None
+    return {
+        "data": stored,
+        "modality": modality,
+        "method": method,
+        "original_transfer_syntax": str(original_syntax),
+        "stored_transfer_syntax": str(target),
+        "original_size": len(file_data),
+        "stored_size": len(stored),
+        "ratio": round(len(file_data) / len(stored), 3)
+    }
+
+def decompress_from_storage(file_data: bytes, original_transfer_syntax: str) -> bytes:
+    """Transcode an instance stored with RLE/deflate back to the transfer syntax it was uploaded in"""
+    ds = pydicom.dcmread(io.BytesIO(file_data), force=True)
+    if ds.file_meta.TransferSyntaxUID == RLELossless:
+        ds.decompress()
+    ds.file_meta.TransferSyntaxUID = pydicom.uid.UID(original_transfer_syntax)
+    return _dataset_bytes(ds)
+
+def _dataset_bytes(ds: Dataset) -> bytes:
+    output = io.BytesIO()
+    ds.save_as(output)
+    return output.getvalue()
+
+def accepts_transfer_syntax(accept_header: Optional[str], requested: Optional[str], transfer_syntax: str) -> bool:
+    """Whether a client asked for (or accepts any) transfer syntax, DICOMweb style:
+    `Accept: application/dicom; transfer-syntax=*` or a `transfer_syntax` query parameter"""
+    accepted = {requested} if requested else set()
+    for media_range in (accept_header or "").split(","):
+        for parameter in media_range.split(";")[1:]:
+            name, _, value = parameter.strip().partition("=")
+            if name.strip().lower() == "transfer-syntax":
+                accepted.add(value.strip().strip('"'))
+    return "*" in accepted or transfer_syntax in accepted
+
+def find_pixel_data_offset(file_data: bytes) -> Optional[int]:
+    """Byte offset where the top-level Pixel Data element (its tag) starts, or None"""
+    try:
+        ds = pydicom.dcmread(io.BytesIO(file_data), force=True, defer_size=1024)
+    except Exception:
+        return None
+    if 0x7FE00010 not in ds or _is_deflated(ds):
+        return None
+    
+    pixel_element = ds.get_item(0x7FE00010, keep_deferred=True)
+    value_offset = getattr(pixel_element, 'value_tell', None) or pixel_element.file_tell
+    tag_bytes = b"\xe0\x7f\x10\x00"
+    if file_data[value_offset - 12:value_offset - 8] == tag_bytes and file_data[value_offset - 8:value_offset - 6] in (b"OB", b"OW"):
+        return value_offset - 12  # Explicit VR: tag, VR, reserved, 4-byte length
+    if file_data[value_offset - 8:value_offset - 4] == tag_bytes:
+        return value_offset - 8  # Implicit VR: tag, 4-byte length
+    return None
+
+def build_frame_index(file_data: bytes) -> Optional[Dict[str, Any]]:
+    """Locate every frame's bytes within the file so frames can be range-read from storage.
+    
+    Native pixel data is split by frame size. Encapsulated fragments are grouped into frames
+    with the Basic (or Extended) Offset Table, or by scanning fragments when both are empty.
+    Frames are lists of [offset, length] byte ranges relative to the start of the file.
+    """
+    ds = pydicom.dcmread(io.BytesIO(file_data), force=True, defer_size=1024)
+    if 0x7FE00010 not in ds or _is_deflated(ds):
+        return None  # Element positions in a deflated file refer to the inflated stream
+    
+    pixel_element = ds.get_item(0x7FE00010, keep_deferred=True)
+    value_offset = getattr(pixel_element, 'value_tell', None) or pixel_element.file_tell
+    transfer_syntax = ds.file_meta.TransferSyntaxUID if hasattr(ds, 'file_meta') and 'TransferSyntaxUID' in ds.file_meta else pydicom.uid.ImplicitVRLittleEndian
+    number_of_frames = int(getattr(ds, 'NumberOfFrames', 1) or 1)
+    index = {
+        "transfer_syntax_uid": str(transfer_syntax),
+        "encapsulated": transfer_syntax.is_encapsulated,
+        "number_of_frames": number_of_frames
+    }
+    
+    if not transfer_syntax.is_encapsulated:
+        bits_allocated = int(getattr(ds, 'BitsAllocated', 0) or 0)
+        if bits_allocated % 8:
+            return None  # Bit-packed frames do not start on byte boundaries
+        frame_length = int(ds.Rows) * int(ds.Columns) * int(getattr(ds, 'SamplesPerPixel', 1) or 1) * bits_allocated // 8
+        index["frames"] = [[[value_offset + i * frame_length, frame_length]] for i in range(number_of_frames)]
+        return index
+    
+    offsets, fragments = _parse_fragment_items(file_data, value_offset)
+    if not offsets and 'ExtendedOffsetTable' in ds:
+        offsets = np.frombuffer(ds.ExtendedOffsetTable, dtype="<u8").tolist()
+    
+    first_item = fragments[0][0] if fragments else 0
+    if len(offsets) == number_of_frames and offsets:
+        # Offset table entries are relative to the first fragment's item tag
+        boundaries = offsets + [float("inf")]
+        frames = [
+            [[data, length] for item, data, length in fragments if boundaries[i] <= item - first_item < boundaries[i + 1]]
+            for i in range(number_of_frames)
+        ]
+    elif len(fragments) == number_of_frames:
+        frames = [[[data, length]] for _, data, length in fragments]
+    elif number_of_frames == 1:
+        frames = [[[data, length] for _, data, length in fragments]]
+    else:
+        # Without an offset table a new frame starts at a fragment opening with a JPEG/J2K start marker
+        frames = []
+        for _, data, length in fragments:
+            if file_data[data:data + 2] in (b"\xff\xd8", b"\xff\x4f") or not frames:
+                frames.append([])
+            frames[-1].append([data, length])
+        if len(frames) != number_of_frames:
+            return None
+    
+    index["frames"] = frames
+    return index
+
+async def index_instance(file_id: str, study_id: str, file_data: bytes, compression: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Record an instance in the instance geometry index (with its ingest compression, if any).
+    
+    Returns the SOP Instance UID when another stored instance already carries it.
+    """
+    try:
+        geometry = extract_instance_geometry(file_data)
+    except Exception as e:
+        logging.warning(f"Could not index instance {file_id}: {str(e)}")
+        return None
+    
+    try:
+        frame_index = build_frame_index(file_data)
+    except Exception as e:
+        logging.warning(f"Could not build frame index for {file_id}: {str(e)}")
+        frame_index = None
+    
+    await db.instances.update_one(
+        {"file_id": file_id},
+        {"$set": {
+            "file_id": file_id,
+            "study_id": study_id,
+            **geometry,
+            "frame_index": frame_index,
+            "header_length": find_pixel_data_offset(file_data),
+            "size": len(file_data),
+            **({"compression": compression} if compression else {}),
+            "indexed_at": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+    
+    sop_instance_uid = geometry["sop_instance_uid"]
+    if not sop_instance_uid:
+        return None
+    existing = await db.instances.find_one(
+        {"sop_instance_uid": sop_instance_uid, "file_id": {"$ne": file_id}}, {"file_id": 1, "study_id": 1}
+    )
+    if not existing:
+        return None
+    logging.warning(
+        f"Instance {file_id} repeats SOP Instance UID {sop_instance_uid} "
+        f"already stored as {existing['file_id']} (study {existing.get('study_id')})"
+    )
+    await db.instances.update_one({"file_id": file_id}, {"$set": {"duplicate_of": existing["file_id"]}})
+    return sop_instance_uid
+
+async def get_study_instances(study: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the instance index of a study, indexing files uploaded before the index existed"""
+    study_id = study.get("study_id") or study.get("id")
+    file_ids = study.get("file_ids", [])
+    instances = await db.instances.find({"file_id": {"$in": file_ids}}, {"_id": 0}).to_list(None)
+    
+    indexed = {instance["file_id"] for instance in instances}
+    for file_id in file_ids:
+        if file_id in indexed:
+            continue
+        try:
+            await index_instance(file_id, study_id, await read_instance(file_id))
+        except Exception:
+            continue
+        instance = await db.instances.find_one({"file_id": file_id}, {"_id": 0})
+        if instance:
+            instances.append(instance)
+    
+    return instances
+
+# ==================== BLOB STORAGE ====================
+# Every stored byte (whole instances, header and pixel blobs, pyramid levels) goes through a
+# blob store. Blob ids are ObjectId strings whichever backend holds them. New blobs go to the
+# configured backend; reads fall back to the other backends so data can be migrated online.
+
+class BlobStore(abc.ABC):
+    """Interface of a blob storage backend"""
+    name = None
+    
+    @abc.abstractmethod
+    async def put(self, filename: str, data: bytes, metadata: Optional[Dict[str, Any]] = None, blob_id: Optional[str] = None) -> str:
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    async def get(self, blob_id: str) -> bytes:
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    async def read_range(self, blob_id: str, start: int, length: int) -> bytes:
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    async def stat(self, blob_id: str) -> Optional[Dict[str, Any]]:
+        """filename, length and metadata of a blob, or None when this backend does not hold it"""
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    async def filenames(self, blob_ids: List[str]) -> Dict[str, str]:
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    async def delete(self, blob_id: str):
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    async def delete_many(self, blob_ids: List[str]):
+        """Delete every listed blob this backend holds; ids it does not hold are ignored"""
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    async def lengths(self, blob_ids: List[str]) -> Dict[str, int]:
+        """Sizes of the listed blobs this backend holds"""
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    async def reclaim_untracked(self, older_than: datetime, dry_run: bool) -> Dict[str, int]:
+        """Remove stored bytes that no blob record owns (e.g. left by a crashed write)"""
+        raise NotImplementedError
+    
+    @abc.abstractmethod
+    def list_ids(self, batch_size: int = 500):
+        """Async iterator over the ids of every blob held by this backend"""
+        raise NotImplementedError
+    
+    def local_path(self, blob_id: str) -> Optional[str]:
+        """Path of the blob on local disk, when the backend can serve it as a plain file"""
+        return None
+
+class GridFSBlobStore(BlobStore):
+    """Blobs as GridFS files (255 KB chunk documents in MongoDB)"""
+    name = "gridfs"
+    
+    def __init__(self, database, bucket):
+        self.db = database
+        self.bucket = bucket
+    
+    async def put(self, filename, data, metadata=None, blob_id=None):
+        from bson import ObjectId
+        if blob_id:
+            await self.bucket.upload_from_stream_with_id(ObjectId(blob_id), filename, io.BytesIO(data), metadata=metadata)
+            return blob_id
+        return str(await self.bucket.upload_from_stream(filename, io.BytesIO(data), metadata=metadata))
+    
+    async def get(self, blob_id):
+        from bson import ObjectId
+        from gridfs.errors import NoFile
+        try:
+            grid_out = await self.bucket.open_download_stream(ObjectId(blob_id))
+        except NoFile:
+            raise FileNotFoundError(f"Blob {blob_id} not found")
+        return await grid_out.read()
+    
+    async def read_range(self, blob_id, start, length):
+        """Fetch only the chunks that cover the range"""
+        from bson import ObjectId
+        object_id = ObjectId(blob_id)
+        file_doc = await self.db["fs.files"].find_one({"_id": object_id}, {"chunkSize": 1, "length": 1})
+        if not file_doc:
+            raise FileNotFoundError(f"Blob {blob_id} not found")
+        if start < 0 or start + length > file_doc["length"]:
+            raise ValueError("Requested range lies outside the blob")
+        
+        chunk_size = file_doc["chunkSize"]
+        first_chunk, last_chunk = start // chunk_size, (start + length - 1) // chunk_size
+        chunks = await self.db["fs.chunks"].find(
+            {"files_id": object_id, "n": {"$gte": first_chunk, "$lte": last_chunk}},
+            {"data": 1}
+        ).sort("n", 1).to_list(None)
+        
+        data = b"".join(bytes(chunk["data"]) for chunk in chunks)
+        offset = start - first_chunk * chunk_size
+        return data[offset:offset + length]
+    
+    async def stat(self, blob_id):
+        from bson import ObjectId
+        file_doc = await self.db["fs.files"].find_one({"_id": ObjectId(blob_id)}, {"filename": 1, "length": 1, "metadata": 1})
+        if not file_doc:
+            return None
+        return {"filename": file_doc.get("filename"), "length": file_doc["length"], "metadata": file_doc.get("metadata")}
+    
+    async def filenames(self, blob_ids):
+        from bson import ObjectId
+        files = await self.db["fs.files"].find(
+            {"_id": {"$in": [ObjectId(blob_id) for blob_id in blob_ids]}}, {"filename": 1}
+        ).to_list(None)
+        return {str(f["_id"]): f.get("filename") for f in files}
+    
+    async def delete(self, blob_id):
+        from bson import ObjectId
+        from gridfs.errors import NoFile
+        try:
+            await self.bucket.delete(ObjectId(blob_id))
+        except NoFile:
+            raise FileNotFoundError(f"Blob {blob_id} not found")
+    
+    async def delete_many(self, blob_ids):
+        """Delete files and their chunks with one bulk delete each per batch, not one round trip per chunk"""
+        from bson import ObjectId
+        object_ids = [ObjectId(blob_id) for blob_id in blob_ids]
+        for start in range(0, len(object_ids), 1000):
+            batch = object_ids[start:start + 1000]
+            await self.db["fs.files"].delete_many({"_id": {"$in": batch}})
+            await self.db["fs.chunks"].delete_many({"files_id": {"$in": batch}})
+    
+    async def lengths(self, blob_ids):
+        from bson import ObjectId
+        files = await self.db["fs.files"].find(
+            {"_id": {"$in": [ObjectId(blob_id) for blob_id in blob_ids]}}, {"length": 1}
+        ).to_list(None)
+        return {str(f["_id"]): f["length"] for f in files}
+    
+    async def reclaim_untracked(self, older_than, dry_run):
+        """Chunks whose fs.files document is gone. Recent chunks may belong to an upload still in progress.
+        
+        Orphans are found on the files_id index alone (a distinct scan compared against fs.files ids);
+        chunk data is only read to size the orphans themselves.
+        """
+        from bson import ObjectId
+        report = {"files": 0, "bytes": 0}
+        
+        async def sweep(files_ids):
+            known = {f["_id"] for f in await self.db["fs.files"].find({"_id": {"$in": files_ids}}, {"_id": 1}).to_list(None)}
+            orphan_ids = [files_id for files_id in files_ids if files_id not in known]
+            if not orphan_ids:
+                return
+            sizes = await self.db["fs.chunks"].aggregate([
+                {"$match": {"files_id": {"$in": orphan_ids}}},
+                {"$group": {"_id": None, "bytes": {"$sum": {"$binarySize": "$data"}}}}
+            ]).to_list(None)
+            report["files"] += len(orphan_ids)
+            report["bytes"] += sizes[0]["bytes"] if sizes else 0
+            if not dry_run:
+                await self.db["fs.chunks"].delete_many({"files_id": {"$in": orphan_ids}})
+        
+        batch = []
+        async for group in self.db["fs.chunks"].aggregate([
+            {"$match": {"files_id": {"$lt": ObjectId.from_datetime(older_than)}}},
+            {"$sort": {"files_id": 1}},
+            {"$group": {"_id": "$files_id"}}
+        ]):
+            batch.append(group["_id"])
+            if len(batch) >= 1000:
+                await sweep(batch)
+                batch = []
+        if batch:
+            await sweep(batch)
+        return report
+    
+    async def list_ids(self, batch_size=500):
+        async for file_doc in self.db["fs.files"].find({}, {"_id": 1}).batch_size(batch_size):
+            yield str(file_doc["_id"])
+
+class LocalBlobStore(BlobStore):
+    """Blobs as plain files on local disk, sharded into two directory levels by the end of the id.
+    
+    File names and metadata live in the local_blobs collection so listing and lookups never
+    walk the directory tree. Files are written to a temporary name and renamed into place.
+    """
+    name = "local"
+    
+    def __init__(self, database, root: Path):
+        self.db = database
+        self.root = Path(root)
+    
+    def _path(self, blob_id: str) -> Path:
+        # ObjectIds start with a timestamp; the trailing counter spreads files evenly
+        return self.root / blob_id[-2:] / blob_id[-4:-2] / blob_id
+    
+    def _write(self, path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def _read(self, path: Path, start: int = 0, length: Optional[int] = None) -> bytes:
+        with open(path, "rb") as f:
+            if length is None:
+                return f.read()
+            size = os.fstat(f.fileno()).st_size
+            if start < 0 or start + length > size:
+                raise ValueError("Requested range lies outside the blob")
+            f.seek(start)
+            return f.read(length)
+    
+    async def put(self, filename, data, metadata=None, blob_id=None):
+        from bson import ObjectId
+        blob_id = blob_id or str(ObjectId())
+        await asyncio.to_thread(self._write, self._path(blob_id), data)
+        await self.db.local_blobs.replace_one(
+            {"_id": blob_id},
+            {"filename": filename, "length": len(data), "metadata": metadata, "uploaded_at": datetime.now(timezone.utc)},
+            upsert=True
+        )
+        return blob_id
+    
+    async def get(self, blob_id):
+        return await asyncio.to_thread(self._read, self._path(blob_id))
+    
+    async def read_range(self, blob_id, start, length):
+        return await asyncio.to_thread(self._read, self._path(blob_id), start, length)
+    
+    async def stat(self, blob_id):
+        doc = await self.db.local_blobs.find_one({"_id": blob_id})
+        if not doc:
+            return None
+        return {"filename": doc.get("filename"), "length": doc["length"], "metadata": doc.get("metadata")}
+    
+    async def filenames(self, blob_ids):
+        docs = await self.db.local_blobs.find({"_id": {"$in": list(blob_ids)}}, {"filename": 1}).to_list(None)
+        return {doc["_id"]: doc.get("filename") for doc in docs}
+    
+    async def delete(self, blob_id):
+        result = await self.db.local_blobs.delete_one({"_id": blob_id})
+        try:
+            await asyncio.to_thread(os.unlink, self._path(blob_id))
+        except FileNotFoundError:
+            if not result.deleted_count:
+                raise FileNotFoundError(f"Blob {blob_id} not found")
+    
+    async def delete_many(self, blob_ids):
+        await self.db.local_blobs.delete_many({"_id": {"$in": list(blob_ids)}})
+        
+        def unlink_all():
+            for blob_id in blob_ids:
+                self._path(blob_id).unlink(missing_ok=True)
+        await asyncio.to_thread(unlink_all)
+    
+    async def lengths(self, blob_ids):
+        docs = await self.db.local_blobs.find({"_id": {"$in": list(blob_ids)}}, {"length": 1}).to_list(None)
+        return {doc["_id"]: doc["length"] for doc in docs}
+    
+    async def reclaim_untracked(self, older_than, dry_run):
+        """Files on disk without a catalog entry, and temporary files of interrupted writes"""
+        cutoff = older_than.timestamp()
+        
+        def old_files():
+            found = []
+            if self.root.is_dir():
+                for path in self.root.glob("*/*/*"):
+                    try:
+                        stat = path.stat()
+                    except FileNotFoundError:
+                        continue
+                    if stat.st_mtime < cutoff:
+                        found.append((path, stat.st_size))
+            return found
+        
+        untracked = []
+        candidates = await asyncio.to_thread(old_files)
+        for start in range(0, len(candidates), 1000):
+            batch = candidates[start:start + 1000]
+            tracked = await self.lengths([path.name for path, _ in batch if not path.name.endswith(".tmp")])
+            untracked.extend((path, size) for path, size in batch if path.name not in tracked)
+        
+        if not dry_run:
+            await asyncio.to_thread(lambda: [path.unlink(missing_ok=True) for path, _ in untracked])
+        return {"files": len(untracked), "bytes": sum(size for _, size in untracked)}
+    
+    async def list_ids(self, batch_size=500):
+        async for doc in self.db.local_blobs.find({}, {"_id": 1}).batch_size(batch_size):
+            yield doc["_id"]
+    
+    def local_path(self, blob_id):
+        path = self._path(blob_id)
+        return str(path) if path.is_file() else None
+
+class BlobStorage:
+    """Routes writes to the configured backend and finds existing blobs in any backend"""
+    
+    def __init__(self, stores: Dict[str, BlobStore], primary: str):
+        if primary not in stores:
+            raise ValueError(f"Unknown blob storage backend '{primary}'")
+        self.stores = stores
+        self.primary = stores[primary]
+    
+    def _lookup_order(self) -> List[BlobStore]:
+        return [self.primary] + [store for store in self.stores.values() if store is not self.primary]
+    
+    async def _first(self, operation: str, blob_id: str, *args):
+        for store in self._lookup_order():
+            try:
+                return await getattr(store, operation)(blob_id, *args)
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(f"Blob {blob_id} not found")
+    
+    async def put(self, filename, data, metadata=None, blob_id=None) -> str:
+        return await self.primary.put(filename, data, metadata, blob_id)
+    
+    async def get(self, blob_id) -> bytes:
+        return await self._first("get", blob_id)
+    
+    async def read_range(self, blob_id, start, length) -> bytes:
+        return await self._first("read_range", blob_id, start, length)
+    
+    async def stat(self, blob_id) -> Optional[Dict[str, Any]]:
+        for store in self._lookup_order():
+            info = await store.stat(blob_id)
+            if info:
+                return {**info, "backend": store.name}
+        return None
+    
+    async def filenames(self, blob_ids) -> Dict[str, str]:
+        names = {}
+        for store in reversed(self._lookup_order()):
+            names.update(await store.filenames(blob_ids))
+        return names
+    
+    async def delete(self, blob_id):
+        await self._first("delete", blob_id)
+    
+    async def delete_many(self, blob_ids) -> Dict[str, int]:
+        """Delete blobs from whichever backends hold them. Returns the number of blobs and bytes removed"""
+        removed = {"blobs": 0, "bytes": 0}
+        for store in self.stores.values():
+            lengths = await store.lengths(blob_ids)
+            if lengths:
+                await store.delete_many(list(lengths))
+                removed["blobs"] += len(lengths)
+                removed["bytes"] += sum(lengths.values())
+        return removed
+    
+    def local_path(self, blob_id) -> Optional[str]:
+        for store in self._lookup_order():
+            path = store.local_path(blob_id)
+            if path:
+                return path
+        return None
+
+blob_storage = BlobStorage(
+    {"gridfs": GridFSBlobStore(db, fs), "local": LocalBlobStore(db, LOCAL_BLOB_ROOT)},
+    BLOB_STORAGE_BACKEND
+)
+
+async def migrate_blobs(migration_id: str, source: str, target: str, delete_source: bool = True):
+    """Copy every blob from one backend to the other under the same id (runs on the job queue).
+    
+    Reads find blobs in either backend, so the system stays online while this runs.
+    """
+    source_store, target_store = blob_storage.stores[source], blob_storage.stores[target]
+    migrated = failed = migrated_bytes = 0
+    
+    async def record(status: str, **extra):
+        await db.storage_migrations.update_one(
+            {"id": migration_id},
+            {"$set": {
+                "status": status, "migrated": migrated, "failed": failed,
+                "migrated_bytes": migrated_bytes, "updated_at": datetime.now(timezone.utc), **extra
+            }}
+        )
+    
+    try:
+        async for blob_id in source_store.list_ids():
+            try:
+                info = await source_store.stat(blob_id)
+                if not info:
+                    continue
+                data = await source_store.get(blob_id)
+                await target_store.put(info["filename"], data, info["metadata"], blob_id)
+                
+                if not await source_store.stat(blob_id):
+                    # Deleted while being copied: do not resurrect it in the target
+                    await target_store.delete(blob_id)
+                    continue
+                if delete_source:
+                    await source_store.delete(blob_id)
+                migrated += 1
+                migrated_bytes += len(data)
+            except Exception as e:
+                failed += 1
+                logging.warning(f"Failed to migrate blob {blob_id} from {source} to {target}: {e}")
+            
+            if (migrated + failed) % 100 == 0:
+                await record("running")
+        await record("completed", finished_at=datetime.now(timezone.utc))
+    except Exception as e:
+        logging.error(f"Blob migration {migration_id} failed: {e}")
+        await record("failed", error=str(e), finished_at=datetime.now(timezone.utc))
+
+async def benchmark_blob_store(store: BlobStore, blob_count: int, blob_bytes: int) -> Dict[str, Any]:
+    """Measure write, full read and 4 KB range read throughput of a backend with throwaway blobs"""
+    payload = os.urandom(blob_bytes)
+    blob_ids = []
+    try:
+        started = time.perf_counter()
+        for i in range(blob_count):
+            blob_ids.append(await store.put(f"benchmark_{i}.bin", payload, {"benchmark": True}))
+        write_seconds = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        for blob_id in blob_ids:
+            await store.get(blob_id)
+        read_seconds = time.perf_counter() - started
+        
+        range_length = min(4096, blob_bytes)
+        started = time.perf_counter()
+        for blob_id in blob_ids:
+            await store.read_range(blob_id, blob_bytes - range_length, range_length)
+        range_seconds = time.perf_counter() - started
+    finally:
+        for blob_id in blob_ids:
+            await store.delete(blob_id)
+    
+    total_mb = blob_count * blob_bytes / (1024 * 1024)
+    return {
+        "backend": store.name,
+        "write_mb_per_s": round(total_mb / write_seconds, 1) if write_seconds else None,
+        "read_mb_per_s": round(total_mb / read_seconds, 1) if read_seconds else None,
+        "range_reads_per_s": round(blob_count / range_seconds, 1) if range_seconds else None
+    }
+
+# ==================== INSTANCE STORAGE ====================
+# An instance is addressed by the blob id stored in a study's file_ids. By default that
+# blob holds the whole DICOM object. With the split layout the blob holds only the
+# header and the instance index records the blobs ("segments") that make up the object.
+
+async def _write_instance_blobs(filename: str, content: bytes, metadata: Dict[str, Any]) -> tuple:
+    """Write new instance content to blob storage. Returns (file id, segments or None for a whole file)"""
+    from bson import ObjectId
+    
+    pixel_offset = find_pixel_data_offset(content) if SPLIT_PIXEL_STORAGE else None
+    if not pixel_offset:
+        return await blob_storage.put(filename, content, metadata), None
+    
+    file_id = ObjectId()
+    pixel_file_id = await blob_storage.put(
+        f"{filename}.pixels", content[pixel_offset:], {"pixel_data_of": str(file_id)}
+    )
+    await blob_storage.put(filename, content[:pixel_offset], {**metadata, "layout": "split"}, str(file_id))
+    segments = [
+        {"kind": "header", "file_id": str(file_id), "offset": 0, "length": pixel_offset},
+        {"kind": "pixels", "file_id": str(pixel_file_id), "offset": 0, "length": len(content) - pixel_offset}
+    ]
+    await db.instances.update_one(
+        {"file_id": str(file_id)},
+        {"$set": {"file_id": str(file_id), "storage": {"layout": "split", "revision": 0, "segments": segments}}},
+        upsert=True
+    )
+    return str(file_id), segments
+
+async def store_instance(filename: str, content: bytes, metadata: Dict[str, Any]) -> str:
+    """Store an uploaded DICOM object and return its file id.
+    
+    Content is addressed by its SHA-256: identical bytes that are already stored are not
+    written again. The new instance gets its own (empty) blob for its id and metadata
+    and references the existing blobs, whose reference count is incremented.
+    """
+    from bson import ObjectId
+    content_sha256 = await asyncio.to_thread(lambda: hashlib.sha256(content).hexdigest())
+    
+    blob = await db.blobs.find_one_and_update(
+        {"_id": content_sha256, "refcount": {"$gt": 0}},
+        {"$inc": {"refcount": 1}}
+    )
+    if blob:
+        file_id = ObjectId()
+        await blob_storage.put(
+            filename, b"", {**metadata, "layout": "reference", "content_sha256": content_sha256}, str(file_id)
+        )
+        await db.instances.update_one(
+            {"file_id": str(file_id)},
+            {"$set": {
+                "file_id": str(file_id),
+                "content_sha256": content_sha256,
+                "storage": {"layout": "reference", "revision": 0, "segments": blob["segments"]}
+            }},
+            upsert=True
+        )
+        return str(file_id)
+    
+    file_id, segments = await _write_instance_blobs(filename, content, metadata)
+    try:
+        await db.blobs.insert_one({
+            "_id": content_sha256,
+            "segments": segments or [{"kind": "content", "file_id": file_id, "offset": 0, "length": len(content)}],
+            "length": len(content),
+            "refcount": 1,
+            "created_at": datetime.now(timezone.utc)
+        })
+    except DuplicateKeyError:
+        return file_id  # A concurrent upload stored the same bytes first; this copy stays unshared
+    
+    await db.instances.update_one(
+        {"file_id": file_id}, {"$set": {"file_id": file_id, "content_sha256": content_sha256}}, upsert=True
+    )
+    return file_id
+
+async def prepare_for_storage(content: bytes) -> tuple:
+    """Apply the ingest compression policy in the process pool. Returns (bytes to store, compression record)"""
+    if not INGEST_COMPRESSION:
+        return content, None
+    try:
+        compressed = await run_cpu_bound(compress_for_storage, content, INGEST_COMPRESSION)
+    except Exception as e:
+        logging.warning(f"Ingest compression failed: {str(e)}")
+        return content, None
+    if not compressed:
+        return content, None
+    return compressed.pop("data"), compressed
+
+async def read_instance_for_client(file_id: str, accept_header: Optional[str], requested: Optional[str] = None) -> bytes:
+    """Return an instance in its stored transfer syntax when the client accepts it, else as uploaded"""
+    contents = await read_instance(file_id)
+    instance = await db.instances.find_one({"file_id": file_id}, {"compression": 1})
+    compression = (instance or {}).get("compression")
+    if compression and not accepts_transfer_syntax(accept_header, requested, compression["stored_transfer_syntax"]):
+        contents = await run_cpu_bound(decompress_from_storage, contents, compression["original_transfer_syntax"])
+    return contents
+
+class FileDiskCache:
+    """Bounded on-disk LRU cache of instances exactly as they are sent to clients.
+    
+    Entries live in `<file_id>/<revision>-<variant>.dcm`, so a header rewrite never serves
+    stale bytes and invalidating a file removes one directory. As in VolumeDiskCache, recency
+    is the file mtime shared by all workers. The byte total is tracked per worker and only
+    re-measured from disk when it crosses the budget. Hit counters are per worker process.
+    """
+    
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        self.approximate_bytes = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+    
+    def _path(self, file_id: str, revision: int, variant: str) -> Path:
+        return self.directory / file_id / f"{revision}-{variant}.dcm"
+    
+    def get(self, file_id: str, revision: int, variant: str) -> Optional[str]:
+        path = self._path(file_id, revision, variant)
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return str(path)
+    
+    def put(self, file_id: str, revision: int, variant: str, contents: bytes):
+        path = self._path(file_id, revision, variant)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(contents)
+            os.replace(temp_path, path)
+        except Exception:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+        
+        if self.approximate_bytes is None:
+            self.approximate_bytes = self.usage()["bytes"]
+        else:
+            self.approximate_bytes += len(contents)
+        if self.approximate_bytes > self.max_bytes:
+            self.evict()
+    
+    def _entries(self) -> List[tuple]:
+        entries = []
+        for path in self.directory.glob("*/*.dcm"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+    
+    def usage(self) -> Dict[str, int]:
+        entries = self._entries()
+        return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries)}
+    
+    def evict(self):
+        """Remove least recently used entries down to 90% of the budget, leaving room to grow"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            try:
+                path.parent.rmdir()
+            except OSError:
+                pass  # Other variants of the file are still cached
+            self.stats["evictions"] += 1
+            total -= size
+        self.approximate_bytes = total
+    
+    def invalidate(self, file_id: str):
+        """Drop every cached variant and revision of a file"""
+        directory = self.directory / file_id
+        if not directory.is_dir():
+            return
+        for path in directory.iterdir():
+            path.unlink(missing_ok=True)
+        directory.rmdir()
+        self.stats["invalidations"] += 1
+
+file_disk_cache = FileDiskCache(FILE_DISK_CACHE_DIR, FILE_DISK_CACHE_BYTES)
+
+async def invalidate_cached_file(file_id: str):
+    if file_disk_cache.enabled:
+        try:
+            await asyncio.to_thread(file_disk_cache.invalidate, file_id)
+        except OSError as e:
+            logging.warning(f"Failed to invalidate cached file {file_id}: {e}")
+
+async def describe_instance_for_client(file_id: str, accept_header: Optional[str], requested: Optional[str] = None) -> Dict[str, Any]:
+    """Decide which bytes a client gets and derive their strong ETag, without reading any blob data.
+    
+    The tag combines the content hash (or the immutable file id for content stored before
+    hashing), the header revision and whether the stored or the decompressed form is sent.
+    Raises FileNotFoundError when the instance does not exist.
+    """
+    instance = await db.instances.find_one(
+        {"file_id": file_id}, {"storage": 1, "compression": 1, "size": 1, "content_sha256": 1}
+    )
+    if not instance and not await blob_storage.stat(file_id):
+        raise FileNotFoundError(f"File {file_id} not found")
+    instance = instance or {}
+    
+    compression = instance.get("compression")
+    transcode = bool(compression) and not accepts_transfer_syntax(accept_header, requested, compression["stored_transfer_syntax"])
+    revision = (instance.get("storage") or {}).get("revision") or 0
+    variant = "original" if transcode else "stored"
+    return {
+        "instance": instance,
+        "compression": compression if transcode else None,
+        "revision": revision,
+        "variant": variant,
+        "etag": f'"{instance.get("content_sha256") or file_id}.{revision}.{variant}"'
+    }
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag (RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any(
+        (candidate.strip()[2:] if candidate.strip().startswith("W/") else candidate.strip()) == opaque
+        for candidate in if_none_match.split(",")
+    )
+
+async def resolve_instance_for_client(
+    file_id: str, accept_header: Optional[str], requested: Optional[str] = None, delivery: Optional[Dict[str, Any]] = None
+) -> tuple:
+    """Return (path, None) when the response can be sent straight from a local file, else (None, bytes).
+    
+    Files kept by the local blob backend are served in place. Everything else goes through
+    the disk cache, so repeat downloads do not read from the blob store again.
+    """
+    delivery = delivery or await describe_instance_for_client(file_id, accept_header, requested)
+    instance, compression = delivery["instance"], delivery["compression"]
+    transcode = compression is not None
+    storage = instance.get("storage")
+    
+    if not transcode:
+        blob_id = file_id
+        if storage:
+            # Only a reference to one whole shared blob maps onto a single file
+            segments = storage["segments"]
+            if len(segments) == 1 and segments[0]["offset"] == 0 and segments[0]["length"] == instance.get("size"):
+                blob_id = segments[0]["file_id"]
+            else:
+                blob_id = None
+        path = blob_storage.local_path(blob_id) if blob_id else None
+        if path:
+            return path, None
+    
+    revision, variant = delivery["revision"], delivery["variant"]
+    if file_disk_cache.enabled:
+        path = await asyncio.to_thread(file_disk_cache.get, file_id, revision, variant)
+        if path:
+            return path, None
+    
+    contents = await single_flight.do(
+        ("file", file_id, revision, variant), _fetch_instance_for_client,
+        file_id, revision, variant, compression
+    )
+    return None, contents
+
+async def _fetch_instance_for_client(file_id: str, revision: int, variant: str, compression: Optional[Dict[str, Any]]) -> bytes:
+    """Read (and decompress when needed) an instance that missed the disk cache, then cache it"""
+    contents = await read_instance(file_id)
+    if compression:
+        contents = await run_cpu_bound(decompress_from_storage, contents, compression["original_transfer_syntax"])
+    if file_disk_cache.enabled:
+        try:
+            await asyncio.to_thread(file_disk_cache.put, file_id, revision, variant, contents)
+        except OSError as e:
+            logging.warning(f"Failed to cache file {file_id}: {e}")
+    return contents
+
+async def get_instance_segments(file_id: str) -> Optional[List[Dict[str, Any]]]:
+    """Segments of a split instance, or None when the blob with the instance's id holds the whole object"""
+    instance = await db.instances.find_one({"file_id": file_id}, {"storage": 1})
+    storage = (instance or {}).get("storage")
+    return storage["segments"] if storage else None
+
+async def _read_segment(segment: Dict[str, Any], start: int = 0, length: Optional[int] = None) -> bytes:
+    length = segment["length"] - start if length is None else length
+    return await blob_storage.read_range(segment["file_id"], segment["offset"] + start, length)
+
+async def read_instance(file_id: str) -> bytes:
+    """Return the complete DICOM object, reassembling split instances"""
+    segments = await get_instance_segments(file_id)
+    if not segments:
+        return await blob_storage.get(file_id)
+    return b"".join([await _read_segment(segment) for segment in segments])
+
+async def read_instance_range(file_id: str, start: int, length: int) -> bytes:
+    """Read a byte range of the logical DICOM object, touching only the blobs and chunks it covers"""
+    segments = await get_instance_segments(file_id)
+    if not segments:
+        return await blob_storage.read_range(file_id, start, length)
+    
+    parts, position, end = [], 0, start + length
+    for segment in segments:
+        segment_end = position + segment["length"]
+        if segment_end > start and position < end:
+            local_start = max(start - position, 0)
+            parts.append(await _read_segment(segment, local_start, min(end, segment_end) - position - local_start))
+        position = segment_end
+    return b"".join(parts)
+
+async def extract_stored_metadata(file_id: str) -> Dict[str, Any]:
+    """Metadata of a stored instance, parsed from its header only"""
+    return extract_dicom_metadata(await read_instance_header(file_id))
+
+async def read_instance_header(file_id: str) -> bytes:
+    """Return only the bytes before Pixel Data, falling back to the whole object when unknown"""
+    segments = await get_instance_segments(file_id)
+    if segments and any(segment["kind"] == "header" for segment in segments):
+        return b"".join([await _read_segment(segment) for segment in segments if segment["kind"] == "header"])
+    
+    instance = await db.instances.find_one({"file_id": file_id}, {"header_length": 1})
+    if instance and instance.get("header_length"):
+        return await read_instance_range(file_id, 0, instance["header_length"])
+    return await read_instance(file_id)
+
+async def rewrite_instance_header(file_id: str, patient_updates: Dict[str, Any], audit: Dict[str, Any]) -> Dict[str, Any]:
+    """Rewrite only the header of an instance, keeping its id and reusing the stored pixel chunks.
+    
+    The new header goes into its own small blob and the instance's segment list is swapped in
+    a single conditional update, so concurrent edits cannot interleave. Whole-file instances
+    become split instances whose pixel segment points into the original file's chunks. The id
+    in the study's file_ids never changes, so no other references need updating.
+    """
+    instance = await db.instances.find_one({"file_id": file_id}) or {}
+    storage = instance.get("storage")
+    file_doc = await blob_storage.stat(file_id)
+    if not file_doc:
+        raise FileNotFoundError(f"File {file_id} not found")
+    
+    has_header_segment = storage and any(segment["kind"] == "header" for segment in storage["segments"])
+    if not has_header_segment and not instance.get("header_length"):
+        contents = await read_instance(file_id)
+        if not instance.get("indexed_at"):
+            # Never indexed: index from the full file once to find the header boundary
+            await index_instance(file_id, instance.get("study_id"), contents)
+            instance = await db.instances.find_one({"file_id": file_id}) or {}
+        if not instance.get("header_length"):
+            # Deflated objects and objects without Pixel Data (SR, KO, PR) have no raw header boundary
+            return await _rewrite_whole_instance(file_id, instance, file_doc, contents, patient_updates, audit)
+    
+    if storage and storage["segments"][0]["kind"] == "content":
+        # Reference to a whole shared file: split it at the header boundary without copying
+        header_length = instance["header_length"]
+        content = {key: value for key, value in storage["segments"][0].items() if key != "rewritten"}
+        header_segment = {**content, "kind": "header", "length": header_length}
+        pixel_segment = {**content, "kind": "pixels", "offset": content["offset"] + header_length, "length": content["length"] - header_length}
+    elif storage:
+        segments = storage["segments"]
+        header_segment = next(segment for segment in segments if segment["kind"] == "header")
+        pixel_segment = next(segment for segment in segments if segment["kind"] == "pixels")
+    else:
+        header_length = instance["header_length"]
+        header_segment = {"kind": "header", "file_id": file_id, "offset": 0, "length": header_length}
+        pixel_segment = {"kind": "pixels", "file_id": file_id, "offset": header_length, "length": file_doc["length"] - header_length}
+    
+    old_header = await _read_segment(header_segment)
+    new_header = await run_cpu_bound(rewrite_dicom_header, old_header, patient_updates)
+    header_file_id = await blob_storage.put(f"{file_doc['filename']}.header", new_header, {"header_of": file_id})
+    
+    # Frame offsets are relative to the start of the object and move with the header length
+    shift = len(new_header) - header_segment["length"]
+    frame_index = instance.get("frame_index")
+    if frame_index and shift:
+        frame_index = {**frame_index, "frames": [
+            [[offset + shift, length] for offset, length in frame] for frame in frame_index["frames"]
+        ]}
+    
+    revision = (storage or {}).get("revision", 0)
+    result = await db.instances.update_one(
+        {"file_id": file_id, "storage.revision": revision or {"$in": [0, None]}} if storage else {"file_id": file_id, "storage": None},
+        {"$set": {
+            "storage": {
+                "layout": "split",
+                "revision": revision + 1,
+                "segments": [
+                    {"kind": "header", "file_id": str(header_file_id), "offset": 0, "length": len(new_header), "rewritten": True},
+                    pixel_segment
+                ]
+            },
+            "header_length": len(new_header),
+            "size": len(new_header) + pixel_segment["length"],
+            "frame_index": frame_index,
+            **{f"audit.{key}": value for key, value in audit.items()}
+        }}
+    )
+    if not result.matched_count:
+        await blob_storage.delete(header_file_id)
+        raise RuntimeError("The instance was modified concurrently; retry the update")
+    
+    await invalidate_cached_file(file_id)
+    
+    # A header blob written by an earlier rewrite is no longer referenced (original headers may be shared)
+    if header_segment.get("rewritten"):
+        try:
+            await blob_storage.delete(header_segment["file_id"])
+        except Exception as e:
+            logging.warning(f"Failed to delete replaced header blob {header_segment['file_id']}: {e}")
+    
+    return {"header_bytes": len(new_header), "revision": revision + 1}
+
+async def _rewrite_whole_instance(
+    file_id: str,
+    instance: Dict[str, Any],
+    file_doc: Dict[str, Any],
+    contents: bytes,
+    patient_updates: Dict[str, Any],
+    audit: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Re-save the complete object into a new blob and point the instance at it, keeping its id"""
+    storage = instance.get("storage")
+    new_contents = await run_cpu_bound(rewrite_dicom_object, contents, patient_updates)
+    content_file_id = await blob_storage.put(f"{file_doc['filename']}.rewritten", new_contents, {"rewrite_of": file_id})
+    
+    try:
+        frame_index = build_frame_index(new_contents)
+    except Exception:
+        frame_index = None
+    
+    revision = (storage or {}).get("revision", 0)
+    result = await db.instances.update_one(
+        {"file_id": file_id, "storage.revision": revision or {"$in": [0, None]}} if storage else {"file_id": file_id, "storage": None},
+        {"$set": {
+            "file_id": file_id,
+            "storage": {
+                "layout": "reference",
+                "revision": revision + 1,
+                "segments": [
+                    {"kind": "content", "file_id": str(content_file_id), "offset": 0, "length": len(new_contents), "rewritten": True}
+                ]
+            },
+            "header_length": find_pixel_data_offset(new_contents),
+            "size": len(new_contents),
+            "frame_index": frame_index,
+            **{f"audit.{key}": value for key, value in audit.items()}
+        }},
+        upsert=not instance
+    )
+    if not result.matched_count and not result.upserted_id:
+        await blob_storage.delete(content_file_id)
+        raise RuntimeError("The instance was modified concurrently; retry the update")
+    
+    await invalidate_cached_file(file_id)
+    
+    # Content written by an earlier whole-object rewrite is no longer referenced
+    for segment in (storage or {}).get("segments", []):
+        if segment.get("rewritten"):
+            try:
+                await blob_storage.delete(segment["file_id"])
+            except Exception as e:
+                logging.warning(f"Failed to delete replaced blob {segment['file_id']}: {e}")
+    
+    return {"header_bytes": len(new_contents), "revision": revision + 1}
+
+async def get_instance_filenames(file_ids: List[str]) -> Dict[str, str]:
+    """Original filenames of instances, keyed by file id"""
+    return await blob_storage.filenames(file_ids)
+
+async def release_content_blob(content_sha256: str, references: int = 1) -> set:
+    """Drop references to shared content. Returns the blob ids that must be kept"""
+    blob = await db.blobs.find_one_and_update(
+        {"_id": content_sha256}, {"$inc": {"refcount": -references}}, return_document=ReturnDocument.AFTER
+    )
+    if not blob:
+        return set()
+    blob_file_ids = {segment["file_id"] for segment in blob["segments"]}
+    if blob["refcount"] > 0:
+        return blob_file_ids
+    
+    # Last reference: whoever removes the record deletes the content
+    if (await db.blobs.delete_one({"_id": content_sha256, "refcount": {"$lte": 0}})).deleted_count:
+        return set()
+    return blob_file_ids
+
+async def delete_instances(file_ids: List[str]) -> Dict[str, int]:
+    """Delete instances with their pyramids, releasing shared content and removing unreferenced blobs in bulk.
+    
+    Index records go first so a retried deletion never releases shared content twice; blobs
+    left behind by an interrupted run are reclaimed by the orphan reconciler.
+    """
+    from bson import ObjectId
+    instances = await db.instances.find(
+        {"file_id": {"$in": file_ids}}, {"file_id": 1, "storage": 1, "content_sha256": 1}
+    ).to_list(None)
+    pyramids = await db.image_pyramids.find({"file_id": {"$in": file_ids}}, {"levels.file_id": 1}).to_list(None)
+    await db.instances.delete_many({"file_id": {"$in": file_ids}})
+    await db.image_pyramids.delete_many({"file_id": {"$in": file_ids}})
+    
+    blob_ids = set(file_ids)
+    for instance in instances:
+        blob_ids.update(segment["file_id"] for segment in (instance.get("storage") or {}).get("segments", []))
+    for pyramid in pyramids:
+        blob_ids.update(level["file_id"] for level in pyramid.get("levels", []))
+    
+    references = {}
+    for instance in instances:
+        if instance.get("content_sha256"):
+            references[instance["content_sha256"]] = references.get(instance["content_sha256"], 0) + 1
+    for content_sha256, count in references.items():
+        blob_ids -= await release_content_blob(content_sha256, count)
+    
+    # Legacy/mock ids that are not ObjectIds never had blobs
+    removed = await blob_storage.delete_many([blob_id for blob_id in blob_ids if ObjectId.is_valid(blob_id)])
+    for file_id in file_ids:
+        await invalidate_cached_file(file_id)
+    return removed
+
+async def delete_instance(file_id: str):
+    """Delete one instance, releasing its shared content and deleting blobs nobody else references"""
+    await delete_instances([file_id])
+
+def slice_normal(orientation: List[float]) -> np.ndarray:
+    """Normal of the image plane from ImageOrientationPatient"""
+    return np.cross(np.array(orientation[:3]), np.array(orientation[3:]))
+
+def sort_series_instances(instances: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Order slices along the slice normal, falling back to InstanceNumber"""
+    def position_key(instance):
+        if instance.get("image_position") and instance.get("image_orientation"):
+            return (0, float(np.dot(slice_normal(instance["image_orientation"]), instance["image_position"])))
+        return (1, instance.get("instance_number") or 0)
+    return sorted(instances, key=position_key)
+
+def decode_slice_pixels(file_data: bytes) -> Dict[str, Any]:
+    """Decode one single-frame slice with its rescale and default window"""
+    ds = pydicom.dcmread(io.BytesIO(file_data), force=True)
+    return {
+        "pixels": ds.pixel_array,
+        "slope": float(_first_value(getattr(ds, 'RescaleSlope', None), 1) or 1),
+        "intercept": float(_first_value(getattr(ds, 'RescaleIntercept', None), 0) or 0),
+        "window_center": _optional_float(_first_value(getattr(ds, 'WindowCenter', None))),
+        "window_width": _optional_float(_first_value(getattr(ds, 'WindowWidth', None))),
+        "invert": str(getattr(ds, 'PhotometricInterpretation', '')) == "MONOCHROME1"
+    }
+
+class VolumeDiskCache:
+    """Bounded on-disk cache of decoded volumes stored as memory-mappable .npy files.
+    
+    Each entry is `<key>.npy` plus a `<key>.json` sidecar with the volume geometry. Recency
+    is tracked through file mtimes so every worker process shares one LRU order, and
+    eviction removes the least recently used entries until the directory fits the byte
+    budget. Workers that still have an evicted file mapped keep reading it safely.
+    """
+    
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+    
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Map a cached volume read-only without copying it into memory"""
+        array_path = self.directory / f"{key}.npy"
+        try:
+            info = json.loads((self.directory / f"{key}.json").read_text())
+            voxels = np.load(array_path, mmap_mode="r")
+            os.utime(array_path)  # Mark as recently used
+        except (FileNotFoundError, ValueError):
+            return None
+        return {**info, "voxels": voxels}
+    
+    def put(self, key: str, voxels: np.ndarray, info: Dict[str, Any]):
+        """Store a volume atomically, then trim the cache to its byte budget"""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                np.save(temp_file, np.ascontiguousarray(voxels))
+            (self.directory / f"{key}.json").write_text(json.dumps(info, default=str))
+            os.replace(temp_path, self.directory / f"{key}.npy")
+        except Exception:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+        self.evict()
+    
+    def evict(self):
+        entries = []
+        for path in self.directory.glob("*.npy"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+            total -= size
+
+volume_disk_cache = VolumeDiskCache(VOLUME_DISK_CACHE_DIR, VOLUME_DISK_CACHE_BYTES)
+
+def _open_shared_memory(name: str, create: bool = False, size: int = 0) -> shared_memory.SharedMemory:
+    """Open a shared memory block that outlives the process (the cache index owns its lifetime)"""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    block = shared_memory.SharedMemory(name=name, create=create, size=size)
+    # Older Pythons unlink every tracked block when the process exits, even blocks other workers use
+    resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+def _unlink_shared_memory(block: shared_memory.SharedMemory):
+    block.close()
+    if sys.version_info < (3, 13):
+        resource_tracker.register(block._name, "shared_memory")  # unlink() unregisters it again
+    block.unlink()
+
+class SharedPixels:
+    """A decoded array borrowed from the shared pixel cache; call release() when done with it"""
+    
+    def __init__(self, cache: "SharedPixelCache", key: str, block: shared_memory.SharedMemory, entry: Dict[str, Any]):
+        self.cache = cache
+        self.key = key
+        self.block = block
+        self.meta = entry["meta"]
+        self.array = np.ndarray(tuple(entry["shape"]), dtype=np.dtype(entry["dtype"]), buffer=block.buf)
+    
+    def release(self):
+        self.array = None
+        self.block.close()
+        self.cache._drop_reference(self.key)
+
+class SharedPixelCache:
+    """Cross-process cache of decoded pixel arrays held in multiprocessing.shared_memory blocks.
+    
+    A small JSON index guarded by an flock maps each key to its block name, shape, dtype and
+    the per-process reference counts of its current borrowers. Blocks without live borrowers
+    are evicted least-recently-used once the cache exceeds its byte budget; references held
+    by processes that have exited are discarded during eviction.
+    """
+    
+    def __init__(self, index_path: Path, max_bytes: int):
+        self.index_path = Path(index_path)
+        self.lock_path = self.index_path.with_suffix(".lock")
+        self.max_bytes = max_bytes
+    
+    @contextmanager
+    def _locked_index(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    index = json.loads(self.index_path.read_text())
+                except (FileNotFoundError, ValueError):
+                    index = {}
+                original = json.dumps(index, sort_keys=True)
+                yield index
+                if json.dumps(index, sort_keys=True) != original:
+                    self.index_path.write_text(json.dumps(index))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    BLOCK_PREFIX = "pacs_"
+    SHM_DIR = Path("/dev/shm")
+    
+    @classmethod
+    def _block_name(cls, key: str) -> str:
+        # Unique per writer, so concurrent puts of one key never share a block; the writer's pid
+        # lets eviction reclaim blocks left unpublished by a writer that died mid-copy
+        return f"{cls.BLOCK_PREFIX}{hashlib.sha256(key.encode()).hexdigest()[:12]}_{os.getpid()}_{secrets.token_hex(2)}"
+    
+    def acquire(self, key: str) -> Optional[SharedPixels]:
+        """Borrow a cached array without copying it; None on a miss"""
+        if not self.max_bytes:
+            return None
+        with self._locked_index() as index:
+            entry = index.get(key)
+            if not entry:
+                return None
+            try:
+                block = _open_shared_memory(entry["name"])
+            except FileNotFoundError:
+                del index[key]
+                return None
+            pid = str(os.getpid())
+            entry["refs"][pid] = entry["refs"].get(pid, 0) + 1
+            entry["last_used"] = time.time()
+            return SharedPixels(self, key, block, entry)
+    
+    def _drop_reference(self, key: str):
+        with self._locked_index() as index:
+            entry = index.get(key)
+            pid = str(os.getpid())
+            if entry and entry["refs"].get(pid):
+                entry["refs"][pid] -= 1
+                if not entry["refs"][pid]:
+                    del entry["refs"][pid]
+    
+    def put(self, key: str, array: np.ndarray, meta: Dict[str, Any]) -> bool:
+        """Copy an array into shared memory, evicting idle entries to make room"""
+        array = np.ascontiguousarray(array)
+        if not self.max_bytes or array.nbytes > self.max_bytes or not array.nbytes:
+            return False
+        
+        # Allocate and copy before taking the index lock; the lock only guards publishing
+        name = self._block_name(key)
+        block = _open_shared_memory(name, create=True, size=array.nbytes)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        block.close()
+        
+        with self._locked_index() as index:
+            already_cached = key in index
+            published = not already_cached and self._make_room(index, array.nbytes)
+            if published:
+                index[key] = {
+                    "name": name,
+                    "shape": list(array.shape),
+                    "dtype": array.dtype.str,
+                    "nbytes": array.nbytes,
+                    "meta": meta,
+                    "refs": {},
+                    "last_used": time.time()
+                }
+        if not published:
+            # Another writer got there first, or there is no room: discard our copy
+            _unlink_shared_memory(_open_shared_memory(name))
+        return published or already_cached
+    
+    @staticmethod
+    def _process_alive(pid: str) -> bool:
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+    
+    def _reclaim_unpublished_blocks(self, index: Dict[str, Any]):
+        """Unlink blocks no entry references whose writer has exited (Linux lists them under /dev/shm)"""
+        if not self.SHM_DIR.is_dir():
+            return
+        published = {entry["name"] for entry in index.values()}
+        for path in self.SHM_DIR.glob(f"{self.BLOCK_PREFIX}*"):
+            parts = path.name.split("_")
+            if path.name in published or len(parts) != 4 or not parts[2].isdigit() or self._process_alive(parts[2]):
+                continue
+            try:
+                _unlink_shared_memory(_open_shared_memory(path.name))
+            except FileNotFoundError:
+                pass
+    
+    def _make_room(self, index: Dict[str, Any], needed: int) -> bool:
+        for entry in index.values():
+            entry["refs"] = {pid: count for pid, count in entry["refs"].items() if self._process_alive(pid)}
+        self._reclaim_unpublished_blocks(index)
+        
+        total = sum(entry["nbytes"] for entry in index.values())
+        idle = sorted((entry["last_used"], key) for key, entry in index.items() if not entry["refs"])
+        for _, key in idle:
+            if total + needed <= self.max_bytes:
+                break
+            entry = index.pop(key)
             try:
-                from datetime import datetime
-                birth_date = datetime.strptime(metadata["patient_birth_date"], "%Y%m%d")
-                study_date = datetime.strptime(metadata["study_date"], "%Y%m%d") if metadata["study_date"] else datetime.now()
-                age = study_date.year - birth_date.year
-                if study_date.month < birth_date.month or (study_date.month == birth_date.month and study_date.day < birth_date.day):
-                    age -= 1
-                metadata["calculated_age"] = age
-            except Exception:
-                metadata["calculated_age"] = None
+                _unlink_shared_memory(_open_shared_memory(entry["name"]))
+            except FileNotFoundError:
+                pass
+            total -= entry["nbytes"]
+        return total + needed <= self.max_bytes
+
+shared_pixel_cache = SharedPixelCache(SHARED_PIXEL_CACHE_INDEX, SHARED_PIXEL_CACHE_BYTES)
+
+def series_volume_key(study_id: str, series_uid: str, instances: List[Dict[str, Any]]) -> str:
+    """Digest of the exact slice list and revisions, so added, replaced or rewritten files produce a new entry"""
+    return VolumeDiskCache.make_key(study_id, series_uid, *sorted(
+        f"{i['file_id']}:{(i.get('storage') or {}).get('revision') or 0}" for i in instances
+    ))
+
+async def load_series_volume(study: Dict[str, Any], series_uid: str) -> Dict[str, Any]:
+    """Build (or fetch from cache) the voxel volume of a series, slices ordered along the normal"""
+    study_id = study.get("study_id") or study.get("id")
+    instances = [
+        instance for instance in await get_study_instances(study)
+        if instance.get("series_instance_uid") == series_uid and instance.get("number_of_frames", 1) == 1
+    ]
+    if not instances:
+        raise HTTPException(status_code=404, detail="Series not found")
+    
+    # Memory and disk entries share one key, so neither outlives a change to the series
+    cache_key = series_volume_key(study_id, series_uid, instances)
+    if cache_key in volume_cache:
+        return volume_cache[cache_key]
+    # Viewers opening the same series at once share one build
+    return await single_flight.do(("volume", cache_key), _build_series_volume, cache_key, instances, series_uid)
+
+def cache_volume(cache_key: str, volume: Dict[str, Any]):
+    # Volumes larger than the whole cache are served uncached (LRUCache refuses them with ValueError)
+    if volume["voxels"].nbytes <= volume_cache.maxsize:
+        volume_cache[cache_key] = volume
+
+async def _build_series_volume(cache_key: str, instances: List[Dict[str, Any]], series_uid: str) -> Dict[str, Any]:
+    # Only slices sharing the dominant matrix size belong to the volume (drops scouts/localizers)
+    shapes = [(instance["rows"], instance["columns"]) for instance in instances]
+    dominant_shape = max(set(shapes), key=shapes.count)
+    instances = sort_series_instances([i for i in instances if (i["rows"], i["columns"]) == dominant_shape])
+    
+    volume = await asyncio.to_thread(volume_disk_cache.get, cache_key)
+    if volume:
+        volume["spacing"] = tuple(volume["spacing"])
+        cache_volume(cache_key, volume)
+        return volume
+    
+    borrowed = []
+    
+    async def decode(instance):
+        # Slices decoded by any worker are reused from shared memory
+        shared = await asyncio.to_thread(shared_pixel_cache.acquire, instance["file_id"])
+        if shared:
+            borrowed.append(shared)
+            return {**shared.meta, "pixels": shared.array}
         
-        return metadata
+        decoded = await run_cpu_bound(decode_slice_pixels, await read_instance(instance["file_id"]))
+        await asyncio.to_thread(
+            shared_pixel_cache.put, instance["file_id"], decoded["pixels"],
+            {k: v for k, v in decoded.items() if k != "pixels"}
+        )
+        return decoded
+    
+    try:
+        slices = await asyncio.gather(*[decode(instance) for instance in instances])
         
-    except Exception as e:
-        logging.error(f"Failed to extract DICOM metadata: {str(e)}")
-        return {}
+        # Keep stored values (and one rescale) when all slices share it, otherwise rescale each slice
+        rescales = {(s["slope"], s["intercept"]) for s in slices}
+        if len(rescales) == 1:
+            voxels = np.stack([s["pixels"] for s in slices])
+            slope, intercept = rescales.pop()
+        else:
+            voxels = np.stack([s["pixels"].astype(np.float32) * s["slope"] + s["intercept"] for s in slices])
+            slope, intercept = 1.0, 0.0
+        slices = [{k: v for k, v in s.items() if k != "pixels"} for s in slices]
+    finally:
+        await asyncio.gather(*[asyncio.to_thread(shared.release) for shared in borrowed])
+    
+    # Spacing (z, y, x) in mm; slice spacing comes from the positions, not SliceThickness
+    first = instances[0]
+    row_spacing, column_spacing = first.get("pixel_spacing") or [1.0, 1.0]
+    slice_spacing = first.get("slice_thickness") or 1.0
+    if len(instances) > 1 and all(i.get("image_position") and i.get("image_orientation") for i in instances):
+        normal = slice_normal(first["image_orientation"])
+        positions = [float(np.dot(normal, i["image_position"])) for i in instances]
+        slice_spacing = float(np.median(np.diff(positions))) or slice_spacing
+    
+    volume = {
+        "voxels": voxels,
+        "spacing": (abs(slice_spacing), float(row_spacing), float(column_spacing)),
+        "slope": slope,
+        "intercept": intercept,
+        "window_center": slices[0]["window_center"],
+        "window_width": slices[0]["window_width"],
+        "invert": slices[0]["invert"],
+        "file_ids": [i["file_id"] for i in instances]
+    }
+    
+    # Swap the freshly decoded array for its memory-mapped copy so the page cache holds the data
+    try:
+        await asyncio.to_thread(
+            volume_disk_cache.put, cache_key, voxels, {k: v for k, v in volume.items() if k != "voxels"}
+        )
+        volume = await asyncio.to_thread(volume_disk_cache.get, cache_key) or volume
+        volume["spacing"] = tuple(volume["spacing"])
+    except OSError as e:
+        logging.warning(f"Could not write volume cache entry for series {series_uid}: {str(e)}")
+    
+    cache_volume(cache_key, volume)
+    return volume
 
-def modify_dicom_metadata(file_data: bytes, patient_updates: Dict[str, Any]) -> bytes:
-    """Modify DICOM file metadata with updated patient information"""
+def _slab_indices(center: int, thickness_mm: float, spacing: float, size: int) -> slice:
+    """Voxel range covering a slab of the given thickness around a position"""
+    half = int(round(thickness_mm / spacing / 2)) if thickness_mm else 0
+    return slice(max(center - half, 0), min(center + half + 1, size))
+
+def _project_slab(slab: np.ndarray, axis: int, mode: str) -> np.ndarray:
+    """Collapse a slab along an axis: maximum (MIP), minimum (MinIP) or mean intensity"""
+    if mode == "mip":
+        return slab.max(axis=axis)
+    if mode == "minip":
+        return slab.min(axis=axis)
+    return slab.mean(axis=axis)
+
+def sample_oblique_plane(voxels: np.ndarray, spacing, normal, offset_mm: float, thickness_mm: float, mode: str) -> np.ndarray:
+    """Resample a plane perpendicular to `normal` (z, y, x, in mm space), `offset_mm` from the volume centre"""
+    spacing = np.array(spacing, dtype=np.float32)
+    normal = np.array(normal, dtype=np.float32)
+    if not np.linalg.norm(normal):
+        raise ValueError("Oblique plane normal must not be zero")
+    normal /= np.linalg.norm(normal)
+    
+    # In-plane axes: any vector not parallel to the normal seeds an orthonormal basis
+    seed = np.array([1.0, 0.0, 0.0]) if abs(normal[0]) < 0.9 else np.array([0.0, 1.0, 0.0])
+    u = np.cross(normal, seed)
+    u /= np.linalg.norm(u)
+    v = np.cross(normal, u)
+    
+    step = float(spacing.min())
+    extent = float(np.linalg.norm(np.array(voxels.shape) * spacing))
+    size = int(extent / step)
+    offsets = (np.arange(size) - size / 2) * step
+    center_mm = (np.array(voxels.shape, dtype=np.float32) - 1) / 2 * spacing + offset_mm * normal
+    plane_mm = center_mm + offsets[:, None, None] * v + offsets[None, :, None] * u
+    
+    depth_steps = max(int(round(thickness_mm / step)), 1) if thickness_mm else 1
+    depth_offsets = (np.arange(depth_steps) - (depth_steps - 1) / 2) * step
+    
+    samples = []
+    for depth in depth_offsets:
+        coords = (plane_mm + depth * normal) / spacing
+        samples.append(_trilinear(voxels, coords))
+    return _project_slab(np.stack(samples), 0, mode)
+
+def _trilinear(voxels: np.ndarray, coords: np.ndarray) -> np.ndarray:
+    """Trilinear interpolation of voxels at fractional (z, y, x) coordinates; outside samples get the minimum"""
+    shape = np.array(voxels.shape)
+    inside = np.all((coords >= 0) & (coords <= shape - 1), axis=-1)
+    coords = np.clip(coords, 0, shape - 1)
+    base = np.minimum(np.floor(coords).astype(np.int64), shape - 2).clip(min=0)
+    frac = coords - base
+    
+    result = np.zeros(coords.shape[:-1], dtype=np.float32)
+    for dz in (0, 1):
+        for dy in (0, 1):
+            for dx in (0, 1):
+                weight = (
+                    (frac[..., 0] if dz else 1 - frac[..., 0])
+                    * (frac[..., 1] if dy else 1 - frac[..., 1])
+                    * (frac[..., 2] if dx else 1 - frac[..., 2])
+                )
+                z = np.minimum(base[..., 0] + dz, shape[0] - 1)
+                y = np.minimum(base[..., 1] + dy, shape[1] - 1)
+                x = np.minimum(base[..., 2] + dx, shape[2] - 1)
+                result += weight * voxels[z, y, x]
+    result[~inside] = voxels.min()
+    return result
+
+def reformat_volume(volume: Dict[str, Any], plane: str, position: Optional[int], thickness_mm: float,
+                    mode: str, normal: Optional[List[float]] = None) -> tuple:
+    """Cut a plane or slab out of a series volume. Returns (modality values, (row, column) spacing).
+    
+    Orthogonal positions are voxel indices along the plane axis; oblique positions are mm offsets
+    along the normal from the volume centre.
+    """
+    voxels = volume["voxels"]
+    dz, dy, dx = volume["spacing"]
+    depth, height, width = voxels.shape
+    
+    if plane == "axial":
+        index = depth // 2 if position is None else position
+        image = _project_slab(voxels[_slab_indices(index, thickness_mm, dz, depth)], 0, mode)
+        pixel_spacing = (dy, dx)
+    elif plane == "coronal":
+        index = height // 2 if position is None else position
+        image = _project_slab(voxels[:, _slab_indices(index, thickness_mm, dy, height), :], 1, mode)[::-1]
+        pixel_spacing = (dz, dx)
+    elif plane == "sagittal":
+        index = width // 2 if position is None else position
+        image = _project_slab(voxels[:, :, _slab_indices(index, thickness_mm, dx, width)], 2, mode)[::-1]
+        pixel_spacing = (dz, dy)
+    elif plane == "oblique":
+        if not normal or len(normal) != 3:
+            raise ValueError("Oblique planes need a normal as three comma-separated values (z,y,x)")
+        image = sample_oblique_plane(voxels, volume["spacing"], normal, float(position or 0), thickness_mm, mode)
+        pixel_spacing = (min(dz, dy, dx),) * 2
+    else:
+        raise ValueError(f"Unknown plane: {plane}")
+    
+    return image.astype(np.float32) * volume["slope"] + volume["intercept"], pixel_spacing
+
+def encode_reformat_png(image: np.ndarray, pixel_spacing, center, width, invert: bool) -> bytes:
+    """Window a reformatted plane and encode it as PNG with square display pixels"""
+    display = Image.fromarray(apply_window(image, center, width, invert))
+    row_spacing, column_spacing = pixel_spacing
+    if row_spacing and column_spacing and abs(row_spacing - column_spacing) > 1e-3:
+        display = display.resize((display.width, max(int(round(display.height * row_spacing / column_spacing)), 1)), Image.BILINEAR)
+    output = io.BytesIO()
+    display.save(output, format="PNG")
+    return output.getvalue()
+
+# ==================== JOB QUEUE ====================
+# Durable background work stored in the jobs collection. A worker claims the most urgent due
+# job with a lease and keeps extending it while the handler runs. A job whose worker dies
+# becomes claimable again once the lease expires. Failures are retried with exponential
+# backoff, and jobs that exhaust their attempts are dead-lettered for an admin to inspect.
+# Jobs are consumed by `python -m worker` and by EMBEDDED_JOB_WORKERS tasks in the API process.
+
+class JobPriority:
+    LOW = 0
+    NORMAL = 5
+    HIGH = 10
+
+JOB_HANDLERS = {}
+
+def job_handler(job_type: str):
+    """Register an async function(payload, job) as the handler of a job type"""
+    def register(func):
+        JOB_HANDLERS[job_type] = func
+        return func
+    return register
+
+async def enqueue_job(
+    job_type: str,
+    payload: Dict[str, Any],
+    priority: int = JobPriority.NORMAL,
+    max_attempts: Optional[int] = None,
+    dedupe_key: Optional[str] = None,
+    run_after: Optional[datetime] = None
+) -> str:
+    """Queue a job and return its id. With a dedupe_key, an equal job that is still pending is reused.
+    
+    The unique index on pending_dedupe_key makes this safe against concurrent enqueues.
+    """
+    pending = {"pending_dedupe_key": dedupe_key}
+    if dedupe_key:
+        existing = await db.jobs.find_one(pending, {"id": 1})
+        if existing:
+            return existing["id"]
+    
+    now = datetime.now(timezone.utc)
+    job = Job(
+        id=f"job_{uuid.uuid4().hex}",
+        type=job_type,
+        payload=payload,
+        priority=priority,
+        status="queued",
+        max_attempts=max_attempts or JOB_MAX_ATTEMPTS,
+        dedupe_key=dedupe_key,
+        pending_dedupe_key=dedupe_key,
+        run_after=run_after or now,
+        created_at=now,
+        updated_at=now
+    )
     try:
-        # Parse DICOM data with force=True to handle files without proper DICM header
-        ds = pydicom.dcmread(io.BytesIO(file_data), force=True)
+        await db.jobs.insert_one(job.dict())
+    except DuplicateKeyError:
+        existing = await db.jobs.find_one(pending, {"id": 1})
+        if not existing:
+            # The competing job finished in between; queue ours after all
+            return await enqueue_job(job_type, payload, priority, max_attempts, dedupe_key, run_after)
+        return existing["id"]
+    return job.id
+
+async def schedule_periodic_job(
+    job_type: str,
+    interval: timedelta,
+    payload: Optional[Dict[str, Any]] = None,
+    current_job: Optional[Dict[str, Any]] = None
+):
+    """Make sure the next run of a periodic job is pending.
+    
+    Called at startup and by the job itself on its first attempt (passing current_job),
+    so the schedule survives restarts and failing runs without piling up duplicates.
+    """
+    if current_job and current_job["attempts"] > 1:
+        return
+    pending = {"type": job_type, "payload.scheduled": True, "status": {"$in": ["queued", "running"]}}
+    if current_job:
+        pending["id"] = {"$ne": current_job["id"]}
+    if await db.jobs.find_one(pending, {"_id": 1}):
+        return
+    await enqueue_job(
+        job_type, {**(payload or {}), "scheduled": True}, priority=JobPriority.LOW,
+        run_after=datetime.now(timezone.utc) + interval
+    )
+
+async def claim_job(worker_id: str, job_types: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """Lease the most urgent due job, including jobs whose previous lease expired"""
+    while True:
+        now = datetime.now(timezone.utc)
+        query = {"$or": [
+            {"status": "queued", "run_after": {"$lte": now}},
+            {"status": "running", "lease_expires_at": {"$lt": now}}
+        ]}
+        if job_types:
+            query["type"] = {"$in": job_types}
         
-        # Update patient information if provided
-        if "patient_name" in patient_updates:
-            ds.PatientName = patient_updates["patient_name"]
-        if "patient_id" in patient_updates:
-            ds.PatientID = patient_updates["patient_id"]
-        if "patient_birth_date" in patient_updates:
-            ds.PatientBirthDate = patient_updates["patient_birth_date"]
-        if "patient_gender" in patient_updates:
-            ds.PatientSex = patient_updates["patient_gender"]
-        if "patient_age" in patient_updates:
-            ds.PatientAge = patient_updates["patient_age"]
-            
-        # Update study information if provided
-        if "study_description" in patient_updates:
-            ds.StudyDescription = patient_updates["study_description"]
-        if "accession_number" in patient_updates:
-            ds.AccessionNumber = patient_updates["accession_number"]
-            
-        # Save modified DICOM to bytes
-        output = io.BytesIO()
-        ds.save_as(output)
-        return output.getvalue()
+        job = await db.jobs.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": "running",
+                    "leased_by": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("priority", -1), ("run_after", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if not job or job["attempts"] <= job["max_attempts"]:
+            return job
         
+        # Its workers kept dying (lease expired on the last attempt): stop handing it out
+        await _dead_letter_job(job, job.get("last_error") or "Lease expired on the final attempt")
+
+async def _dead_letter_job(job: Dict[str, Any], error: str):
+    now = datetime.now(timezone.utc)
+    await db.jobs.update_one(
+        {"id": job["id"], "leased_by": job["leased_by"]},
+        {
+            "$set": {"status": "dead", "last_error": error, "lease_expires_at": None, "updated_at": now, "finished_at": now},
+            "$unset": {"pending_dedupe_key": ""}
+        }
+    )
+    logging.error(f"Job {job['id']} ({job['type']}) dead-lettered after {job['attempts']} attempts: {error}")
+
+async def _extend_job_lease(job: Dict[str, Any]):
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        await db.jobs.update_one(
+            {"id": job["id"], "leased_by": job["leased_by"], "status": "running"},
+            {"$set": {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=JOB_LEASE_SECONDS)}}
+        )
+
+async def execute_job(job: Dict[str, Any]):
+    """Run a leased job's handler and record the outcome"""
+    handler = JOB_HANDLERS.get(job["type"])
+    heartbeat = asyncio.create_task(_extend_job_lease(job))
+    try:
+        if not handler:
+            raise RuntimeError(f"No handler for job type '{job['type']}'")
+        result = await handler(job["payload"], job)
     except Exception as e:
-        logging.error(f"Failed to modify DICOM metadata: {str(e)}")
-        return file_data  # Return original if modification fails
+        error = f"{type(e).__name__}: {e}"
+        if job["attempts"] >= job["max_attempts"]:
+            await _dead_letter_job(job, error)
+            return
+        delay = JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+        await db.jobs.update_one(
+            {"id": job["id"], "leased_by": job["leased_by"]},
+            {"$set": {
+                "status": "queued",
+                "last_error": error,
+                "leased_by": None,
+                "lease_expires_at": None,
+                "run_after": datetime.now(timezone.utc) + timedelta(seconds=delay),
+                "updated_at": datetime.now(timezone.utc)
+            }}
+        )
+        logging.warning(f"Job {job['id']} ({job['type']}) failed on attempt {job['attempts']}, retrying in {delay}s: {error}")
+        return
+    finally:
+        heartbeat.cancel()
+    
+    now = datetime.now(timezone.utc)
+    await db.jobs.update_one(
+        {"id": job["id"], "leased_by": job["leased_by"]},
+        {
+            "$set": {
+                "status": "completed",
+                "result": result,
+                "last_error": None,
+                "lease_expires_at": None,
+                "updated_at": now,
+                "finished_at": now
+            },
+            "$unset": {"pending_dedupe_key": ""}
+        }
+    )
+
+async def run_job_worker(worker_id: str, stop: asyncio.Event, job_types: Optional[List[str]] = None):
+    """Claim and run jobs until `stop` is set"""
+    while not stop.is_set():
+        try:
+            job = await claim_job(worker_id, job_types)
+        except Exception as e:
+            logging.error(f"Job worker {worker_id} could not claim a job: {e}")
+            job = None
+        if job:
+            await execute_job(job)
+            continue
+        try:
+            await asyncio.wait_for(stop.wait(), JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+@api_router.get("/admin/jobs", response_model=List[Job])
+async def get_jobs(
+    status: Optional[str] = None,
+    job_type: Optional[str] = None,
+    limit: int = 100,
+    current_user: User = Depends(get_current_user)
+):
+    """List background jobs, e.g. status=dead for the dead-letter queue"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can view background jobs")
+    
+    query = {}
+    if status:
+        query["status"] = status
+    if job_type:
+        query["type"] = job_type
+    jobs = await db.jobs.find(query, {"_id": 0}).sort("updated_at", -1).to_list(min(limit, 1000))
+    return [Job(**job) for job in jobs]
+
+@api_router.post("/admin/jobs/{job_id}/retry", response_model=Job)
+async def retry_dead_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Put a dead-lettered job back in the queue with a fresh set of attempts"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can retry background jobs")
+    
+    dead = await db.jobs.find_one({"id": job_id, "status": "dead"}, {"dedupe_key": 1})
+    if not dead:
+        raise HTTPException(status_code=404, detail="No dead-lettered job with this id")
+    
+    now = datetime.now(timezone.utc)
+    try:
+        job = await db.jobs.find_one_and_update(
+            {"id": job_id, "status": "dead"},
+            {"$set": {
+                "status": "queued", "attempts": 0, "run_after": now, "updated_at": now, "finished_at": None,
+                "pending_dedupe_key": dead.get("dedupe_key")
+            }},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="An equal job is already queued or running")
+    if not job:
+        raise HTTPException(status_code=404, detail="No dead-lettered job with this id")
+    return Job(**job)
 
 # ==================== AUTH ROUTES ====================
 
@@ -356,7 +2843,7 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Hash password
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     
     # Create user document
     user_dict = {
@@ -367,6 +2854,7 @@ async def register(user_data: UserCreate):
         "role": user_data.role,
         "centre_id": user_data.centre_id,
         "phone": user_data.phone,
+        "modalities": user_data.modalities,
         "created_at": datetime.now(timezone.utc),
         "is_active": True
     }
@@ -380,13 +2868,20 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login", response_model=Token)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password"]):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    valid, new_hash = await verify_and_update_password(credentials.password, user["password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     if not user.get("is_active", True):
         raise HTTPException(status_code=403, detail="Account is deactivated")
     
-    access_token = create_access_token(data={"sub": user["email"]})
+    # Upgrade the stored hash only once the login is actually allowed
+    if new_hash:
+        await db.users.update_one({"id": user["id"], "password": user["password"]}, {"$set": {"password": new_hash}})
+    
+    access_token = create_user_token(user)
     
     user.pop("password")
     return Token(
@@ -399,6 +2894,57 @@ async def login(credentials: UserLogin):
 async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
+@api_router.post("/api-keys")
+async def create_api_key(key_data: ApiKeyCreate, current_user: User = Depends(get_current_user)):
+    """Create a scoped API key for a modality gateway or integration. The key is only shown once."""
+    if current_user.role not in [UserRole.ADMIN, UserRole.CENTRE]:
+        raise HTTPException(status_code=403, detail="Only admins and centres can create API keys")
+    
+    unknown_scopes = set(key_data.scopes) - set(API_KEY_SCOPES)
+    if not key_data.scopes or unknown_scopes:
+        raise HTTPException(status_code=400, detail=f"Scopes must be chosen from: {', '.join(API_KEY_SCOPES)}")
+    
+    # Centre users can only create keys for their own centre
+    centre_id = key_data.centre_id if current_user.role == UserRole.ADMIN else current_user.centre_id
+    
+    key_id = f"apikey_{uuid.uuid4().hex[:12]}"
+    key = f"{API_KEY_PREFIX}{key_id[7:]}_{secrets.token_urlsafe(32)}"
+    api_key = ApiKey(
+        id=key_id,
+        name=key_data.name,
+        prefix=key[:len(API_KEY_PREFIX) + 12],
+        centre_id=centre_id,
+        scopes=key_data.scopes,
+        created_by=current_user.id,
+        created_at=datetime.now(timezone.utc)
+    )
+    await db.api_keys.insert_one({**api_key.dict(), "key_hash": hash_api_key(key)})
+    
+    return {**api_key.dict(), "key": key}
+
+@api_router.get("/api-keys", response_model=List[ApiKey])
+async def get_api_keys(current_user: User = Depends(get_current_user)):
+    if current_user.role not in [UserRole.ADMIN, UserRole.CENTRE]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    query = {} if current_user.role == UserRole.ADMIN else {"centre_id": current_user.centre_id}
+    api_keys = await db.api_keys.find(query, {"_id": 0, "key_hash": 0}).to_list(1000)
+    return [ApiKey(**k) for k in api_keys]
+
+@api_router.delete("/api-keys/{key_id}")
+async def revoke_api_key(key_id: str, current_user: User = Depends(get_current_user)):
+    if current_user.role not in [UserRole.ADMIN, UserRole.CENTRE]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    api_key = await db.api_keys.find_one({"id": key_id})
+    if not api_key or (current_user.role == UserRole.CENTRE and api_key.get("centre_id") != current_user.centre_id):
+        raise HTTPException(status_code=404, detail="API key not found")
+    
+    await db.api_keys.update_one({"id": key_id}, {"$set": {"revoked": True}})
+    api_key_cache.pop(api_key["key_hash"], None)
+    
+    return {"message": "API key revoked"}
+
 # ==================== DIAGNOSTIC CENTRE ROUTES ====================
 
 @api_router.post("/centres", response_model=DiagnosticCentre)
@@ -451,12 +2997,140 @@ async def toggle_user_active(user_id: str, current_user: User = Depends(get_curr
         raise HTTPException(status_code=404, detail="User not found")
     
     new_status = not user.get("is_active", True)
-    await db.users.update_one({"id": user_id}, {"$set": {"is_active": new_status}})
+    await db.users.update_one({"id": user_id}, {"$set": {"is_active": new_status}, "$inc": {"token_version": 1}})
+    invalidate_principal(user["email"])
     
     return {"message": "User status updated", "is_active": new_status}
 
+@api_router.patch("/users/{user_id}/role")
+async def update_user_role(
+    user_id: str,
+    role: str = Body(...),
+    centre_id: Optional[str] = Body(None),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can change user roles")
+    
+    valid_roles = [value for key, value in vars(UserRole).items() if key.isupper()]
+    if role not in valid_roles:
+        raise HTTPException(status_code=400, detail=f"Role must be one of: {', '.join(valid_roles)}")
+    
+    user = await db.users.find_one({"id": user_id})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # Existing tokens carry the old role, so they stop working
+    await db.users.update_one(
+        {"id": user_id}, {"$set": {"role": role, "centre_id": centre_id}, "$inc": {"token_version": 1}}
+    )
+    invalidate_principal(user["email"])
+    
+    return {"message": "User role updated", "role": role, "centre_id": centre_id}
+
+@api_router.patch("/users/{user_id}/modalities")
+async def update_user_modalities(
+    user_id: str,
+    modalities: List[str] = Body(..., embed=True),
+    current_user: User = Depends(get_current_user)
+):
+    """Set the modalities a radiologist is credentialed to read (empty: all)"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can change reading credentials")
+    
+    modalities = sorted({modality.strip() for modality in modalities if modality.strip()})
+    result = await db.users.update_one({"id": user_id}, {"$set": {"modalities": modalities}})
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="User not found")
+    radiologist_roster_cache.clear()
+    
+    return {"message": "Reading credentials updated", "modalities": modalities}
+
 # ==================== DICOM STUDY ROUTES ====================
 
+@job_handler("process_study_upload")
+async def process_study_upload(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    """Post-upload work for stored files: metadata, instance index, pyramids and the AI report stub.
+    
+    Every step is idempotent, so a retried job redoes the whole list safely.
+    """
+    study_id, modality = payload["study_id"], payload["modality"]
+    dicom_metadata = {}
+    duplicate_sop_instance_uids = []
+    
+    for entry in payload["files"]:
+        content = await read_instance(entry["file_id"])
+        
+        # Extract DICOM metadata from the first file
+        if not dicom_metadata:
+            dicom_metadata = await run_cpu_bound(extract_dicom_metadata, content)
+        
+        duplicate_sop_uid = await index_instance(entry["file_id"], study_id, content, entry.get("compression"))
+        if duplicate_sop_uid:
+            duplicate_sop_instance_uids.append(duplicate_sop_uid)
+        
+        # Large CR/DX/MG images get a preview pyramid
+        if not await db.image_pyramids.find_one({"file_id": entry["file_id"]}, {"_id": 1}):
+            await generate_image_pyramid(entry["file_id"], study_id, content)
+    
+    if duplicate_sop_instance_uids:
+        await db.studies.update_one(
+            {"$or": [{"study_id": study_id}, {"id": study_id}]},
+            {"$addToSet": {"duplicate_sop_instance_uids": {"$each": duplicate_sop_instance_uids}}}
+        )
+    
+    if payload.get("ai_report_id"):
+        # Generate AI report with DICOM metadata context
+        findings = []
+        if dicom_metadata:
+            findings.append(f"DICOM study processed: {dicom_metadata.get('study_description', 'Unknown study')}")
+            findings.append(f"Modality: {dicom_metadata.get('modality', modality)}")
+            findings.append(f"Institution: {dicom_metadata.get('institution_name', 'Unknown')}")
+            if dicom_metadata.get('manufacturer'):
+                findings.append(f"Equipment: {dicom_metadata.get('manufacturer')} {dicom_metadata.get('manufacturer_model', '')}")
+        else:
+            findings.append(f"Study uploaded for {modality} imaging")
+            findings.append("DICOM metadata extraction pending")
+        
+        ai_report_dict = {
+            "id": payload["ai_report_id"],
+            "study_id": study_id,
+            "findings": ". ".join(findings),
+            "preliminary_diagnosis": f"DICOM {modality} study - Metadata extracted successfully" if dicom_metadata else f"{modality} study uploaded - Awaiting processing",
+            "confidence_score": 0.95 if dicom_metadata else 0.80,
+            "generated_at": datetime.now(timezone.utc),
+            "model_version": "DICOM-Metadata-v1.0"
+        }
+        await db.ai_reports.replace_one({"id": ai_report_dict["id"]}, ai_report_dict, upsert=True)
+    
+    return {"files": len(payload["files"]), "duplicate_sop_instance_uids": duplicate_sop_instance_uids}
+
+@job_handler("delete_study")
+async def delete_study_job(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    """Delete a tombstoned study: instances and blobs in bulk, then reports, then the study itself.
+    
+    Every step is idempotent, so a failed attempt is simply retried by the queue.
+    """
+    study = await db.studies.find_one({"id": payload["study_id"]})
+    if not study:
+        return {"files": 0, "blobs": 0, "bytes": 0}
+    
+    file_ids = study.get("file_ids", [])
+    removed = {"blobs": 0, "bytes": 0}
+    for start in range(0, len(file_ids), 500):
+        batch = await delete_instances(file_ids[start:start + 500])
+        removed["blobs"] += batch["blobs"]
+        removed["bytes"] += batch["bytes"]
+    
+    if study.get("ai_report_id"):
+        await db.ai_reports.delete_one({"id": study["ai_report_id"]})
+    if study.get("final_report_id"):
+        await db.final_reports.delete_one({"id": study["final_report_id"]})
+    await db.studies.delete_one({"id": study["id"]})
+    
+    logging.info(f"Deleted study {study['study_id']}: {len(file_ids)} files, {removed['blobs']} blobs, {removed['bytes']} bytes")
+    return {"files": len(file_ids), **removed}
+
 @api_router.post("/studies/upload", response_model=DicomStudy)
 async def upload_dicom_study(
     patient_name: str = Form(...),
@@ -464,61 +3138,47 @@ async def upload_dicom_study(
     patient_gender: str = Form(...),
     modality: str = Form(...),
     notes: Optional[str] = Form(None),
+    priority: str = Form(StudyPriority.ROUTINE),
     files: List[UploadFile] = File(...),
     current_user: User = Depends(get_current_user)
 ):
     if current_user.role != UserRole.TECHNICIAN:
         raise HTTPException(status_code=403, detail="Only technicians can upload studies")
+    priority = priority.lower()
+    if priority not in STUDY_SLA_MINUTES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of: {', '.join(STUDY_SLA_MINUTES)}")
     
     # Generate study ID
     study_id = generate_study_id()
     
-    # Upload files to GridFS and extract DICOM metadata
+    # Upload files to blob storage
     file_ids = []
-    dicom_metadata = {}
+    duplicate_sop_instance_uids = []
     
+    dicom_files = []
     for file in files:
         content = await file.read()
         
-        # Extract DICOM metadata from the first file
-        if not dicom_metadata and file.filename.lower().endswith('.dcm'):
-            dicom_metadata = extract_dicom_metadata(content)
+        compression = None
+        if file.filename.lower().endswith('.dcm'):
+            content, compression = await prepare_for_storage(content)
         
-        file_id = await fs.upload_from_stream(
+        file_id = await store_instance(
             f"{study_id}_{file.filename}",
-            io.BytesIO(content),
-            metadata={
+            content,
+            {
                 "study_id": study_id, 
-                "original_name": file.filename,
-                "dicom_metadata": dicom_metadata if file.filename.lower().endswith('.dcm') else {}
+                "original_name": file.filename
             }
         )
-        file_ids.append(str(file_id))
-    
-    # Generate AI report with DICOM metadata context
-    findings = []
-    if dicom_metadata:
-        findings.append(f"DICOM study processed: {dicom_metadata.get('study_description', 'Unknown study')}")
-        findings.append(f"Modality: {dicom_metadata.get('modality', modality)}")
-        findings.append(f"Institution: {dicom_metadata.get('institution_name', 'Unknown')}")
-        if dicom_metadata.get('manufacturer'):
-            findings.append(f"Equipment: {dicom_metadata.get('manufacturer')} {dicom_metadata.get('manufacturer_model', '')}")
-    else:
-        findings.append(f"Study uploaded for {modality} imaging")
-        findings.append("DICOM metadata extraction pending")
+        file_ids.append(file_id)
+        if file.filename.lower().endswith('.dcm'):
+            dicom_files.append({"file_id": file_id, "compression": compression})
     
-    ai_report_dict = {
-        "id": f"ai_{generate_study_id()}",
-        "study_id": study_id,
-        "findings": ". ".join(findings),
-        "preliminary_diagnosis": f"DICOM {modality} study - Metadata extracted successfully" if dicom_metadata else f"{modality} study uploaded - Awaiting processing",
-        "confidence_score": 0.95 if dicom_metadata else 0.80,
-        "generated_at": datetime.now(timezone.utc),
-        "model_version": "DICOM-Metadata-v1.0"
-    }
-    await db.ai_reports.insert_one(ai_report_dict)
+    ai_report_id = f"ai_{generate_study_id()}"
     
     # Create study document
+    uploaded_at = datetime.now(timezone.utc)
     study_dict = {
         "id": f"study_{generate_study_id()}",
         "study_id": study_id,
@@ -532,16 +3192,29 @@ async def upload_dicom_study(
         "status": "pending",
         "notes": notes,
         "file_ids": file_ids,
-        "uploaded_at": datetime.now(timezone.utc),
-        "ai_report_id": ai_report_dict["id"],
+        "uploaded_at": uploaded_at,
+        "priority": priority,
+        "sla_deadline": study_sla_deadline(priority, uploaded_at),
+        "ai_report_id": ai_report_id,
         "final_report_id": None,
         "is_draft": False,
         "delete_requested": False,
         "delete_requested_at": None,
-        "delete_requested_by": None
+        "delete_requested_by": None,
+        "duplicate_sop_instance_uids": duplicate_sop_instance_uids
     }
     
     await db.studies.insert_one(study_dict)
+    
+    # Metadata extraction, indexing, pyramids and the AI report run on the job queue, once the study exists
+    await enqueue_job("process_study_upload", {
+        "study_id": study_id,
+        "modality": modality,
+        "files": dicom_files,
+        "ai_report_id": ai_report_id
+    }, priority=JobPriority.HIGH)
+    if AUTO_ASSIGN_ENABLED:
+        await enqueue_job("auto_assign_study", {"study_id": study_dict["id"]})
     return DicomStudy(**study_dict)
 
 @api_router.get("/studies", response_model=List[DicomStudy])
@@ -549,6 +3222,7 @@ async def get_studies(
     study_status: Optional[str] = None,
     centre_id: Optional[str] = None,
     radiologist_id: Optional[str] = None,
+    priority: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     query = {}
@@ -562,12 +3236,22 @@ async def get_studies(
         if radiologist_id:
             query["radiologist_id"] = radiologist_id
     
+    # Tombstoned studies are on their way out
+    query["deleted_at"] = None
+    
     if study_status:
         query["status"] = study_status
+    if priority:
+        query["priority"] = priority
     if centre_id and current_user.role == UserRole.ADMIN:
         query["centre_id"] = centre_id
     
-    studies = await db.studies.find(query).sort("uploaded_at", -1).to_list(1000)
+    # The pending worklist is read most urgent first: earliest SLA deadline, which ages routine studies upward
+    if study_status == "pending":
+        sort = [("sla_deadline", 1), ("uploaded_at", 1)]
+    else:
+        sort = [("uploaded_at", -1)]
+    studies = await db.studies.find(query).sort(sort).to_list(1000)
     
     # Transform MongoDB documents to match DicomStudy model
     result = []
@@ -592,7 +3276,12 @@ async def get_studies(
             "is_draft": study.get("is_draft", False),
             "delete_requested": study.get("delete_requested", False),
             "delete_requested_at": study.get("delete_requested_at"),
-            "delete_requested_by": study.get("delete_requested_by")
+            "delete_requested_by": study.get("delete_requested_by"),
+            "assigned_at": study.get("assigned_at"),
+            "claim_expires_at": study.get("claim_expires_at"),
+            "opened_at": study.get("opened_at"),
+            "priority": study.get("priority", StudyPriority.ROUTINE),
+            "sla_deadline": study.get("sla_deadline")
         }
         result.append(DicomStudy(**study_data))
     
@@ -600,9 +3289,11 @@ async def get_studies(
 
 @api_router.get("/studies/{study_id}", response_model=DicomStudy)
 async def get_study(study_id: str, current_user: User = Depends(get_current_user)):
-    study = await db.studies.find_one({"study_id": study_id})
+    study = await db.studies.find_one({"study_id": study_id, "deleted_at": None})
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
+    # Opening a claimed study in the viewer marks it as being read and keeps the claim alive
+    await touch_study_claim(study, current_user.id)
     
     # Transform MongoDB document to match DicomStudy model
     study_data = {
@@ -624,7 +3315,12 @@ async def get_study(study_id: str, current_user: User = Depends(get_current_user
         "is_draft": study.get("is_draft", False),
         "delete_requested": study.get("delete_requested", False),
         "delete_requested_at": study.get("delete_requested_at"),
-        "delete_requested_by": study.get("delete_requested_by")
+        "delete_requested_by": study.get("delete_requested_by"),
+        "assigned_at": study.get("assigned_at"),
+        "claim_expires_at": study.get("claim_expires_at"),
+        "opened_at": study.get("opened_at"),
+        "priority": study.get("priority", StudyPriority.ROUTINE),
+        "sla_deadline": study.get("sla_deadline")
     }
     
     return DicomStudy(**study_data)
@@ -678,6 +3374,7 @@ async def search_studies(
     # Filter out drafts unless explicitly requested
     if not search_params.get("include_drafts"):
         query["is_draft"] = {"$ne": True}
+    query["deleted_at"] = None
     
     studies = await db.studies.find(query).sort("uploaded_at", -1).to_list(1000)
     
@@ -704,7 +3401,12 @@ async def search_studies(
             "is_draft": study.get("is_draft", False),
             "delete_requested": study.get("delete_requested", False),
             "delete_requested_at": study.get("delete_requested_at"),
-            "delete_requested_by": study.get("delete_requested_by")
+            "delete_requested_by": study.get("delete_requested_by"),
+            "assigned_at": study.get("assigned_at"),
+            "claim_expires_at": study.get("claim_expires_at"),
+            "opened_at": study.get("opened_at"),
+            "priority": study.get("priority", StudyPriority.ROUTINE),
+            "sla_deadline": study.get("sla_deadline")
         }
         result.append(DicomStudy(**study_data))
     
@@ -716,7 +3418,7 @@ async def request_delete_study(study_id: str, current_user: User = Depends(get_c
     if current_user.role != UserRole.TECHNICIAN:
         raise HTTPException(status_code=403, detail="Only technicians can request deletion")
     
-    study = await db.studies.find_one({"study_id": study_id})
+    study = await db.studies.find_one({"study_id": study_id, "deleted_at": None})
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
     
@@ -740,7 +3442,7 @@ async def mark_study_as_draft(study_id: str, current_user: User = Depends(get_cu
     if current_user.role != UserRole.TECHNICIAN:
         raise HTTPException(status_code=403, detail="Only technicians can mark studies as draft")
     
-    study = await db.studies.find_one({"study_id": study_id})
+    study = await db.studies.find_one({"study_id": study_id, "deleted_at": None})
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
     
@@ -760,7 +3462,7 @@ async def unmark_study_draft(study_id: str, current_user: User = Depends(get_cur
     if current_user.role != UserRole.TECHNICIAN:
         raise HTTPException(status_code=403, detail="Only technicians can unmark drafts")
     
-    study = await db.studies.find_one({"study_id": study_id})
+    study = await db.studies.find_one({"study_id": study_id, "deleted_at": None})
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
     
@@ -780,29 +3482,23 @@ async def approve_delete_request(study_id: str, current_user: User = Depends(get
     if current_user.role not in [UserRole.CENTRE, UserRole.ADMIN]:
         raise HTTPException(status_code=403, detail="Only centre managers or admins can approve deletion")
     
-    study = await db.studies.find_one({"study_id": study_id})
+    study = await db.studies.find_one({"study_id": study_id, "deleted_at": None})
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
     
     if not study.get("delete_requested"):
         raise HTTPException(status_code=400, detail="No delete request for this study")
     
-    # Delete files from GridFS
-    for file_id in study.get("file_ids", []):
-        try:
-            from bson import ObjectId
-            await fs.delete(ObjectId(file_id))
-        except Exception as e:
-            logger.warning(f"Failed to delete file {file_id}: {e}")
-    
-    # Delete study
-    await db.studies.delete_one({"study_id": study_id})
-    
-    # Delete associated reports
-    if study.get("ai_report_id"):
-        await db.ai_reports.delete_one({"id": study["ai_report_id"]})
-    if study.get("final_report_id"):
-        await db.final_reports.delete_one({"id": study["final_report_id"]})
+    # Tombstone the study so it disappears from every listing; the job queue removes files and reports
+    await db.studies.update_one(
+        {"study_id": study_id},
+        {"$set": {
+            "status": "deleting",
+            "deleted_at": datetime.now(timezone.utc),
+            "deleted_by": current_user.id
+        }}
+    )
+    await enqueue_job("delete_study", {"study_id": study["id"]}, priority=JobPriority.LOW, dedupe_key=f"delete_study:{study['id']}")
     
     return {"message": "Study deleted successfully"}
 
@@ -812,7 +3508,7 @@ async def reject_delete_request(study_id: str, current_user: User = Depends(get_
     if current_user.role not in [UserRole.CENTRE, UserRole.ADMIN]:
         raise HTTPException(status_code=403, detail="Only centre managers or admins can reject deletion")
     
-    study = await db.studies.find_one({"study_id": study_id})
+    study = await db.studies.find_one({"study_id": study_id, "deleted_at": None})
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
     
@@ -827,27 +3523,330 @@ async def reject_delete_request(study_id: str, current_user: User = Depends(get_
     
     return {"message": "Delete request rejected"}
 
+def claimable_study_filter(now: datetime) -> Dict[str, Any]:
+    """Studies a radiologist may claim: pending, or assigned under a claim that has lapsed"""
+    return {
+        "deleted_at": None,
+        "is_draft": {"$ne": True},
+        "$or": [
+            {"status": "pending"},
+            {"status": "assigned", "final_report_id": None, "claim_expires_at": {"$lt": now}}
+        ]
+    }
+
+def study_claim_update(radiologist_id: str, now: datetime, automatic: bool = False) -> Dict[str, Any]:
+    return {"$set": {
+        "radiologist_id": radiologist_id,
+        "status": "assigned",
+        "assigned_at": now,
+        "auto_assigned": automatic,
+        "claim_expires_at": now + timedelta(minutes=STUDY_CLAIM_LEASE_MINUTES) if STUDY_CLAIM_LEASE_MINUTES > 0 else None,
+        "opened_at": None
+    }}
+
+async def touch_study_claim(study: Dict[str, Any], radiologist_id: str):
+    """Note that the assigned radiologist opened the study, and extend their claim when a lease is set.
+    
+    The claim is only extended once less than half the lease remains, so repeated views do not
+    write (and broadcast) the study on every request.
+    """
+    if study.get("status") != "assigned" or study.get("radiologist_id") != radiologist_id:
+        return
+    now = datetime.now(timezone.utc)
+    updates = {}
+    if not study.get("opened_at"):
+        updates["opened_at"] = now
+    if STUDY_CLAIM_LEASE_MINUTES > 0:
+        lease = timedelta(minutes=STUDY_CLAIM_LEASE_MINUTES)
+        expires = study.get("claim_expires_at")
+        if expires and expires.tzinfo is None:
+            expires = expires.replace(tzinfo=timezone.utc)
+        if not expires or expires - now < lease / 2:
+            updates["claim_expires_at"] = now + lease
+    if not updates:
+        return
+    result = await db.studies.update_one(
+        {"id": study["id"], "status": "assigned", "radiologist_id": radiologist_id}, {"$set": updates}
+    )
+    if result.modified_count:
+        study.update(updates)
+
+async def release_expired_study_claims() -> int:
+    """Put studies whose claim lapsed without a report back on the worklist"""
+    result = await db.studies.update_many(
+        {"status": "assigned", "final_report_id": None, "claim_expires_at": {"$lt": datetime.now(timezone.utc)}},
+        {"$set": {"status": "pending", "radiologist_id": None, "assigned_at": None, "auto_assigned": False, "claim_expires_at": None, "opened_at": None}}
+    )
+    if result.modified_count:
+        logging.info(f"Released {result.modified_count} expired study claims")
+    return result.modified_count
+
+@job_handler("release_study_claims")
+async def release_study_claims_job(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    if STUDY_CLAIM_LEASE_MINUTES > 0:
+        await schedule_periodic_job("release_study_claims", timedelta(seconds=STUDY_CLAIM_SWEEP_SECONDS), current_job=job)
+    return {"released": await release_expired_study_claims()}
+
 @api_router.patch("/studies/{study_id}/assign")
 async def assign_study(study_id: str, current_user: User = Depends(get_current_user)):
+    """Claim a study atomically. Claiming your own study again renews the claim"""
     if current_user.role != UserRole.RADIOLOGIST:
         raise HTTPException(status_code=403, detail="Only radiologists can assign studies to themselves")
     
-    study = await db.studies.find_one({"study_id": study_id})
+    now = datetime.now(timezone.utc)
+    query = claimable_study_filter(now)
+    query["$or"].append({"status": "assigned", "radiologist_id": current_user.id})
+    query["study_id"] = study_id
+    
+    study = await db.studies.find_one_and_update(query, study_claim_update(current_user.id, now), {"_id": 1})
     if not study:
-        raise HTTPException(status_code=404, detail="Study not found")
+        if not await db.studies.find_one({"study_id": study_id, "deleted_at": None}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Study not found")
+        raise HTTPException(status_code=409, detail="Study is already assigned or no longer open")
     
-    await db.studies.update_one(
-        {"study_id": study_id},
-        {"$set": {"radiologist_id": current_user.id, "status": "assigned"}}
+    return {"message": "Study assigned successfully"}
+
+@api_router.post("/studies/claim-next")
+async def claim_next_studies(
+    count: int = Body(1, embed=True),
+    modality: Optional[str] = Body(None, embed=True),
+    current_user: User = Depends(get_current_user)
+):
+    """Claim up to `count` of the next studies on the worklist, most urgent first"""
+    if current_user.role != UserRole.RADIOLOGIST:
+        raise HTTPException(status_code=403, detail="Only radiologists can claim studies")
+    if not 1 <= count <= STUDY_CLAIM_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"count must be between 1 and {STUDY_CLAIM_BATCH_LIMIT}")
+    
+    claimed = []
+    for _ in range(count):
+        now = datetime.now(timezone.utc)
+        query = claimable_study_filter(now)
+        if modality:
+            query["modality"] = modality
+        # Each claim is a single atomic document update, so concurrent callers never receive the same study
+        study = await db.studies.find_one_and_update(
+            query,
+            study_claim_update(current_user.id, now),
+            {"_id": 0, "study_id": 1, "claim_expires_at": 1},
+            sort=[("sla_deadline", 1), ("uploaded_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if not study:
+            break
+        claimed.append(study)
+    
+    return {"claimed": claimed, "count": len(claimed)}
+
+# ==================== AUTOMATIC ASSIGNMENT ====================
+
+async def get_radiologist_roster(fresh: bool = False) -> List[Dict[str, Any]]:
+    """Active radiologists with their modality credentials (upper-cased), cached briefly"""
+    roster = None if fresh else radiologist_roster_cache.get("roster")
+    if roster is None:
+        roster = [
+            {"id": user["id"], "name": user.get("name"), "modalities": {m.upper() for m in user.get("modalities") or []}}
+            async for user in db.users.find(
+                {"role": UserRole.RADIOLOGIST, "is_active": {"$ne": False}}, {"id": 1, "name": 1, "modalities": 1}
+            )
+        ]
+        radiologist_roster_cache["roster"] = roster
+    return roster
+
+async def get_radiologist_loads(roster: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Open studies and recent reports per radiologist, from one aggregation each"""
+    ids = [radiologist["id"] for radiologist in roster]
+    loads = {radiologist_id: {"open": 0, "reported": 0} for radiologist_id in ids}
+    
+    async for row in db.studies.aggregate([
+        {"$match": {"radiologist_id": {"$in": ids}, "status": "assigned", "deleted_at": None}},
+        {"$group": {"_id": "$radiologist_id", "count": {"$sum": 1}}}
+    ]):
+        loads[row["_id"]]["open"] = row["count"]
+    
+    since = datetime.now(timezone.utc) - timedelta(hours=AUTO_ASSIGN_THROUGHPUT_HOURS)
+    async for row in db.final_reports.aggregate([
+        {"$match": {"radiologist_id": {"$in": ids}, "approved_at": {"$gte": since}}},
+        {"$group": {"_id": "$radiologist_id", "count": {"$sum": 1}}}
+    ]):
+        loads[row["_id"]]["reported"] = row["count"]
+    return loads
+
+def team_reporting_prior(loads: Dict[str, Dict[str, Any]]) -> float:
+    """Average reports per radiologist over the throughput window (at least one), used as the rate prior"""
+    if not loads:
+        return 1.0
+    return max(sum(load["reported"] for load in loads.values()) / len(loads), 1.0)
+
+def radiologist_backlog_hours(load: Dict[str, Any], prior: float, open_studies: Optional[int] = None) -> float:
+    """Expected hours until a newly assigned study is reached, at the radiologist's recent reading rate.
+    
+    The rate is shrunk halfway toward the team average, so a quiet or new radiologist counts as at
+    most twice as slow as an average reader instead of being starved of work.
+    """
+    rate = (load["reported"] + prior) / (2 * AUTO_ASSIGN_THROUGHPUT_HOURS)
+    return ((load["open"] if open_studies is None else open_studies) + 1) / rate
+
+def pick_radiologist(
+    modality: str,
+    roster: List[Dict[str, Any]],
+    loads: Dict[str, Dict[str, Any]],
+    exclude: Optional[str] = None
+) -> Optional[str]:
+    """The credentialed radiologist with spare capacity who would reach the study soonest"""
+    candidates = [
+        radiologist["id"] for radiologist in roster
+        if radiologist["id"] != exclude
+        and (not radiologist["modalities"] or (modality or "").upper() in radiologist["modalities"])
+        and loads[radiologist["id"]]["open"] < AUTO_ASSIGN_MAX_OPEN
+    ]
+    if not candidates:
+        return None
+    prior = team_reporting_prior(loads)
+    return min(candidates, key=lambda radiologist_id: (
+        radiologist_backlog_hours(loads[radiologist_id], prior), loads[radiologist_id]["open"], radiologist_id
+    ))
+
+async def auto_assign_study(study: Dict[str, Any], roster: List[Dict[str, Any]], loads: Dict[str, Dict[str, Any]]) -> Optional[str]:
+    """Assign one pending study, keeping `loads` current. Studies claimed meanwhile are left alone"""
+    radiologist_id = pick_radiologist(study.get("modality"), roster, loads)
+    if not radiologist_id:
+        return None
+    
+    result = await db.studies.update_one(
+        {"id": study["id"], "status": "pending", "deleted_at": None, "is_draft": {"$ne": True}},
+        study_claim_update(radiologist_id, datetime.now(timezone.utc), automatic=True)
     )
+    if not result.modified_count:
+        return None
+    loads[radiologist_id]["open"] += 1
+    return radiologist_id
+
+@job_handler("auto_assign_study")
+async def auto_assign_study_job(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    """Incremental assignment of a fresh upload; unassignable studies wait for the next rebalancing pass"""
+    study = await db.studies.find_one({"id": payload["study_id"]}, {"id": 1, "modality": 1})
+    if not study:
+        return {"radiologist_id": None}
+    roster = await get_radiologist_roster()
+    return {"radiologist_id": await auto_assign_study(study, roster, await get_radiologist_loads(roster))}
+
+async def rebalance_assignments() -> Dict[str, int]:
+    """One periodic pass over the worklist.
     
-    return {"message": "Study assigned successfully"}
+    1. Automatic assignments held by radiologists who left the roster or lost the credential go back to pending.
+    2. The most recent automatic assignments nobody has opened yet move to radiologists who would reach them sooner.
+    3. Pending studies are assigned in SLA deadline order until nobody has spare capacity.
+    """
+    summary = {"released": 0, "moved": 0, "assigned": 0}
+    roster = await get_radiologist_roster(fresh=True)
+    unreported_auto = {"status": "assigned", "auto_assigned": True, "final_report_id": None}
+    release = {"$set": {"status": "pending", "radiologist_id": None, "assigned_at": None, "auto_assigned": False, "claim_expires_at": None, "opened_at": None}}
+    
+    result = await db.studies.update_many(
+        {**unreported_auto, "radiologist_id": {"$nin": [radiologist["id"] for radiologist in roster]}}, release
+    )
+    summary["released"] += result.modified_count
+    for radiologist in roster:
+        if radiologist["modalities"]:
+            result = await db.studies.update_many(
+                {**unreported_auto, "radiologist_id": radiologist["id"], "modality": {"$nin": list(radiologist["modalities"])}},
+                release
+            )
+            summary["released"] += result.modified_count
+    
+    loads = await get_radiologist_loads(roster)
+    prior = team_reporting_prior(loads)
+    
+    def hours_to_last(radiologist_id):
+        # Hours until the radiologist reaches the last study they already hold
+        load = loads[radiologist_id]
+        return radiologist_backlog_hours(load, prior, load["open"] - 1)
+    
+    skip = set()
+    while summary["moved"] < AUTO_ASSIGN_MAX_MOVES and roster:
+        busiest = max(
+            (radiologist["id"] for radiologist in roster if radiologist["id"] not in skip and loads[radiologist["id"]]["open"]),
+            key=hours_to_last, default=None
+        )
+        if busiest is None:
+            break
+        # Studies the radiologist has opened are being read and never move
+        movable = {**unreported_auto, "radiologist_id": busiest, "opened_at": None}
+        study = await db.studies.find_one(movable, {"id": 1, "modality": 1}, sort=[("assigned_at", -1)])
+        target = study and pick_radiologist(study.get("modality"), roster, loads, exclude=busiest)
+        # Same cost as incremental assignment: move only when the target would reach the study sooner
+        if not target or radiologist_backlog_hours(loads[target], prior) >= hours_to_last(busiest):
+            skip.add(busiest)
+            continue
+        # The study keeps its original assigned_at, so it is not picked as the newest again next pass
+        claim = study_claim_update(target, datetime.now(timezone.utc), automatic=True)
+        del claim["$set"]["assigned_at"]
+        result = await db.studies.update_one({"id": study["id"], **movable}, claim)
+        if result.modified_count:
+            loads[busiest]["open"] -= 1
+            loads[target]["open"] += 1
+            summary["moved"] += 1
+        else:
+            skip.add(busiest)
+    
+    pending = db.studies.find(
+        {"status": "pending", "deleted_at": None, "is_draft": {"$ne": True}}, {"id": 1, "modality": 1}
+    ).sort([("sla_deadline", 1), ("uploaded_at", 1)])
+    async for study in pending:
+        if not any(load["open"] < AUTO_ASSIGN_MAX_OPEN for load in loads.values()):
+            break
+        if await auto_assign_study(study, roster, loads):
+            summary["assigned"] += 1
+    
+    if any(summary.values()):
+        logging.info(f"Assignment rebalancing: {summary}")
+    return summary
+
+@job_handler("rebalance_assignments")
+async def rebalance_assignments_job(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, int]:
+    if payload.get("scheduled") and AUTO_ASSIGN_ENABLED:
+        await schedule_periodic_job("rebalance_assignments", timedelta(seconds=AUTO_ASSIGN_REBALANCE_SECONDS), current_job=job)
+    return await rebalance_assignments()
+
+@api_router.get("/admin/assignments/load")
+async def get_assignment_load(current_user: User = Depends(get_current_user)):
+    """Per-radiologist open load, recent throughput and the backlog the scheduler balances on"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.CENTRE]:
+        raise HTTPException(status_code=403, detail="Only admins or centre managers can view assignment load")
+    
+    roster = await get_radiologist_roster(fresh=True)
+    loads = await get_radiologist_loads(roster)
+    prior = team_reporting_prior(loads)
+    return {
+        "auto_assign_enabled": AUTO_ASSIGN_ENABLED,
+        "max_open": AUTO_ASSIGN_MAX_OPEN,
+        "throughput_hours": AUTO_ASSIGN_THROUGHPUT_HOURS,
+        "radiologists": [
+            {
+                "id": radiologist["id"],
+                "name": radiologist["name"],
+                "modalities": sorted(radiologist["modalities"]),
+                **loads[radiologist["id"]],
+                "backlog_hours": round(radiologist_backlog_hours(loads[radiologist["id"]], prior), 2)
+            }
+            for radiologist in roster
+        ]
+    }
+
+@api_router.post("/admin/assignments/rebalance")
+async def start_assignment_rebalance(current_user: User = Depends(get_current_user)):
+    """Queue an immediate rebalancing pass"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can rebalance assignments")
+    job_id = await enqueue_job("rebalance_assignments", {"scheduled": False}, dedupe_key="rebalance_assignments:manual")
+    return {"job_id": job_id}
 
 # ==================== AI REPORT ROUTES ====================
 
 @api_router.get("/studies/{study_id}/ai-report", response_model=AIReport)
 async def get_ai_report(study_id: str, current_user: User = Depends(get_current_user)):
-    study = await db.studies.find_one({"study_id": study_id})
+    study = await db.studies.find_one({"study_id": study_id, "deleted_at": None})
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
     
@@ -871,9 +3870,11 @@ async def create_final_report(
     if current_user.role != UserRole.RADIOLOGIST:
         raise HTTPException(status_code=403, detail="Only radiologists can create final reports")
     
-    study = await db.studies.find_one({"study_id": study_id})
+    study = await db.studies.find_one({"study_id": study_id, "deleted_at": None})
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
+    if study.get("status") == "assigned" and study.get("radiologist_id") not in (None, current_user.id):
+        raise HTTPException(status_code=409, detail="Study is assigned to another radiologist")
     
     final_report_dict = {
         "id": f"report_{generate_study_id()}",
@@ -889,7 +3890,7 @@ async def create_final_report(
     await db.final_reports.insert_one(final_report_dict)
     await db.studies.update_one(
         {"study_id": study_id},
-        {"$set": {"final_report_id": final_report_dict["id"], "status": "completed"}}
+        {"$set": {"final_report_id": final_report_dict["id"], "status": "completed", "radiologist_id": current_user.id}}
     )
     
     return FinalReport(**final_report_dict)
@@ -904,7 +3905,7 @@ async def edit_final_report(
     if current_user.role != UserRole.RADIOLOGIST:
         raise HTTPException(status_code=403, detail="Only radiologists can edit reports")
     
-    study = await db.studies.find_one({"study_id": study_id})
+    study = await db.studies.find_one({"study_id": study_id, "deleted_at": None})
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
     
@@ -950,7 +3951,7 @@ async def edit_final_report(
 
 @api_router.get("/studies/{study_id}/final-report", response_model=FinalReport)
 async def get_final_report(study_id: str, current_user: User = Depends(get_current_user)):
-    study = await db.studies.find_one({"study_id": study_id})
+    study = await db.studies.find_one({"study_id": study_id, "deleted_at": None})
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
     
@@ -966,12 +3967,57 @@ async def get_final_report(study_id: str, current_user: User = Depends(get_curre
 # ==================== DICOM FILE ROUTES ====================
 
 @api_router.get("/files/{file_id}")
-async def get_dicom_file(file_id: str, current_user: User = Depends(get_current_user)):
+async def get_dicom_file(
+    file_id: str,
+    request: Request,
+    transfer_syntax: Optional[str] = None,
+    revision: Optional[int] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Return an instance. Requests naming the current `revision` may be cached indefinitely;
+    other requests are revalidated with If-None-Match, answered with 304 from the index alone.
+    """
+    return await serve_instance(file_id, request, transfer_syntax, revision, "private, max-age=31536000, immutable")
+
+@api_router.get("/signed/files/{file_id}")
+async def get_signed_dicom_file(
+    file_id: str,
+    request: Request,
+    study: str,
+    user: str,
+    revision: int,
+    expires: int,
+    signature: str,
+    transfer_syntax: Optional[str] = None
+):
+    """Return an instance through a signed link from a study manifest; no token or user lookup needed"""
+    if not verify_file_signature(file_id, study, user, revision, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired download link")
+    
+    # Shared caches may keep the response until the link expires
+    max_age = max(expires - int(time.time()), 0)
+    return await serve_instance(file_id, request, transfer_syntax, revision, f"public, max-age={max_age}, immutable")
+
+async def serve_instance(
+    file_id: str, request: Request, transfer_syntax: Optional[str], revision: Optional[int], pinned_cache_control: str
+):
+    """Send an instance with its ETag, or 304 when the client already has it"""
     try:
-        from bson import ObjectId
-        grid_out = await fs.open_download_stream(ObjectId(file_id))
-        contents = await grid_out.read()
-        return StreamingResponse(io.BytesIO(contents), media_type="application/dicom")
+        accept = request.headers.get("accept")
+        delivery = await describe_instance_for_client(file_id, accept, transfer_syntax)
+        headers = {
+            "ETag": delivery["etag"],
+            "Vary": "Accept",
+            # A header rewrite bumps the revision, so a revision-pinned URL always returns the same bytes
+            "Cache-Control": pinned_cache_control if revision == delivery["revision"] else "private, no-cache"
+        }
+        if etag_matches(request.headers.get("if-none-match"), delivery["etag"]):
+            return Response(status_code=304, headers=headers)
+        
+        path, contents = await resolve_instance_for_client(file_id, accept, transfer_syntax, delivery)
+        if path:
+            return FileResponse(path, media_type="application/dicom", headers=headers)
+        return StreamingResponse(io.BytesIO(contents), media_type="application/dicom", headers=headers)
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"File not found: {str(e)}")
 
@@ -979,11 +4025,7 @@ async def get_dicom_file(file_id: str, current_user: User = Depends(get_current_
 async def get_dicom_file_metadata(file_id: str, current_user: User = Depends(get_current_user)):
     """Extract metadata from a stored DICOM file"""
     try:
-        from bson import ObjectId
-        grid_out = await fs.open_download_stream(ObjectId(file_id))
-        contents = await grid_out.read()
-        metadata = extract_dicom_metadata(contents)
-        return metadata
+        return await single_flight.do(("metadata", file_id), extract_stored_metadata, file_id)
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"File not found or metadata extraction failed: {str(e)}")
 
@@ -995,30 +4037,16 @@ async def update_dicom_file_metadata(
 ):
     """Update DICOM file metadata with new patient information"""
     try:
-        from bson import ObjectId
-        
-        # Get original file
-        grid_out = await fs.open_download_stream(ObjectId(file_id))
-        original_contents = await grid_out.read()
-        original_filename = grid_out.filename
-        
-        # Modify DICOM metadata
-        modified_contents = modify_dicom_metadata(original_contents, patient_updates)
-        
-        # Delete old file
-        await fs.delete(ObjectId(file_id))
-        
-        # Upload modified file with same filename
-        new_file_id = await fs.upload_from_stream(
-            original_filename,
-            io.BytesIO(modified_contents),
-            metadata={"updated_at": datetime.now(timezone.utc)}
+        # Rewrite only the header; the file id and the stored pixel data stay as they are
+        rewrite = await rewrite_instance_header(
+            file_id, patient_updates, {"updated_at": datetime.now(timezone.utc), "updated_by": current_user.id}
         )
         
         return {
             "message": "DICOM metadata updated successfully",
             "old_file_id": file_id,
-            "new_file_id": str(new_file_id),
+            "new_file_id": file_id,
+            "revision": rewrite["revision"],
             "updated_fields": list(patient_updates.keys())
         }
         
@@ -1029,11 +4057,7 @@ async def update_dicom_file_metadata(
 async def get_dicom_metadata(file_id: str, current_user: User = Depends(get_current_user)):
     """Extract and return DICOM metadata from a file"""
     try:
-        from bson import ObjectId
-        grid_out = await fs.open_download_stream(ObjectId(file_id))
-        contents = await grid_out.read()
-        
-        metadata = extract_dicom_metadata(contents)
+        metadata = await single_flight.do(("metadata", file_id), extract_stored_metadata, file_id)
         if not metadata:
             raise HTTPException(status_code=400, detail="Failed to extract DICOM metadata")
         
@@ -1073,33 +4097,382 @@ async def update_dicom_metadata(
         raise HTTPException(status_code=403, detail="Only technicians and admins can update DICOM metadata")
     
     try:
-        from bson import ObjectId
-        
-        # Get original file
-        grid_out = await fs.open_download_stream(ObjectId(file_id))
-        original_contents = await grid_out.read()
-        original_filename = grid_out.filename
-        
-        # Modify metadata
-        modified_contents = modify_dicom_metadata(original_contents, updates)
-        
-        # Save modified file (replace original)
-        await fs.delete(ObjectId(file_id))
-        new_file_id = await fs.upload_from_stream(
-            original_filename,
-            io.BytesIO(modified_contents),
-            metadata={"modified_at": datetime.now(timezone.utc).isoformat(), "modified_by": current_user.id}
+        # Rewrite only the header; the file id and the stored pixel data stay as they are
+        rewrite = await rewrite_instance_header(
+            file_id, updates, {"modified_at": datetime.now(timezone.utc).isoformat(), "modified_by": current_user.id}
         )
         
         return {
             "message": "DICOM metadata updated successfully",
             "old_file_id": file_id,
-            "new_file_id": str(new_file_id),
+            "new_file_id": file_id,
+            "revision": rewrite["revision"],
             "updates_applied": updates
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update DICOM metadata: {str(e)}")
 
+@api_router.get("/files/{file_id}/pyramid")
+async def get_image_pyramid(file_id: str, current_user: User = Depends(get_current_user)):
+    """Describe the preview pyramid of a large image so the viewer can load the smallest level first"""
+    pyramid = await db.image_pyramids.find_one({"file_id": file_id})
+    if not pyramid:
+        raise HTTPException(status_code=404, detail="No image pyramid for this file")
+    
+    return {
+        "file_id": file_id,
+        "width": pyramid["width"],
+        "height": pyramid["height"],
+        "tile_size": pyramid["tile_size"],
+        "levels": [
+            {
+                "scale": level["scale"],
+                "width": level["width"],
+                "height": level["height"],
+                "size": level.get("size"),
+                "columns": -(-level["width"] // pyramid["tile_size"]),
+                "rows": -(-level["height"] // pyramid["tile_size"]),
+                "url": f"/api/files/{file_id}/pyramid/{level['scale']}"
+            }
+            for level in sorted(pyramid["levels"], key=lambda level: -level["scale"])
+        ]
+    }
+
+async def _read_pyramid_level(file_id: str, scale: int):
+    """Return (pyramid, level PNG bytes) for a stored pyramid level"""
+    pyramid = await db.image_pyramids.find_one({"file_id": file_id})
+    if not pyramid:
+        raise HTTPException(status_code=404, detail="No image pyramid for this file")
+    
+    level = next((lvl for lvl in pyramid["levels"] if lvl["scale"] == scale), None)
+    if not level:
+        raise HTTPException(status_code=404, detail=f"Pyramid level 1/{scale} not available")
+    
+    return pyramid, await blob_storage.get(level["file_id"])
+
+@api_router.get("/files/{file_id}/pyramid/{scale}")
+async def get_image_pyramid_level(file_id: str, scale: int, current_user: User = Depends(get_current_user)):
+    """Return a whole pyramid level (scale 8 = 1/8 resolution, 1 = full resolution) as PNG"""
+    _, level_data = await _read_pyramid_level(file_id, scale)
+    return StreamingResponse(io.BytesIO(level_data), media_type="image/png")
+
+async def _render_pyramid_tile(file_id: str, scale: int, column: int, row: int) -> bytes:
+    pyramid, level_data = await _read_pyramid_level(file_id, scale)
+    return await run_cpu_bound(crop_pyramid_tile, level_data, column, row, pyramid["tile_size"])
+
+@api_router.get("/files/{file_id}/pyramid/{scale}/tiles/{column}/{row}")
+async def get_image_pyramid_tile(
+    file_id: str,
+    scale: int,
+    column: int,
+    row: int,
+    current_user: User = Depends(get_current_user)
+):
+    """Return one tile of a pyramid level as PNG"""
+    try:
+        tile = await single_flight.do(("tile", file_id, scale, column, row), _render_pyramid_tile, file_id, scale, column, row)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return StreamingResponse(io.BytesIO(tile), media_type="image/png")
+
+@api_router.get("/files/{file_id}/frames/{frame_number}")
+async def get_dicom_frame(file_id: str, frame_number: int, current_user: User = Depends(get_current_user)):
+    """Return one frame (1-based) of a multi-frame instance, reading only the storage chunks it spans.
+    
+    Native frames are raw little-endian pixel bytes; encapsulated frames are returned in their
+    stored transfer syntax, which is reported in the X-Transfer-Syntax-UID header.
+    """
+    instance = await db.instances.find_one({"file_id": file_id}, {"frame_index": 1, "rows": 1, "columns": 1})
+    if not instance or "frame_index" not in instance:
+        # Files stored before frame indexing are indexed once from the full file
+        try:
+            contents = await read_instance(file_id)
+        except Exception as e:
+            raise HTTPException(status_code=404, detail=f"File not found: {str(e)}")
+        await index_instance(file_id, None, contents)
+        instance = await db.instances.find_one({"file_id": file_id}, {"frame_index": 1, "rows": 1, "columns": 1})
+    
+    frame_index = (instance or {}).get("frame_index")
+    if not frame_index:
+        raise HTTPException(status_code=422, detail="Frames of this file cannot be addressed individually")
+    if frame_number < 1 or frame_number > len(frame_index["frames"]):
+        raise HTTPException(status_code=404, detail=f"Frame {frame_number} does not exist")
+    
+    # Fragments of one frame are contiguous apart from item headers, so one range read covers them
+    ranges = frame_index["frames"][frame_number - 1]
+    span_start = ranges[0][0]
+    span = await read_instance_range(file_id, span_start, ranges[-1][0] + ranges[-1][1] - span_start)
+    frame = b"".join(span[offset - span_start:offset - span_start + length] for offset, length in ranges)
+    
+    transfer_syntax = frame_index["transfer_syntax_uid"]
+    media_type = FRAME_MEDIA_TYPES.get(transfer_syntax, "application/octet-stream")
+    return StreamingResponse(io.BytesIO(frame), media_type=media_type, headers={
+        "X-Transfer-Syntax-UID": transfer_syntax,
+        "X-Number-Of-Frames": str(frame_index["number_of_frames"]),
+        "X-Rows": str(instance.get("rows", "")),
+        "X-Columns": str(instance.get("columns", ""))
+    })
+
+# ==================== MPR / MIP ROUTES ====================
+
+async def _find_study_for_volume(study_id: str) -> Dict[str, Any]:
+    study = await db.studies.find_one({"$or": [{"study_id": study_id}, {"id": study_id}], "deleted_at": None})
+    if not study:
+        raise HTTPException(status_code=404, detail="Study not found")
+    return study
+
+@api_router.get("/studies/{study_id}/manifest")
+async def get_study_manifest(study_id: str, current_user: User = Depends(get_current_user)):
+    """List the instances of a study with short-lived signed download URLs"""
+    study = await _find_study_for_volume(study_id)
+    await touch_study_claim(study, current_user.id)
+    instances = sorted(
+        await get_study_instances(study),
+        key=lambda i: (i.get("series_instance_uid", ""), i.get("instance_number") or 0)
+    )
+    
+    entries, expires = [], None
+    for instance in instances:
+        revision = (instance.get("storage") or {}).get("revision") or 0
+        url, expires = signed_file_url(instance["file_id"], study["id"], current_user.id, revision)
+        entries.append({
+            "file_id": instance["file_id"],
+            "series_instance_uid": instance.get("series_instance_uid"),
+            "sop_instance_uid": instance.get("sop_instance_uid"),
+            "instance_number": instance.get("instance_number"),
+            "number_of_frames": instance.get("number_of_frames", 1),
+            "revision": revision,
+            "url": url
+        })
+    
+    return {
+        "study_id": study["id"],
+        "expires_at": datetime.fromtimestamp(expires, timezone.utc) if expires else None,
+        "instances": entries
+    }
+
+@api_router.get("/studies/{study_id}/series")
+async def get_study_series(study_id: str, current_user: User = Depends(get_current_user)):
+    """List the series of a study from the instance geometry index"""
+    study = await _find_study_for_volume(study_id)
+    series = {}
+    for instance in await get_study_instances(study):
+        entry = series.setdefault(instance.get("series_instance_uid", ""), {
+            "series_instance_uid": instance.get("series_instance_uid", ""),
+            "modality": instance.get("modality", ""),
+            "instance_count": 0,
+            "file_ids": []
+        })
+        entry["instance_count"] += 1
+        entry["file_ids"].append(instance["file_id"])
+    return list(series.values())
+
+@api_router.get("/studies/{study_id}/series/{series_uid}/volume")
+async def get_series_volume(study_id: str, series_uid: str, current_user: User = Depends(get_current_user)):
+    """Describe the reconstructed volume of a series (dimensions and spacing for MPR navigation)"""
+    volume = await load_series_volume(await _find_study_for_volume(study_id), series_uid)
+    depth, height, width = volume["voxels"].shape
+    return {
+        "study_id": study_id,
+        "series_instance_uid": series_uid,
+        "dimensions": {"axial": depth, "coronal": height, "sagittal": width},
+        "spacing": dict(zip(["slice", "row", "column"], volume["spacing"])),
+        "window_center": volume["window_center"],
+        "window_width": volume["window_width"],
+        "file_ids": volume["file_ids"]
+    }
+
+@api_router.get("/studies/{study_id}/series/{series_uid}/mpr")
+async def get_series_reformat(
+    study_id: str,
+    series_uid: str,
+    plane: str = "axial",
+    position: Optional[float] = None,
+    thickness: float = 0.0,
+    mode: str = "mip",
+    normal: Optional[str] = None,
+    window_center: Optional[float] = None,
+    window_width: Optional[float] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Render an axial/coronal/sagittal/oblique plane or MIP/MinIP/average slab of a series as PNG.
+    
+    `thickness` is the slab thickness in mm (0 = single plane) and `mode` is mip, minip or avg.
+    """
+    if mode not in ("mip", "minip", "avg"):
+        raise HTTPException(status_code=400, detail="mode must be mip, minip or avg")
+    
+    volume = await load_series_volume(await _find_study_for_volume(study_id), series_uid)
+    
+    try:
+        normal_vector = tuple(float(v) for v in normal.split(",")) if normal else None
+        orthogonal_position = int(position) if position is not None and plane != "oblique" else position
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid reformat request: {str(e)}")
+    
+    render_key = ("mpr", study_id, series_uid, plane, orthogonal_position, thickness, mode, normal_vector, window_center, window_width)
+    try:
+        png = await single_flight.do(
+            render_key, _render_reformat, volume, plane, orthogonal_position, thickness, mode, normal_vector,
+            window_center, window_width
+        )
+    except (ValueError, IndexError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid reformat request: {str(e)}")
+    return StreamingResponse(io.BytesIO(png), media_type="image/png")
+
+async def _render_reformat(volume, plane, position, thickness, mode, normal_vector, window_center, window_width) -> bytes:
+    image, pixel_spacing = await asyncio.to_thread(
+        reformat_volume, volume, plane, position, thickness, mode, list(normal_vector) if normal_vector else None
+    )
+    center = window_center if window_center is not None else volume["window_center"]
+    width = window_width if window_width is not None else volume["window_width"]
+    return await asyncio.to_thread(encode_reformat_png, image, pixel_spacing, center, width, volume["invert"])
+
+# ==================== STUDY METADATA CORRECTION ROUTES ====================
+
+async def run_metadata_correction_job(job_id: str, resume: bool = False):
+    """Apply a job's header updates to every instance of its study that is not done yet.
+    
+    Files are rewritten concurrently (header re-encoding runs in the CPU process pool) and
+    each file is retried with backoff before it is marked failed. Rewrites are idempotent,
+    so running a job again only redoes files whose state is not "done". `resume` also picks
+    up a job left "running" by a worker that died.
+    """
+    statuses = ["queued", "failed", "running"] if resume else ["queued", "failed"]
+    job = await db.metadata_correction_jobs.find_one_and_update(
+        {"id": job_id, "status": {"$in": statuses}},
+        {"$set": {"status": "running", "updated_at": datetime.now(timezone.utc)}, "$inc": {"attempts": 1}}
+    )
+    if not job:
+        return  # Already running or finished
+    
+    semaphore = asyncio.Semaphore(METADATA_CORRECTION_CONCURRENCY)
+    
+    async def correct(file_id: str):
+        async with semaphore:
+            error = None
+            for attempt in range(METADATA_CORRECTION_ATTEMPTS):
+                try:
+                    await rewrite_instance_header(file_id, job["updates"], {
+                        "corrected_at": datetime.now(timezone.utc),
+                        "correction_job_id": job_id
+                    })
+                    await db.metadata_correction_jobs.update_one(
+                        {"id": job_id},
+                        {
+                            "$set": {f"file_states.{file_id}": "done", "updated_at": datetime.now(timezone.utc)},
+                            "$unset": {f"errors.{file_id}": ""},
+                            "$inc": {"completed_files": 1}
+                        }
+                    )
+                    return
+                except Exception as e:
+                    error = str(e)
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+            
+            await db.metadata_correction_jobs.update_one(
+                {"id": job_id},
+                {"$set": {
+                    f"file_states.{file_id}": "failed",
+                    f"errors.{file_id}": error,
+                    "updated_at": datetime.now(timezone.utc)
+                }}
+            )
+    
+    pending = [file_id for file_id, state in job["file_states"].items() if state != "done"]
+    await asyncio.gather(*[correct(file_id) for file_id in pending])
+    
+    job = await db.metadata_correction_jobs.find_one({"id": job_id})
+    failed_files = sum(1 for state in job["file_states"].values() if state == "failed")
+    await db.metadata_correction_jobs.update_one(
+        {"id": job_id},
+        {"$set": {
+            "status": "failed" if failed_files else "completed",
+            "failed_files": failed_files,
+            "updated_at": datetime.now(timezone.utc),
+            "finished_at": datetime.now(timezone.utc)
+        }}
+    )
+    
+    # Keep the study's own demographics in line with the corrected files
+    if not failed_files:
+        study_updates = {k: job["updates"][k] for k in ("patient_name", "patient_gender") if k in job["updates"]}
+        if study_updates:
+            await db.studies.update_one(
+                {"$or": [{"study_id": job["study_id"]}, {"id": job["study_id"]}]}, {"$set": study_updates}
+            )
+
+@job_handler("metadata_correction")
+async def metadata_correction_job(payload: Dict[str, Any], job: Dict[str, Any]) -> None:
+    # The queue lease guarantees a single runner, so a retry after a crash may resume it
+    await run_metadata_correction_job(payload["job_id"], resume=job["attempts"] > 1)
+
+@api_router.post("/studies/{study_id}/metadata-corrections", response_model=MetadataCorrectionJob)
+async def create_metadata_correction(
+    study_id: str,
+    updates: Dict[str, Any] = Body(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Queue a correction of patient/study fields across every file of a study"""
+    if current_user.role not in [UserRole.TECHNICIAN, UserRole.ADMIN]:
+        raise HTTPException(status_code=403, detail="Only technicians and admins can update DICOM metadata")
+    
+    unknown_fields = set(updates) - METADATA_CORRECTION_FIELDS
+    if not updates or unknown_fields:
+        raise HTTPException(status_code=400, detail=f"Updates must use the fields: {', '.join(sorted(METADATA_CORRECTION_FIELDS))}")
+    
+    study = await db.studies.find_one({"$or": [{"study_id": study_id}, {"id": study_id}], "deleted_at": None})
+    if not study:
+        raise HTTPException(status_code=404, detail="Study not found")
+    
+    job_dict = {
+        "id": f"correction_{generate_study_id()}",
+        "study_id": study_id,
+        "updates": updates,
+        "status": "queued",
+        "total_files": len(study.get("file_ids", [])),
+        "completed_files": 0,
+        "failed_files": 0,
+        "file_states": {file_id: "pending" for file_id in study.get("file_ids", [])},
+        "errors": {},
+        "attempts": 0,
+        "created_by": current_user.id,
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc),
+        "finished_at": None
+    }
+    await db.metadata_correction_jobs.insert_one(job_dict)
+    await enqueue_job("metadata_correction", {"job_id": job_dict["id"]}, dedupe_key=f"metadata_correction:{job_dict['id']}")
+    
+    return MetadataCorrectionJob(**job_dict)
+
+@api_router.get("/studies/{study_id}/metadata-corrections/{job_id}", response_model=MetadataCorrectionJob)
+async def get_metadata_correction(study_id: str, job_id: str, current_user: User = Depends(get_current_user)):
+    """Report the progress of a metadata correction job"""
+    job = await db.metadata_correction_jobs.find_one({"id": job_id, "study_id": study_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Correction job not found")
+    return MetadataCorrectionJob(**job)
+
+@api_router.post("/studies/{study_id}/metadata-corrections/{job_id}/retry", response_model=MetadataCorrectionJob)
+async def retry_metadata_correction(
+    study_id: str,
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Re-run a failed correction job; files that were already corrected are skipped"""
+    if current_user.role not in [UserRole.TECHNICIAN, UserRole.ADMIN]:
+        raise HTTPException(status_code=403, detail="Only technicians and admins can update DICOM metadata")
+    
+    job = await db.metadata_correction_jobs.find_one({"id": job_id, "study_id": study_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Correction job not found")
+    if job["status"] != "failed":
+        raise HTTPException(status_code=400, detail=f"Only failed jobs can be retried (job is {job['status']})")
+    
+    await enqueue_job("metadata_correction", {"job_id": job_id}, dedupe_key=f"metadata_correction:{job_id}")
+    return MetadataCorrectionJob(**job)
+
 # ==================== RADIOLOGIST DOWNLOAD/UPLOAD ROUTES ====================
 
 @api_router.get("/studies/{study_id}/download")
@@ -1110,7 +4483,7 @@ async def download_study(study_id: str, current_user: User = Depends(get_current
     
     try:
         # Get study details
-        study = await db.studies.find_one({"id": study_id})
+        study = await db.studies.find_one({"id": study_id, "deleted_at": None})
         if not study:
             raise HTTPException(status_code=404, detail="Study not found")
         
@@ -1119,12 +4492,11 @@ async def download_study(study_id: str, current_user: User = Depends(get_current
         
         with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
             # Add DICOM files
+            filenames = await get_instance_filenames(study.get("file_ids", []))
             for file_id in study.get("file_ids", []):
                 try:
-                    from bson import ObjectId
-                    grid_out = await fs.open_download_stream(ObjectId(file_id))
-                    file_contents = await grid_out.read()
-                    filename = grid_out.filename or f"dicom_{file_id}.dcm"
+                    file_contents = await read_instance_for_client(file_id, None)
+                    filename = filenames.get(file_id) or f"dicom_{file_id}.dcm"
                     zip_file.writestr(f"DICOM/{filename}", file_contents)
                 except Exception:
                     continue
@@ -1185,6 +4557,7 @@ async def upload_study_with_report(
         
         # Upload DICOM files and extract metadata
         file_ids = []
+        dicom_files = []
         dicom_metadata = {}
         
         for file in files:
@@ -1205,16 +4578,22 @@ async def upload_study_with_report(
                     if extracted_metadata.get("study_description"):
                         study_description = extracted_metadata["study_description"]
             
-            file_id = await fs.upload_from_stream(
+            compression = None
+            if file.filename.lower().endswith('.dcm'):
+                content, compression = await prepare_for_storage(content)
+            
+            file_id = await store_instance(
                 f"{study_id}_{file.filename}",
-                io.BytesIO(content),
-                metadata={
+                content,
+                {
                     "study_id": study_id,
                     "original_name": file.filename,
                     "dicom_metadata": dicom_metadata if file.filename.lower().endswith('.dcm') else {}
                 }
             )
-            file_ids.append(str(file_id))
+            file_ids.append(file_id)
+            if file.filename.lower().endswith('.dcm'):
+                dicom_files.append({"file_id": file_id, "compression": compression})
         
         # Create study record
         study_dict = {
@@ -1229,11 +4608,20 @@ async def upload_study_with_report(
             "uploaded_at": datetime.now(timezone.utc),
             "status": "completed",  # Studies with reports are completed
             "centre_id": getattr(current_user, 'centre_id', None),
-            "dicom_metadata": dicom_metadata
+            "dicom_metadata": dicom_metadata,
+            "duplicate_sop_instance_uids": []
         }
         
         await db.studies.insert_one(study_dict)
         
+        # Indexing and pyramids run on the job queue, once the study exists
+        await enqueue_job("process_study_upload", {
+            "study_id": study_id,
+            "modality": modality,
+            "files": dicom_files,
+            "ai_report_id": None
+        }, priority=JobPriority.HIGH)
+        
         # Create final report if provided
         if final_report_text or report_file:
             report_content = final_report_text
@@ -1271,69 +4659,365 @@ async def upload_study_with_report(
         logging.error(f"Failed to upload study with report: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to upload study: {str(e)}")
 
+@api_router.get("/admin/storage/compression")
+async def get_compression_stats(current_user: User = Depends(get_current_user)):
+    """Measured ingest compression ratios per modality and method"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can view storage statistics")
+    
+    groups = await db.instances.aggregate([
+        {"$match": {"compression": {"$exists": True}}},
+        {"$group": {
+            "_id": {"modality": "$compression.modality", "method": "$compression.method"},
+            "instances": {"$sum": 1},
+            "original_bytes": {"$sum": "$compression.original_size"},
+            "stored_bytes": {"$sum": "$compression.stored_size"}
+        }},
+        {"$sort": {"_id.modality": 1}}
+    ]).to_list(None)
+    
+    return {
+        "policy": INGEST_COMPRESSION,
+        "modalities": [
+            {
+                **group["_id"],
+                "instances": group["instances"],
+                "original_bytes": group["original_bytes"],
+                "stored_bytes": group["stored_bytes"],
+                "ratio": round(group["original_bytes"] / group["stored_bytes"], 3) if group["stored_bytes"] else None
+            }
+            for group in groups
+        ]
+    }
+
+@api_router.get("/admin/storage/file-cache")
+async def get_file_cache_stats(current_user: User = Depends(get_current_user)):
+    """Disk usage of the file cache and the hit ratio seen by this worker"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can view storage statistics")
+    if not file_disk_cache.enabled:
+        return {"enabled": False, "single_flight": dict(single_flight.stats)}
+    
+    usage = await asyncio.to_thread(file_disk_cache.usage)
+    stats = dict(file_disk_cache.stats)
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        "enabled": True,
+        "max_bytes": file_disk_cache.max_bytes,
+        **usage,
+        **stats,
+        "hit_ratio": round(stats["hits"] / lookups, 4) if lookups else None,
+        "single_flight": dict(single_flight.stats),
+        "worker_pid": os.getpid()
+    }
+
+@job_handler("storage_migration")
+async def storage_migration_job(payload: Dict[str, Any], job: Dict[str, Any]) -> None:
+    await migrate_blobs(payload["migration_id"], payload["source"], payload["target"], payload["delete_source"])
+
+@api_router.post("/admin/storage/migrations", response_model=StorageMigration)
+async def start_storage_migration(
+    source: str = Body(...),
+    target: str = Body(...),
+    delete_source: bool = Body(True),
+    current_user: User = Depends(get_current_user)
+):
+    """Move every blob from one storage backend to another while the system stays online"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can migrate storage")
+    if source not in blob_storage.stores or target not in blob_storage.stores or source == target:
+        raise HTTPException(status_code=400, detail=f"Source and target must be two of: {', '.join(blob_storage.stores)}")
+    if await db.storage_migrations.find_one({"status": "running"}):
+        raise HTTPException(status_code=409, detail="A storage migration is already running")
+    
+    now = datetime.now(timezone.utc)
+    migration = StorageMigration(
+        id=f"migration_{uuid.uuid4().hex[:12]}",
+        source=source,
+        target=target,
+        delete_source=delete_source,
+        status="running",
+        created_by=current_user.id,
+        created_at=now,
+        updated_at=now
+    )
+    await db.storage_migrations.insert_one(migration.dict())
+    await enqueue_job("storage_migration", {
+        "migration_id": migration.id, "source": source, "target": target, "delete_source": delete_source
+    }, priority=JobPriority.LOW)
+    return migration
+
+@api_router.get("/admin/storage/migrations/{migration_id}", response_model=StorageMigration)
+async def get_storage_migration(migration_id: str, current_user: User = Depends(get_current_user)):
+    """Progress of a storage migration"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can view storage migrations")
+    
+    migration = await db.storage_migrations.find_one({"id": migration_id}, {"_id": 0})
+    if not migration:
+        raise HTTPException(status_code=404, detail="Migration not found")
+    return StorageMigration(**migration)
+
+async def referenced_blob_ids(blob_ids: List[str]) -> set:
+    """The subset of blob ids that an instance, shared content record, pyramid or study still points at"""
+    referenced = set()
+    async for doc in db.instances.find(
+        {"$or": [{"file_id": {"$in": blob_ids}}, {"storage.segments.file_id": {"$in": blob_ids}}]},
+        {"file_id": 1, "storage.segments.file_id": 1}
+    ):
+        referenced.add(doc["file_id"])
+        referenced.update(segment["file_id"] for segment in (doc.get("storage") or {}).get("segments", []))
+    async for doc in db.blobs.find({"segments.file_id": {"$in": blob_ids}}, {"segments.file_id": 1}):
+        referenced.update(segment["file_id"] for segment in doc["segments"])
+    async for doc in db.image_pyramids.find({"levels.file_id": {"$in": blob_ids}}, {"levels.file_id": 1}):
+        referenced.update(level["file_id"] for level in doc["levels"])
+    async for doc in db.studies.find({"file_ids": {"$in": blob_ids}}, {"file_ids": 1}):
+        referenced.update(doc["file_ids"])
+    return referenced & set(blob_ids)
+
+async def reconcile_blobs(dry_run: bool = False) -> Dict[str, Any]:
+    """Find and reclaim storage nothing references any more.
+    
+    Covers shared content records whose last instance is gone, blobs left behind by failed deletions
+    or replaced headers, and raw bytes (GridFS chunks, local files) without a blob record.
+    """
+    from bson import ObjectId
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=BLOB_ORPHAN_GRACE_HOURS)
+    report = {"dry_run": dry_run, "content_records": 0, "backends": {}}
+    
+    # Shared content records without any instance left (e.g. a deletion interrupted after releasing the count)
+    async for blob in db.blobs.find({"created_at": {"$lt": cutoff}}, {"_id": 1, "refcount": 1}):
+        if not await db.instances.find_one({"content_sha256": blob["_id"]}, {"_id": 1}):
+            report["content_records"] += 1
+            if not dry_run:
+                # Matching the refcount we saw loses the race against a concurrent upload of the same content
+                await db.blobs.delete_one({"_id": blob["_id"], "refcount": blob["refcount"]})
+    
+    for name, store in blob_storage.stores.items():
+        orphaned = {"blobs": 0, "bytes": 0}
+        
+        async def sweep(batch):
+            orphans = set(batch) - await referenced_blob_ids(batch)
+            if not orphans:
+                return
+            lengths = await store.lengths(list(orphans))
+            orphaned["blobs"] += len(lengths)
+            orphaned["bytes"] += sum(lengths.values())
+            if not dry_run:
+                await store.delete_many(list(lengths))
+        
+        batch = []
+        async for blob_id in store.list_ids():
+            if ObjectId.is_valid(blob_id) and ObjectId(blob_id).generation_time < cutoff:
+                batch.append(blob_id)
+            if len(batch) >= 500:
+                await sweep(batch)
+                batch = []
+        if batch:
+            await sweep(batch)
+        
+        report["backends"][name] = {
+            "orphaned_blobs": orphaned["blobs"],
+            "orphaned_blob_bytes": orphaned["bytes"],
+            "untracked": await store.reclaim_untracked(cutoff, dry_run)
+        }
+    
+    total = sum(b["orphaned_blob_bytes"] + b["untracked"]["bytes"] for b in report["backends"].values())
+    report["reclaimable_bytes" if dry_run else "reclaimed_bytes"] = total
+    logging.info(f"Blob reconciliation {'(dry run) ' if dry_run else ''}finished: {report}")
+    return report
+
+@job_handler("reconcile_blobs")
+async def reconcile_blobs_job(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    if payload.get("scheduled") and BLOB_RECONCILE_INTERVAL_HOURS > 0:
+        await schedule_periodic_job("reconcile_blobs", timedelta(hours=BLOB_RECONCILE_INTERVAL_HOURS), {"dry_run": False}, job)
+    return await reconcile_blobs(payload.get("dry_run", False))
+
+@api_router.post("/admin/storage/reconcile")
+async def start_blob_reconciliation(dry_run: bool = Body(True, embed=True), current_user: User = Depends(get_current_user)):
+    """Queue a pass that finds (and unless dry_run, deletes) orphaned blobs; the report is the job result"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can reconcile storage")
+    
+    job_id = await enqueue_job(
+        "reconcile_blobs", {"dry_run": dry_run, "scheduled": False}, priority=JobPriority.LOW,
+        dedupe_key=f"reconcile_blobs:{'dry_run' if dry_run else 'reclaim'}"
+    )
+    return {"job_id": job_id, "dry_run": dry_run}
+
+@job_handler("storage_benchmark")
+async def storage_benchmark_job(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    results = [
+        await benchmark_blob_store(store, payload["blob_count"], payload["blob_size_kb"] * 1024)
+        for store in blob_storage.stores.values()
+    ]
+    return {**payload, "primary": blob_storage.primary.name, "results": results}
+
+@api_router.post("/admin/storage/benchmark")
+async def run_storage_benchmark(
+    blob_count: int = Body(50),
+    blob_size_kb: int = Body(512),
+    current_user: User = Depends(get_current_user)
+):
+    """Queue a comparison of backend throughput on this server with the same throwaway blobs; the figures are the job result"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can run storage benchmarks")
+    if not 1 <= blob_count <= 1000 or not 1 <= blob_size_kb <= 64 * 1024:
+        raise HTTPException(status_code=400, detail="blob_count must be 1-1000 and blob_size_kb 1-65536")
+    if blob_count * blob_size_kb * 1024 > STORAGE_BENCHMARK_MAX_BYTES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A benchmark may write at most {STORAGE_BENCHMARK_MAX_BYTES // (1024 * 1024)} MB per backend"
+        )
+    
+    # Single attempt: a retry would only measure a backend already under the failed run's load
+    job_id = await enqueue_job(
+        "storage_benchmark", {"blob_count": blob_count, "blob_size_kb": blob_size_kb},
+        priority=JobPriority.LOW, max_attempts=1, dedupe_key="storage_benchmark"
+    )
+    # One benchmark at a time: while one is pending, its job is returned instead of queueing another
+    return {"job_id": job_id}
+
 # ==================== DATABASE CLEANUP ====================
 
+MOCK_STUDY_FILTER = {"file_ids": {"$elemMatch": {"$regex": "^file_"}}}
+TEST_BILLING_RATE_FILTER = {"$or": [
+    {"modality": {"$regex": "TEST"}},
+    {"description": {"$regex": "test|Test|TEST"}}
+]}
+# Test invoices have $0 amounts or test centres
+TEST_INVOICE_FILTER = {"$or": [
+    {"total_amount": 0},
+    {"centre_name": {"$regex": "test|Test|TEST"}}
+]}
+
+async def _remove_matching(collection, query: Dict[str, Any], dry_run: bool) -> int:
+    if dry_run:
+        return await collection.count_documents(query)
+    return (await collection.delete_many(query)).deleted_count
+
+async def cleanup_mock_data_run(dry_run: bool = False) -> Dict[str, Any]:
+    """Remove mock studies, their reports, test billing data and orphaned payment transactions.
+    
+    Every category is one set-based operation, and the summary holds the documents actually matched.
+    """
+    # Studies are removed by `id`; their AI and uploaded reports reference the short `study_id`
+    mock_studies = await db.studies.find(MOCK_STUDY_FILTER, {"_id": 0, "id": 1, "study_id": 1}).to_list(None)
+    mock_study_ids = [study["id"] for study in mock_studies]
+    short_study_ids = [study["study_id"] for study in mock_studies if study.get("study_id")]
+    mock_files = await db.studies.aggregate([
+        {"$match": MOCK_STUDY_FILTER},
+        {"$project": {"file_ids": {"$filter": {
+            "input": "$file_ids", "cond": {"$regexMatch": {"input": "$$this", "regex": "^file_"}}
+        }}}},
+        {"$group": {"_id": None, "count": {"$sum": {"$size": "$file_ids"}}}}
+    ]).to_list(None)
+    
+    cleanup_summary = {
+        "dry_run": dry_run,
+        "studies_removed": 0,
+        "mock_files_removed": mock_files[0]["count"] if mock_files else 0,
+        "ai_reports_removed": 0,
+        "reports_removed": 0,
+        "billing_rates_removed": 0,
+        "invoices_removed": 0,
+        "payment_transactions_removed": 0
+    }
+    
+    for start in range(0, len(short_study_ids), 1000):
+        batch = {"$in": short_study_ids[start:start + 1000]}
+        cleanup_summary["ai_reports_removed"] += await _remove_matching(db.ai_reports, {"study_id": batch}, dry_run)
+        cleanup_summary["reports_removed"] += await _remove_matching(db.reports, {"study_id": batch}, dry_run)
+    for start in range(0, len(mock_study_ids), 1000):
+        cleanup_summary["studies_removed"] += await _remove_matching(
+            db.studies, {"id": {"$in": mock_study_ids[start:start + 1000]}}, dry_run
+        )
+    
+    cleanup_summary["billing_rates_removed"] = await _remove_matching(db.billing_rates, TEST_BILLING_RATE_FILTER, dry_run)
+    cleanup_summary["invoices_removed"] = await _remove_matching(db.invoices, TEST_INVOICE_FILTER, dry_run)
+    
+    # Transactions without a surviving invoice; test invoices count as gone so a dry run reports the same
+    orphaned = db.payment_transactions.aggregate([
+        {"$lookup": {"from": "invoices", "localField": "invoice_id", "foreignField": "id", "as": "invoice"}},
+        {"$match": {"invoice": {"$not": {"$elemMatch": {"$nor": TEST_INVOICE_FILTER["$or"]}}}}},
+        {"$project": {"_id": 1}}
+    ])
+    orphaned_ids = [doc["_id"] async for doc in orphaned]
+    for start in range(0, len(orphaned_ids), 1000):
+        cleanup_summary["payment_transactions_removed"] += await _remove_matching(
+            db.payment_transactions, {"_id": {"$in": orphaned_ids[start:start + 1000]}}, dry_run
+        )
+    
+    logging.info(f"Mock data cleanup {'(dry run) ' if dry_run else ''}finished: {cleanup_summary}")
+    return cleanup_summary
+
+@job_handler("cleanup_mock_data")
+async def cleanup_mock_data_job(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    return await cleanup_mock_data_run(payload.get("dry_run", False))
+
 @api_router.delete("/admin/cleanup-mock-data")
-async def cleanup_mock_data(current_user: User = Depends(get_current_user)):
-    """Remove all mock and test data from the system"""
+async def cleanup_mock_data(
+    dry_run: bool = False,
+    background: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Remove all mock and test data from the system.
+    
+    dry_run only counts what would be removed; background queues the cleanup as a job
+    (for large databases) whose summary is the job result.
+    """
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Only admins can cleanup mock data")
     
+    if background:
+        job_id = await enqueue_job(
+            "cleanup_mock_data", {"dry_run": dry_run}, priority=JobPriority.LOW,
+            dedupe_key=f"cleanup_mock_data:{'dry_run' if dry_run else 'remove'}"
+        )
+        return {"message": "Mock and test data cleanup queued", "job_id": job_id}
+    
     try:
-        cleanup_summary = {
-            "studies_removed": 0,
-            "mock_files_removed": 0,
-            "ai_reports_removed": 0,
-            "reports_removed": 0,
-            "billing_rates_removed": 0,
-            "invoices_removed": 0
-        }
-        
-        # Remove studies with mock file_ids (file_XXXXX pattern)
-        mock_studies = await db.studies.find({"file_ids": {"$elemMatch": {"$regex": "^file_"}}}).to_list(None)
-        for study in mock_studies:
-            await db.studies.delete_one({"id": study["id"]})
-            cleanup_summary["studies_removed"] += 1
-            
-            # Remove associated AI reports
-            await db.ai_reports.delete_many({"study_id": study["id"]})
-            cleanup_summary["ai_reports_removed"] += 1
-            
-            # Remove associated reports
-            await db.reports.delete_many({"study_id": study["id"]})
-            cleanup_summary["reports_removed"] += 1
-        
-        # Remove test billing rates
-        test_rates = await db.billing_rates.delete_many({
-            "$or": [
-                {"modality": {"$regex": "TEST"}},
-                {"description": {"$regex": "test|Test|TEST"}}
-            ]
-        })
-        cleanup_summary["billing_rates_removed"] = test_rates.deleted_count
-        
-        # Remove test invoices (those with $0 amounts or test centres)
-        test_invoices = await db.invoices.delete_many({
-            "$or": [
-                {"total_amount": 0},
-                {"centre_name": {"$regex": "test|Test|TEST"}}
-            ]
-        })
-        cleanup_summary["invoices_removed"] = test_invoices.deleted_count
-        
-        # Remove orphaned payment transactions
-        await db.payment_transactions.delete_many({
-            "invoice_id": {"$nin": await db.invoices.distinct("id")}
-        })
-        
+        cleanup_summary = await cleanup_mock_data_run(dry_run)
         return {
-            "message": "Mock and test data cleanup completed",
+            "message": "Mock and test data cleanup dry run completed" if dry_run else "Mock and test data cleanup completed",
             "summary": cleanup_summary
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to cleanup mock data: {str(e)}")
 
+@api_router.post("/admin/auth/benchmark")
+async def run_login_benchmark(logins: int = Body(50, embed=True), current_user: User = Depends(get_current_user)):
+    """Measure password verifications per second at the configured bcrypt cost on this server"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can run benchmarks")
+    if not 1 <= logins <= 1000:
+        raise HTTPException(status_code=400, detail="logins must be between 1 and 1000")
+    
+    loop = asyncio.get_running_loop()
+    hashed = await loop.run_in_executor(password_executor, pwd_context.hash, "benchmark-password")
+    
+    started = time.perf_counter()
+    await loop.run_in_executor(password_executor, pwd_context.verify, "benchmark-password", hashed)
+    single_seconds = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        loop.run_in_executor(password_executor, pwd_context.verify, "benchmark-password", hashed)
+        for _ in range(logins)
+    ])
+    elapsed = time.perf_counter() - started
+    
+    logins_per_second = logins / elapsed
+    return {
+        "bcrypt_rounds": BCRYPT_ROUNDS,
+        "workers": PASSWORD_HASH_WORKERS,
+        "cpu_count": os.cpu_count(),
+        "single_verify_ms": round(single_seconds * 1000, 1),
+        "logins_per_second": round(logins_per_second, 1),
+        "logins_per_second_per_core": round(logins_per_second / min(PASSWORD_HASH_WORKERS, os.cpu_count() or 1), 1)
+    }
+
 @api_router.post("/admin/create-demo-users")
 async def create_demo_users(current_user: User = Depends(get_current_user)):
     """Create demo radiologist and technician users"""
@@ -1350,7 +5034,7 @@ async def create_demo_users(current_user: User = Depends(get_current_user)):
                 "id": generate_study_id(),
                 "name": "Dr. Sarah Johnson",
                 "email": "radiologist@pacs.com", 
-                "password": hash_password("radio123"),
+                "password": await hash_password("radio123"),
                 "role": UserRole.RADIOLOGIST,
                 "specialization": "Radiology",
                 "license_number": "RAD123456",
@@ -1379,7 +5063,7 @@ async def create_demo_users(current_user: User = Depends(get_current_user)):
                 "id": generate_study_id(),
                 "name": "Tech Mike Wilson",
                 "email": "technician@pacs.com",
-                "password": hash_password("tech123"),
+                "password": await hash_password("tech123"),
                 "role": UserRole.TECHNICIAN,
                 "centre_id": centre_data["id"],
                 "created_at": datetime.now(timezone.utc),
@@ -1408,20 +5092,20 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
     
     if current_user.role == UserRole.ADMIN:
         stats["total_centres"] = await db.centres.count_documents({})
-        stats["total_studies"] = await db.studies.count_documents({})
+        stats["total_studies"] = await db.studies.count_documents({"deleted_at": None})
         stats["total_radiologists"] = await db.users.count_documents({"role": UserRole.RADIOLOGIST})
-        stats["pending_studies"] = await db.studies.count_documents({"status": "pending"})
+        stats["pending_studies"] = await db.studies.count_documents({"status": "pending", "deleted_at": None})
         stats["total_revenue"] = await calculate_total_revenue()
         stats["pending_invoices"] = await db.invoices.count_documents({"status": "pending"})
     elif current_user.role == UserRole.CENTRE:
-        stats["total_studies"] = await db.studies.count_documents({"centre_id": current_user.centre_id})
-        stats["pending_studies"] = await db.studies.count_documents({"centre_id": current_user.centre_id, "status": "pending"})
-        stats["completed_studies"] = await db.studies.count_documents({"centre_id": current_user.centre_id, "status": "completed"})
+        stats["total_studies"] = await db.studies.count_documents({"centre_id": current_user.centre_id, "deleted_at": None})
+        stats["pending_studies"] = await db.studies.count_documents({"centre_id": current_user.centre_id, "status": "pending", "deleted_at": None})
+        stats["completed_studies"] = await db.studies.count_documents({"centre_id": current_user.centre_id, "status": "completed", "deleted_at": None})
     elif current_user.role == UserRole.TECHNICIAN:
-        stats["uploaded_studies"] = await db.studies.count_documents({"technician_id": current_user.id})
+        stats["uploaded_studies"] = await db.studies.count_documents({"technician_id": current_user.id, "deleted_at": None})
     elif current_user.role == UserRole.RADIOLOGIST:
-        stats["assigned_studies"] = await db.studies.count_documents({"radiologist_id": current_user.id, "status": "assigned"})
-        stats["completed_studies"] = await db.studies.count_documents({"radiologist_id": current_user.id, "status": "completed"})
+        stats["assigned_studies"] = await db.studies.count_documents({"radiologist_id": current_user.id, "status": "assigned", "deleted_at": None})
+        stats["completed_studies"] = await db.studies.count_documents({"radiologist_id": current_user.id, "status": "completed", "deleted_at": None})
     
     return stats
 
@@ -1430,6 +5114,212 @@ async def calculate_total_revenue():
     invoices = await db.invoices.find({"status": "paid"}).to_list(10000)
     return sum(inv.get("total_amount", 0) for inv in invoices)
 
+# ==================== LIVE UPDATES ====================
+
+class LiveUpdateSubscriber:
+    def __init__(self, user: User, queue_size: int):
+        self.user = user
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # Set when events had to be dropped; the client is told to refetch
+        self.overflowed = False
+
+class LiveUpdateHub:
+    """Fans change-stream events out to the connected clients of this process.
+    
+    One change stream per process watches studies, final_reports and invoices; each event is
+    scoped once and put on the queues of the subscribers allowed to see it. A subscriber that
+    falls behind is cut off with a resync message instead of buffering without bound.
+    """
+    
+    COLLECTIONS = ["studies", "final_reports", "invoices"]
+    
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.available = False
+        self.stats = {"events": 0, "deliveries": 0, "overflows": 0}
+    
+    def subscribe(self, user: User) -> LiveUpdateSubscriber:
+        subscriber = LiveUpdateSubscriber(user, self.queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber: LiveUpdateSubscriber):
+        self.subscribers.discard(subscriber)
+    
+    def publish(self, event: Dict[str, Any], audience):
+        self.stats["events"] += 1
+        for subscriber in list(self.subscribers):
+            if subscriber.overflowed or not audience(subscriber.user):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+                self.stats["deliveries"] += 1
+            except asyncio.QueueFull:
+                subscriber.overflowed = True
+                self.stats["overflows"] += 1
+    
+    async def run(self):
+        """Follow the change stream, resuming after transient errors"""
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": self.COLLECTIONS},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]}
+        }}]
+        resume_token = None
+        while True:
+            try:
+                async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    self.available = True
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        try:
+                            await publish_change(change)
+                        except Exception as e:
+                            logging.warning(f"Failed to publish live update: {e}")
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == 40573:
+                    logging.warning("Live updates disabled: change streams need MongoDB running as a replica set")
+                    self.available = False
+                    return
+                logging.warning(f"Live update stream failed, resuming: {e}")
+                if e.code == 286:  # ChangeStreamHistoryLost
+                    resume_token = None
+            except Exception as e:
+                logging.warning(f"Live update stream failed, resuming: {e}")
+            self.available = False
+            await asyncio.sleep(1)
+
+live_updates = LiveUpdateHub(LIVE_UPDATE_QUEUE_SIZE)
+
+def _scoped_document(model, document: Dict[str, Any]) -> Dict[str, Any]:
+    return jsonable_encoder({field: document.get(field) for field in model.model_fields if field in document})
+
+async def publish_change(change: Dict[str, Any]):
+    """Turn one change event into a client delta and decide who may see it"""
+    collection = change["ns"]["coll"]
+    operation = change["operationType"]
+    document = change.get("fullDocument")
+    
+    if operation == "delete" or document is None:
+        # Deleted documents are gone, so their scope (and id) is unknown; admins are told to refetch
+        live_updates.publish(
+            {"collection": collection, "operation": "delete"},
+            lambda user: user.role == UserRole.ADMIN
+        )
+        return
+    
+    event = {"collection": collection, "operation": operation, "id": document.get("id")}
+    if operation == "update":
+        event["fields"] = sorted((change.get("updateDescription") or {}).get("updatedFields", {}))
+    
+    if collection == "studies":
+        if document.get("deleted_at"):
+            # Tombstoned studies leave every list; clients drop them by id
+            event["operation"] = "delete"
+            event.pop("fields", None)
+        else:
+            event["document"] = _scoped_document(DicomStudy, document)
+        centre_id = document.get("centre_id")
+        
+        # Radiologists read from the shared worklist, so they see every study like GET /studies
+        def audience(user):
+            return user.role in [UserRole.ADMIN, UserRole.RADIOLOGIST] or (
+                user.role in [UserRole.CENTRE, UserRole.TECHNICIAN] and user.centre_id == centre_id
+            )
+    elif collection == "final_reports":
+        event["document"] = _scoped_document(FinalReport, document)
+        study = await db.studies.find_one({"study_id": document.get("study_id")}, {"centre_id": 1}) or {}
+        centre_id, radiologist_id = study.get("centre_id"), document.get("radiologist_id")
+        
+        def audience(user):
+            return user.role == UserRole.ADMIN or (
+                user.role == UserRole.RADIOLOGIST and user.id == radiologist_id
+            ) or (
+                user.role in [UserRole.CENTRE, UserRole.TECHNICIAN] and user.centre_id == centre_id
+            )
+    else:
+        event["document"] = _scoped_document(Invoice, document)
+        centre_id = document.get("centre_id")
+        
+        def audience(user):
+            return user.role == UserRole.ADMIN or (user.role == UserRole.CENTRE and user.centre_id == centre_id)
+    
+    live_updates.publish(event, audience)
+
+@api_router.get("/events")
+async def stream_live_updates(
+    request: Request,
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Server-sent events with scoped deltas of studies, reports and invoices.
+    
+    Browsers' EventSource cannot send headers, so the bearer token may be passed as ?token=.
+    A "resync" event means updates were dropped and the client should refetch. The principal is
+    re-checked every heartbeat interval, and the stream ends once the session is no longer valid.
+    """
+    if credentials is None:
+        if not token:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    user = await get_current_user(request, credentials)
+    if not live_updates.available:
+        raise HTTPException(status_code=503, detail="Live updates are not available")
+    
+    subscriber = live_updates.subscribe(user)
+    
+    async def still_authorized() -> bool:
+        # Deactivation or a role change bumps token_version, which invalidates the token
+        try:
+            subscriber.user = await get_current_user(request, credentials)
+        except HTTPException:
+            return False
+        return True
+    
+    async def events():
+        checked_at = time.monotonic()
+        try:
+            yield f"retry: 3000\nevent: ready\ndata: {json.dumps({'role': user.role})}\n\n"
+            while True:
+                if time.monotonic() - checked_at >= LIVE_UPDATE_HEARTBEAT_SECONDS:
+                    if not await still_authorized():
+                        break
+                    checked_at = time.monotonic()
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), LIVE_UPDATE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if subscriber.overflowed or await request.is_disconnected():
+                        if subscriber.overflowed:
+                            yield "event: resync\ndata: {}\n\n"
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['collection']}\ndata: {json.dumps(event)}\n\n"
+                if subscriber.overflowed and subscriber.queue.empty():
+                    yield "event: resync\ndata: {}\n\n"
+                    break
+        finally:
+            live_updates.unsubscribe(subscriber)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@api_router.get("/admin/live-updates")
+async def get_live_update_stats(current_user: User = Depends(get_current_user)):
+    """Live update channel state in this worker process"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can view live update stats")
+    return {
+        "available": live_updates.available,
+        "subscribers": len(live_updates.subscribers),
+        **live_updates.stats,
+        "worker_pid": os.getpid()
+    }
+
 # ==================== BILLING ROUTES ====================
 
 @api_router.post("/billing/rates", response_model=BillingRate)
@@ -1804,9 +5694,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+embedded_job_workers_stop = asyncio.Event()
+live_updates_task = None
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    embedded_job_workers_stop.set()
+    if live_updates_task:
+        live_updates_task.cancel()
     client.close()
+    cpu_executor.shutdown(wait=False)
+    password_executor.shutdown(wait=False)
 
 @app.on_event("startup")
 async def startup_event():
@@ -1816,7 +5714,7 @@ async def startup_event():
         admin_dict = {
             "id": f"user_{generate_study_id()}",
             "email": "admin@pacs.com",
-            "password": hash_password("admin123"),
+            "password": await hash_password("admin123"),
             "name": "System Administrator",
             "role": UserRole.ADMIN,
             "centre_id": None,
@@ -1825,4 +5723,75 @@ async def startup_event():
             "is_active": True
         }
         await db.users.insert_one(admin_dict)
-        logger.info("Default admin user created: admin@pacs.com / admin123")
\ No newline at end of file
+        logger.info("Default admin user created: admin@pacs.com / admin123")
+    
+    # Indexes
+    await db.image_pyramids.create_index("file_id", unique=True)
+    await db.instances.create_index("file_id", unique=True)
+    await db.instances.create_index([("study_id", 1), ("series_instance_uid", 1)])
+    await db.instances.create_index("sop_instance_uid")
+    await db.metadata_correction_jobs.create_index("id", unique=True)
+    await db.storage_migrations.create_index("id", unique=True)
+    await db.api_keys.create_index("key_hash", unique=True)
+    await db.jobs.create_index("id", unique=True)
+    await db.jobs.create_index([("status", 1), ("priority", -1), ("run_after", 1)])
+    await db.jobs.create_index([("status", 1), ("lease_expires_at", 1)])
+    # At most one pending job per dedupe key. pending_dedupe_key only exists while a job is queued or
+    # running, so the partial filter needs no $in (unsupported before MongoDB 6.0)
+    for old_index in ("dedupe_key_1", "dedupe_key_pending"):
+        try:
+            await db.jobs.drop_index(old_index)
+        except OperationFailure:
+            pass
+    await db.jobs.create_index(
+        "pending_dedupe_key", unique=True, partialFilterExpression={"pending_dedupe_key": {"$type": "string"}}
+    )
+    async for job in db.jobs.find(
+        {"status": {"$in": ["queued", "running"]}, "dedupe_key": {"$type": "string"}, "pending_dedupe_key": {"$exists": False}},
+        {"id": 1, "dedupe_key": 1}
+    ):
+        try:
+            await db.jobs.update_one({"id": job["id"]}, {"$set": {"pending_dedupe_key": job["dedupe_key"]}})
+        except DuplicateKeyError:
+            pass  # An equal job queued before deduplication was atomic; it simply runs once more
+    await db.jobs.create_index(
+        "finished_at", expireAfterSeconds=JOB_RETENTION_DAYS * 86400, partialFilterExpression={"status": "completed"}
+    )
+    # Reference lookups of the blob reconciler
+    await db.instances.create_index("content_sha256")
+    await db.instances.create_index("storage.segments.file_id")
+    await db.blobs.create_index("segments.file_id")
+    await db.image_pyramids.create_index("levels.file_id")
+    await db.studies.create_index("file_ids")
+    # Worklist claims, in SLA deadline order
+    await db.studies.create_index([("status", 1), ("uploaded_at", 1)])
+    await db.studies.create_index([("status", 1), ("sla_deadline", 1), ("uploaded_at", 1)])
+    await db.studies.create_index([("status", 1), ("claim_expires_at", 1)])
+    # Radiologist load and throughput for automatic assignment
+    await db.studies.create_index([("radiologist_id", 1), ("status", 1)])
+    await db.final_reports.create_index([("radiologist_id", 1), ("approved_at", 1)])
+    # Studies from before priorities existed are routine, due one routine SLA after upload
+    await db.studies.update_many(
+        {"sla_deadline": {"$exists": False}, "uploaded_at": {"$type": "date"}},
+        [{"$set": {
+            "priority": {"$ifNull": ["$priority", StudyPriority.ROUTINE]},
+            "sla_deadline": {"$add": ["$uploaded_at", STUDY_SLA_MINUTES[StudyPriority.ROUTINE] * 60 * 1000]}
+        }}]
+    )
+    # Orphaned payment transaction lookups during cleanup
+    await db.invoices.create_index("id")
+    if BLOB_RECONCILE_INTERVAL_HOURS > 0:
+        await schedule_periodic_job("reconcile_blobs", timedelta(hours=BLOB_RECONCILE_INTERVAL_HOURS), {"dry_run": False})
+    if STUDY_CLAIM_LEASE_MINUTES > 0:
+        await schedule_periodic_job("release_study_claims", timedelta(seconds=STUDY_CLAIM_SWEEP_SECONDS))
+    if AUTO_ASSIGN_ENABLED:
+        await schedule_periodic_job("rebalance_assignments", timedelta(seconds=AUTO_ASSIGN_REBALANCE_SECONDS))
+    
+    # Job consumers in this API process
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:api"
+    for i in range(EMBEDDED_JOB_WORKERS):
+        asyncio.create_task(run_job_worker(f"{worker_id}:{i}", embedded_job_workers_stop))
+    
+    if LIVE_UPDATES_ENABLED:
+        global live_updates_task
+        live_updates_task = asyncio.create_task(live_updates.run())
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""Background job worker.
+
+Run from the backend directory with `python -m worker`. It consumes the same Mongo-backed job
+queue as the API (post-upload processing, deletions, metadata corrections, storage
+migrations), so heavy work can run on separate cores or hosts. Set EMBEDDED_JOB_WORKERS=0 on
+the API processes when dedicated workers are deployed.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+
+from server import JOB_HANDLERS, CPU_WORKERS, run_job_worker, client, cpu_executor, password_executor
+
+logger = logging.getLogger("worker")
+
+async def main(concurrency: int, job_types):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Worker {worker_id} running {concurrency} consumers for {', '.join(job_types or JOB_HANDLERS)}")
+    # Consumers finish their current job before exiting; unfinished leases expire and are retried elsewhere
+    await asyncio.gather(*[run_job_worker(f"{worker_id}:{i}", stop, job_types) for i in range(concurrency)])
+    logger.info(f"Worker {worker_id} stopped")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consume the PACS background job queue")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get('JOB_WORKER_CONCURRENCY', CPU_WORKERS)))
+    parser.add_argument("--type", dest="job_types", action="append", choices=sorted(JOB_HANDLERS),
+                        help="Only consume this job type (repeatable)")
+    args = parser.parse_args()
+    
+    try:
+        asyncio.run(main(args.concurrency, args.job_types))
+    finally:
+        client.close()
+        cpu_executor.shutdown(wait=False)
+        password_executor.shutdown(wait=False)
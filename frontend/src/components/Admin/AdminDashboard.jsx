@@ -9,6 +9,7 @@ import { Building2, Users, FileText, Activity, LogOut, Plus, UserCheck, DollarSi
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from "../ui/dialog";
 import { Label } from "../ui/label";
 import AdvancedSearch from "../Search/AdvancedSearch";
+import { applyLiveUpdate, useLiveUpdates } from "../../hooks/use-live-updates";
 
 const Sidebar = ({ logout }) => {
   return (
@@ -79,6 +80,12 @@ const DashboardHome = () => {
     fetchStats();
   }, []);
 
+  // Only aggregates are shown here, so changes just trigger a throttled stats refresh
+  useLiveUpdates({
+    onResync: () => fetchStats(),
+    onSettled: () => fetchStats()
+  }, ["studies", "final_reports"]);
+
   const fetchStats = async () => {
     try {
       const response = await axios.get("/dashboard/stats");
@@ -343,12 +350,20 @@ const RadiologistsManagement = () => {
 
 const StudiesView = () => {
   const [studies, setStudies] = useState([]);
+  const [searching, setSearching] = useState(false);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
     fetchStudies();
   }, []);
 
+  useLiveUpdates({
+    onEvent: (event) => setStudies((current) => applyLiveUpdate(current, event, { insert: !searching })),
+    onResync: () => {
+      if (!searching) fetchStudies();
+    }
+  }, ["studies"]);
+
   const fetchStudies = async () => {
     try {
       const response = await axios.get("/studies");
@@ -364,12 +379,14 @@ const StudiesView = () => {
     try {
       const response = await axios.post("/studies/search", searchParams);
       setStudies(response.data);
+      setSearching(true);
     } catch (error) {
       console.error("Search failed:", error);
     }
   };
 
   const handleSearchReset = () => {
+    setSearching(false);
     fetchStudies();
   };
 
@@ -449,6 +466,13 @@ const BillingManagement = () => {
     }
   }, [activeTab]);
 
+  useLiveUpdates({
+    onEvent: (event) => setInvoices((current) => applyLiveUpdate(current, event)),
+    onResync: () => {
+      if (activeTab === 'invoices') fetchInvoices();
+    }
+  }, ["invoices"]);
+
   const fetchRates = async () => {
     setLoading(true);
     try {
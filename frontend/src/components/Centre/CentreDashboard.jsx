@@ -4,6 +4,7 @@ import axios from "axios";
 import { Button } from "../ui/button";
 import { Card, CardContent } from "../ui/card";
 import { Activity, FileText, Users, LogOut } from "lucide-react";
+import { applyLiveUpdate, useLiveUpdates } from "../../hooks/use-live-updates";
 
 export default function CentreDashboard() {
   const { user, logout } = useContext(AuthContext);
@@ -15,6 +16,15 @@ export default function CentreDashboard() {
     fetchData();
   }, []);
 
+  // Study deltas are applied in place; stats are refreshed at most every few seconds
+  useLiveUpdates({
+    onEvent: (event) => {
+      if (event.collection === "studies") setStudies((current) => applyLiveUpdate(current, event));
+    },
+    onResync: () => fetchData(),
+    onSettled: () => fetchStats()
+  }, ["studies", "final_reports"]);
+
   const fetchData = async () => {
     try {
       const [studiesRes, statsRes] = await Promise.all([
@@ -30,6 +40,15 @@ export default function CentreDashboard() {
     }
   };
 
+  const fetchStats = async () => {
+    try {
+      const response = await axios.get("/dashboard/stats");
+      setStats(response.data);
+    } catch (error) {
+      console.error("Failed to fetch stats:", error);
+    }
+  };
+
   if (loading) {
     return (
       <div className="min-h-screen flex items-center justify-center bg-slate-50">
@@ -10,11 +10,13 @@ import { Label } from "../ui/label";
 import { Textarea } from "../ui/textarea";
 import { Input } from "../ui/input";
 import AdvancedSearch from "../Search/AdvancedSearch";
+import { applyLiveUpdate, useLiveUpdates } from "../../hooks/use-live-updates";
 
 export default function RadiologistDashboard() {
   const { user, logout } = useContext(AuthContext);
   const navigate = useNavigate();
   const [studies, setStudies] = useState([]);
+  const [searching, setSearching] = useState(false);
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(true);
   const [selectedStudy, setSelectedStudy] = useState(null);
@@ -48,6 +50,17 @@ export default function RadiologistDashboard() {
     fetchData();
   }, []);
 
+  // Study deltas are applied in place (search results only take updates); stats are refreshed at most every few seconds
+  useLiveUpdates({
+    onEvent: (event) => {
+      if (event.collection !== "studies") return;
+      setAllStudies((current) => applyLiveUpdate(current, event));
+      setStudies((current) => applyLiveUpdate(current, event, { insert: !searching }));
+    },
+    onResync: () => fetchData(),
+    onSettled: () => fetchStats()
+  }, ["studies", "final_reports"]);
+
   const fetchData = async () => {
     try {
       const [studiesRes, statsRes] = await Promise.all([
@@ -64,16 +77,27 @@ export default function RadiologistDashboard() {
     }
   };
 
+  const fetchStats = async () => {
+    try {
+      const response = await axios.get("/dashboard/stats");
+      setStats(response.data);
+    } catch (error) {
+      console.error("Failed to fetch stats:", error);
+    }
+  };
+
   const handleSearch = async (searchParams) => {
     try {
       const response = await axios.post("/studies/search", searchParams);
       setStudies(response.data);
+      setSearching(true);
     } catch (error) {
       console.error("Search failed:", error);
     }
   };
 
   const handleResetSearch = () => {
+    setSearching(false);
     setStudies(allStudies);
   };
 
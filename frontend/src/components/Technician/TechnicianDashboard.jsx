@@ -9,10 +9,12 @@ import { Activity, Upload, FileText, LogOut } from "lucide-react";
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from "../ui/dialog";
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "../ui/select";
 import AdvancedSearch from "../Search/AdvancedSearch";
+import { applyLiveUpdate, useLiveUpdates } from "../../hooks/use-live-updates";
 
 export default function TechnicianDashboard() {
   const { user, logout } = useContext(AuthContext);
   const [studies, setStudies] = useState([]);
+  const [searching, setSearching] = useState(false);
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(true);
   const [showUploadDialog, setShowUploadDialog] = useState(false);
@@ -22,6 +24,7 @@ export default function TechnicianDashboard() {
     patient_age: "",
     patient_gender: "Male",
     modality: "CT",
+    priority: "routine",
     notes: ""
   });
   const [files, setFiles] = useState([]);
@@ -30,6 +33,17 @@ export default function TechnicianDashboard() {
     fetchData();
   }, []);
 
+  // Study deltas are applied in place (search results only take updates); stats are refreshed at most every few seconds
+  useLiveUpdates({
+    onEvent: (event) => {
+      if (event.collection === "studies") setStudies((current) => applyLiveUpdate(current, event, { insert: !searching }));
+    },
+    onResync: () => {
+      if (!searching) fetchData();
+    },
+    onSettled: () => fetchStats()
+  }, ["studies", "final_reports"]);
+
   const fetchData = async () => {
     try {
       const [studiesRes, statsRes] = await Promise.all([
@@ -45,6 +59,15 @@ export default function TechnicianDashboard() {
     }
   };
 
+  const fetchStats = async () => {
+    try {
+      const response = await axios.get("/dashboard/stats");
+      setStats(response.data);
+    } catch (error) {
+      console.error("Failed to fetch stats:", error);
+    }
+  };
+
   const handleFileSelection = async (selectedFiles) => {
     setFiles(selectedFiles);
     
@@ -91,6 +114,7 @@ export default function TechnicianDashboard() {
       uploadFormData.append("patient_age", formData.patient_age);
       uploadFormData.append("patient_gender", formData.patient_gender);
       uploadFormData.append("modality", formData.modality);
+      uploadFormData.append("priority", formData.priority);
       if (formData.notes) uploadFormData.append("notes", formData.notes);
       
       for (let file of files) {
@@ -102,7 +126,7 @@ export default function TechnicianDashboard() {
       });
 
       setShowUploadDialog(false);
-      setFormData({ patient_name: "", patient_age: "", patient_gender: "Male", modality: "CT", notes: "" });
+      setFormData({ patient_name: "", patient_age: "", patient_gender: "Male", modality: "CT", priority: "routine", notes: "" });
       setFiles([]);
       fetchData();
       alert("Study uploaded successfully!");
@@ -172,6 +196,7 @@ export default function TechnicianDashboard() {
     try {
       const response = await axios.post("/studies/search", searchParams);
       setStudies(response.data);
+      setSearching(true);
     } catch (error) {
       console.error("Search failed:", error);
       alert("Search failed");
@@ -179,6 +204,7 @@ export default function TechnicianDashboard() {
   };
 
   const handleSearchReset = () => {
+    setSearching(false);
     fetchData();
   };
 
@@ -307,6 +333,19 @@ export default function TechnicianDashboard() {
                       </SelectContent>
                     </Select>
                   </div>
+                  <div>
+                    <Label>Priority *</Label>
+                    <Select value={formData.priority} onValueChange={(val) => setFormData({ ...formData, priority: val })}>
+                      <SelectTrigger>
+                        <SelectValue />
+                      </SelectTrigger>
+                      <SelectContent>
+                        <SelectItem value="routine">Routine</SelectItem>
+                        <SelectItem value="urgent">Urgent</SelectItem>
+                        <SelectItem value="stat">STAT</SelectItem>
+                      </SelectContent>
+                    </Select>
+                  </div>
                 </div>
                 <div>
                   <Label>Clinical Notes</Label>
@@ -0,0 +1,74 @@
+import { useEffect, useRef } from "react";
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+
+// Aggregates (dashboard stats) are refreshed at most this often while changes keep arriving
+const SETTLE_INTERVAL_MS = 10000;
+
+// Apply one scoped delta to a list held in state, matching items by `id`. Inserts are
+// skipped for filtered lists (search results), which only take updates and removals.
+export function applyLiveUpdate(items, event, { insert = true } = {}) {
+  if (!event.id) return items;
+  if (event.operation === "delete") return items.filter((item) => item.id !== event.id);
+  if (!event.document) return items;
+  const index = items.findIndex((item) => item.id === event.id);
+  if (index === -1) return insert ? [event.document, ...items] : items;
+  const next = items.slice();
+  next[index] = { ...items[index], ...event.document };
+  return next;
+}
+
+// Server-sent study, report and invoice deltas in the user's scope.
+//   onEvent(event)  - each delta ({collection, operation, id, document}), to apply to local state
+//   onResync()      - updates were dropped or cannot be applied by id: refetch the lists
+//   onSettled()     - something changed; throttled, for aggregates such as dashboard stats
+export function useLiveUpdates({ onEvent, onResync, onSettled }, collections = ["studies", "final_reports", "invoices"]) {
+  const handlersRef = useRef({ onEvent, onResync, onSettled });
+  handlersRef.current = { onEvent, onResync, onSettled };
+  const collectionsKey = collections.join(",");
+
+  useEffect(() => {
+    const token = localStorage.getItem("token");
+    if (!token || typeof EventSource === "undefined") return;
+
+    let resyncTimer = null;
+    let settleTimer = null;
+    const resync = () => {
+      clearTimeout(resyncTimer);
+      resyncTimer = setTimeout(() => handlersRef.current.onResync?.(), 300);
+    };
+    const settle = () => {
+      if (settleTimer) return;
+      settleTimer = setTimeout(() => {
+        settleTimer = null;
+        handlersRef.current.onSettled?.();
+      }, SETTLE_INTERVAL_MS);
+    };
+    const handleEvent = (message) => {
+      const event = JSON.parse(message.data);
+      if (event.operation === "delete" && !event.id) resync();
+      else handlersRef.current.onEvent?.(event);
+      settle();
+    };
+
+    const source = new EventSource(`${BACKEND_URL}/api/events?token=${encodeURIComponent(token)}`);
+    collectionsKey.split(",").forEach((collection) => source.addEventListener(collection, handleEvent));
+    source.addEventListener("resync", () => {
+      resync();
+      settle();
+    });
+    source.onerror = () => {
+      // Unavailable (503) or signed out: stop retrying, the dashboard still loads on demand
+      if (source.readyState === EventSource.CLOSED) {
+        clearTimeout(resyncTimer);
+        clearTimeout(settleTimer);
+      }
+    };
+
+    return () => {
+      clearTimeout(resyncTimer);
+      clearTimeout(settleTimer);
+      source.close();
+    };
+  }, [collectionsKey]);
+}
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+PACS Worklist Claim Concurrency Test
+Hammers PATCH /studies/{id}/assign and POST /studies/claim-next from many threads
+and checks that no study is ever handed to two radiologists.
+Run it against a test deployment only: it claims every pending CT study it can reach.
+"""
+
+import requests
+import sys
+import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+# Configuration
+BASE_URL = "https://medimage.preview.emergentagent.com/api"
+ADMIN_EMAIL = "admin@pacs.com"
+ADMIN_PASSWORD = "admin123"
+TECHNICIAN_EMAIL = "technician@pacs.com"
+TECHNICIAN_PASSWORD = "tech123"
+
+RADIOLOGIST_COUNT = 8
+STUDY_COUNT = 200
+CLAIM_THREADS = 32
+CONTESTED_STUDIES = 20
+
+class WorklistClaimTester:
+    def __init__(self):
+        self.session = requests.Session()
+        self.radiologist_tokens: List[str] = []
+        self.technician_token = None
+        self.study_ids: List[str] = []
+        self.test_results = []
+        self.local = threading.local()
+    
+    def log_test(self, test_name: str, success: bool, message: str, details: Optional[Dict] = None):
+        """Log test result"""
+        result = {
+            "test": test_name,
+            "success": success,
+            "message": message,
+            "details": details or {},
+            "timestamp": datetime.now().isoformat()
+        }
+        self.test_results.append(result)
+        status = "✅ PASS" if success else "❌ FAIL"
+        print(f"{status} {test_name}: {message}")
+        if details and not success:
+            print(f"   Details: {details}")
+    
+    def login(self, email: str, password: str) -> Optional[str]:
+        response = self.session.post(f"{BASE_URL}/auth/login", json={"email": email, "password": password})
+        if response.status_code == 200:
+            return response.json()["access_token"]
+        return None
+    
+    def thread_session(self) -> requests.Session:
+        """One HTTP connection pool per worker thread"""
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+    
+    def setup_users(self) -> bool:
+        """Create the demo technician and a pool of radiologists"""
+        print("\n=== Setting Up Users ===")
+        
+        admin_token = self.login(ADMIN_EMAIL, ADMIN_PASSWORD)
+        if not admin_token:
+            self.log_test("Admin Login", False, "Could not log in as admin")
+            return False
+        self.session.post(f"{BASE_URL}/admin/create-demo-users", headers={"Authorization": f"Bearer {admin_token}"})
+        
+        self.technician_token = self.login(TECHNICIAN_EMAIL, TECHNICIAN_PASSWORD)
+        if not self.technician_token:
+            self.log_test("Technician Login", False, "Could not log in as the demo technician")
+            return False
+        
+        for i in range(RADIOLOGIST_COUNT):
+            email = f"claimtest{i}@pacs.com"
+            self.session.post(f"{BASE_URL}/auth/register", json={
+                "email": email,
+                "password": "claim123",
+                "name": f"Claim Tester {i}",
+                "role": "radiologist"
+            })
+            token = self.login(email, "claim123")
+            if not token:
+                self.log_test("Radiologist Setup", False, f"Could not log in as {email}")
+                return False
+            self.radiologist_tokens.append(token)
+        
+        self.log_test("User Setup", True, f"{RADIOLOGIST_COUNT} radiologists ready")
+        return True
+    
+    def upload_studies(self, count: int) -> List[str]:
+        """Upload small placeholder studies to fill the worklist"""
+        study_ids = []
+        headers = {"Authorization": f"Bearer {self.technician_token}"}
+        for i in range(count):
+            response = self.session.post(
+                f"{BASE_URL}/studies/upload",
+                headers=headers,
+                data={"patient_name": f"Claim^Test^{i}", "patient_age": "40", "patient_gender": "O", "modality": "CT"},
+                files=[("files", (f"claim_test_{i}.txt", b"claim test placeholder"))]
+            )
+            if response.status_code == 200:
+                study_ids.append(response.json()["study_id"])
+        return study_ids
+    
+    def test_contested_assign(self):
+        """Every radiologist tries to claim the same study at the same moment; exactly one may win"""
+        print("\n=== Testing Contested Single-Study Claims ===")
+        
+        study_ids = self.upload_studies(CONTESTED_STUDIES)
+        double_assignments = []
+        
+        def assign(study_id: str, token: str) -> int:
+            response = self.thread_session().patch(
+                f"{BASE_URL}/studies/{study_id}/assign", headers={"Authorization": f"Bearer {token}"}
+            )
+            return response.status_code
+        
+        with ThreadPoolExecutor(max_workers=RADIOLOGIST_COUNT) as executor:
+            for study_id in study_ids:
+                barrier_results = list(executor.map(lambda token: assign(study_id, token), self.radiologist_tokens))
+                winners = barrier_results.count(200)
+                if winners != 1 or barrier_results.count(409) != len(barrier_results) - 1:
+                    double_assignments.append({"study_id": study_id, "statuses": Counter(barrier_results)})
+        
+        self.log_test(
+            "Contested Assign",
+            not double_assignments and len(study_ids) == CONTESTED_STUDIES,
+            f"{len(study_ids)} studies, {RADIOLOGIST_COUNT} simultaneous claims each, {len(double_assignments)} with other than one winner",
+            {"failures": double_assignments[:5]}
+        )
+    
+    def test_claim_next_throughput(self):
+        """Many threads claim the next study until the worklist is empty"""
+        print("\n=== Testing Claim-Next Throughput ===")
+        
+        self.study_ids = self.upload_studies(STUDY_COUNT)
+        self.log_test("Worklist Setup", len(self.study_ids) == STUDY_COUNT, f"Uploaded {len(self.study_ids)} studies")
+        
+        claims: List[Dict[str, Any]] = []
+        errors = Counter()
+        lock = threading.Lock()
+        
+        def claimer(worker: int):
+            token = self.radiologist_tokens[worker % len(self.radiologist_tokens)]
+            while True:
+                response = self.thread_session().post(
+                    f"{BASE_URL}/studies/claim-next",
+                    json={"count": 1, "modality": "CT"},
+                    headers={"Authorization": f"Bearer {token}"}
+                )
+                if response.status_code != 200:
+                    with lock:
+                        errors[response.status_code] += 1
+                    return
+                claimed = response.json()["claimed"]
+                if not claimed:
+                    return
+                with lock:
+                    claims.extend({"study_id": study["study_id"], "worker": worker} for study in claimed)
+        
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=CLAIM_THREADS) as executor:
+            list(executor.map(claimer, range(CLAIM_THREADS)))
+        elapsed = time.perf_counter() - started
+        
+        claimed_ids = Counter(claim["study_id"] for claim in claims)
+        duplicates = {study_id: n for study_id, n in claimed_ids.items() if n > 1}
+        ours = set(self.study_ids)
+        
+        self.log_test("No Double Claims", not duplicates, f"{len(claims)} claims, {len(duplicates)} studies claimed twice",
+                      {"duplicates": dict(list(duplicates.items())[:5])})
+        self.log_test("Worklist Drained", ours <= set(claimed_ids), f"{len(ours & set(claimed_ids))} of {len(ours)} uploaded studies claimed",
+                      {"errors": dict(errors)})
+        self.log_test("Claim Throughput", True, f"{len(claims) / elapsed:.0f} claims/sec with {CLAIM_THREADS} threads ({elapsed:.2f}s)")
+    
+    def run_all_tests(self):
+        print("🚀 Starting Worklist Claim Concurrency Tests")
+        print(f"Base URL: {BASE_URL}")
+        
+        if not self.setup_users():
+            return self.print_summary()
+        
+        self.test_contested_assign()
+        self.test_claim_next_throughput()
+        
+        return self.print_summary()
+    
+    def print_summary(self):
+        """Print test summary"""
+        print("\n" + "="*60)
+        print("🏁 TEST SUMMARY")
+        print("="*60)
+        
+        total_tests = len(self.test_results)
+        passed_tests = sum(1 for result in self.test_results if result["success"])
+        failed_tests = total_tests - passed_tests
+        
+        print(f"Total Tests: {total_tests}")
+        print(f"✅ Passed: {passed_tests}")
+        print(f"❌ Failed: {failed_tests}")
+        
+        if failed_tests > 0:
+            print("\n🔍 FAILED TESTS:")
+            for result in self.test_results:
+                if not result["success"]:
+                    print(f"  ❌ {result['test']}: {result['message']}")
+        
+        print("\n" + "="*60)
+        
+        return failed_tests == 0
+
+if __name__ == "__main__":
+    tester = WorklistClaimTester()
+    success = tester.run_all_tests()
+    sys.exit(0 if success else 1)